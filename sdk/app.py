@@ -1,15 +1,44 @@
 # live_stream_supa.py
+import abc
+import asyncio
+import base64
+import bisect
+import contextlib
+import ctypes
+import ctypes.util
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import mimetypes
 import os
+import posixpath
+import queue
+import random
+import select
+import shutil
+import sqlite3
+import struct
 import subprocess
+import sys
+import tempfile
 import time
 import threading
 import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from urllib.parse import parse_qs, quote, urlsplit
 from dotenv import load_dotenv
 from flask import Flask, send_from_directory, render_template_string, request, jsonify, send_file, Response
 from flask_cors import CORS
-from supabase import create_client, Client
+from storage3 import SyncStorageClient
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from websockets.asyncio.server import broadcast, serve
+from websockets.exceptions import ConnectionClosed
 
 # ---- load config ----
 load_dotenv()
@@ -20,7 +49,25 @@ SUPABASE_BUCKET = os.getenv("SUPABASE_BUCKET", "hls-bucket")  # bucket name
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in environment")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Dedicated storage client for uploads: one keep-alive pool shared by the upload workers
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 4))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", 2))
+storage_http = httpx.Client(
+    limits=httpx.Limits(max_connections=UPLOAD_WORKERS * 2, max_keepalive_connections=UPLOAD_WORKERS * 2, keepalive_expiry=60),
+    timeout=httpx.Timeout(60.0, connect=10.0),
+    follow_redirects=True,
+    http2=True,
+)
+storage_client = SyncStorageClient(
+    f"{SUPABASE_URL.rstrip('/')}/storage/v1/",
+    headers={"apiKey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+    http_client=storage_http,
+)
+storage_bucket = storage_client.from_(SUPABASE_BUCKET)
+
+def public_url_for(remote_path: str) -> str:
+    """Public object URL, built locally: {SUPABASE_URL}/storage/v1/object/public/{BUCKET}/{path}."""
+    return f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/public/{SUPABASE_BUCKET}/{quote(remote_path)}"
 
 # ---- Flask app ----
 app = Flask(__name__)
@@ -33,101 +80,724 @@ HLS_OUTPUT_DIR = os.getenv("HLS_OUTPUT_DIR", "stream")
 CLIPS_DIR = os.getenv("CLIPS_DIR", "clips")
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", ".")
 SEGMENT_PREFIX = "segment_"  # local segment filename prefix
-SEGMENT_PATTERN = f"{SEGMENT_PREFIX}%03d.ts"
+SEGMENT_PATTERN = SEGMENT_PREFIX + "{run}_%03d.ts"  # run id keeps names unique across restarts (segments are cached as immutable)
 PLAYLIST_NAME = "stream.m3u8"
-HLS_TIME = 20
-HLS_LIST_SIZE = 30  # sliding window length
-POLL_INTERVAL = 0.6  # seconds for uploader loop
+# Default stream profile (see StreamProfile); /start_stream can pick a preset or override these per stream
+OUTPUT_FPS = 25  # the live encode is constant frame rate
+HLS_TIME = float(os.getenv("HLS_TIME", 20))  # segment length
+HLS_KEYFRAME_SEC = os.getenv("HLS_KEYFRAME_SEC")  # forced keyframe cadence, must divide HLS_TIME (default: HLS_TIME)
+HLS_GOP_FRAMES = os.getenv("HLS_GOP_FRAMES")  # max frames between keyframes (default: cadence, at most X264_KEYINT)
+X264_KEYINT = 250  # libx264's own default max GOP
+HLS_SCENECUT = os.getenv("HLS_SCENECUT", "1").lower() in ("1", "true", "yes")  # extra keyframes on scene changes
+HLS_LIST_SIZE = int(os.getenv("HLS_LIST_SIZE", 30))  # sliding window length
+# Adaptive bitrate ladder: comma-separated rendition heights (e.g. "1080,720,480,360"). The source is decoded once
+# and split into one scaled encode per height, each under HLS_OUTPUT_DIR/<height>p/ with PLAYLIST_NAME as the
+# master playlist. Empty keeps the single full-resolution rendition.
+ABR_LADDER = os.getenv("ABR_LADDER", "")
+ABR_MAX_BITRATES = {2160: 14000, 1440: 9000, 1080: 5000, 720: 2800, 540: 1800, 480: 1400, 360: 800, 240: 400}  # kbit/s caps
+VARIANT_PLAYLIST_NAME = "index.m3u8"
+# Low-latency HLS: ffmpeg cuts LL_PART_SEC fMP4 parts (one keyframe each) into LL_PARTS_PLAYLIST and the server
+# groups every LL_PARTS_PER_SEGMENT parts into a segment, serving PLAYLIST_NAME with EXT-X-PART entries, a preload
+# hint and blocking reloads (_HLS_msn / _HLS_part). Not combined with ABR_LADDER. These two are the default
+# profile's keyframe_sec and segment_sec in this mode (HLS_TIME / HLS_KEYFRAME_SEC / HLS_GOP_FRAMES are unused).
+LL_HLS = os.getenv("LL_HLS", "0").lower() in ("1", "true", "yes")
+LL_PART_SEC = float(os.getenv("LL_PART_SEC", 1.0))
+LL_PARTS_PER_SEGMENT = int(os.getenv("LL_PARTS_PER_SEGMENT", 4))
+LL_PART_WINDOW = 3  # newest segments whose parts stay listed in the playlist
+LL_PARTS_PLAYLIST = "parts.m3u8"  # ffmpeg's own playlist of parts, never served
+LL_PART_PATTERN = "part_{run}_%d.m4s"
+LIVE_MEDIA_SUFFIXES = (".ts", ".m4s", ".mp4")  # files the uploader pushes (.mp4: fMP4 init segments)
+POLL_INTERVAL = 0.6  # seconds for uploader loop (polling fallback when inotify is unavailable)
+LIVE_CACHE_MAX_BYTES = int(os.getenv("LIVE_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # /live proxy cache budget
+LIVE_PLAYLIST_TTL_SEC = float(os.getenv("LIVE_PLAYLIST_TTL_SEC", 1.0))
+LIVE_SEGMENT_TTL_SEC = float(os.getenv("LIVE_SEGMENT_TTL_SEC", 24 * 3600))
+LIVE_NEGATIVE_TTL_SEC = 0.5  # errors/404s (e.g. a segment not uploaded yet) are only coalesced briefly
+LIVE_POOL_SIZE = int(os.getenv("LIVE_POOL_SIZE", 32))  # keep-alive connections to storage for /live
+LIVE_CHUNK_BYTES = 64 * 1024
+DVR_DIR = os.getenv("DVR_DIR", "dvr")  # local segment ring kept after segments leave the live playlist
+DVR_MAX_BYTES = int(os.getenv("DVR_MAX_BYTES", 2 * 1024 ** 3))
+DVR_MAX_AGE_SEC = int(os.getenv("DVR_MAX_AGE_SEC", 3 * 3600))
 REACTION_WINDOW_SEC = float(os.getenv("REACTION_WINDOW_SEC", 3))
 REACTION_THRESHOLD = int(os.getenv("REACTION_THRESHOLD", 1))
+REACTION_BUCKET_SEC = float(os.getenv("REACTION_BUCKET_SEC", 0.25))  # aggregation granularity inside the window
+REACTION_TYPES = ("heart", "dislike")
+REACT_BATCH_MAX = int(os.getenv("REACT_BATCH_MAX", 1000))  # events accepted per /react/batch request
+WS_PORT = int(os.getenv("WS_PORT", 5002))  # realtime WebSocket channel; 0 disables it (SSE on /events still works)
+REALTIME_COUNTS_INTERVAL_SEC = float(os.getenv("REALTIME_COUNTS_INTERVAL_SEC", 0.25))  # counts push cadence
+SSE_QUEUE_SIZE = 256  # events buffered per SSE client; a slow client loses the oldest
+WS_INBOUND_MAX = int(os.getenv("WS_INBOUND_MAX", 10 * REACT_BATCH_MAX))  # WebSocket reactions awaiting ingest; more are dropped
+# Unique-user counting: "exact" (per-user map) or "hll" (fixed-memory HyperLogLog per bucket).
+# HLL standard error is 1.04 / sqrt(2 ** HLL_PRECISION): p=10 ~3.3%, p=12 ~1.6%, p=14 ~0.8%.
+REACTION_COUNTER = os.getenv("REACTION_COUNTER", "exact").lower()
+HLL_PRECISION = int(os.getenv("HLL_PRECISION", 12))
+HLL_T_SAMPLE = int(os.getenv("HLL_T_SAMPLE", 256))  # reservoir of client 't' values kept per bucket in hll mode
+# Clip bounds from quantiles of the client-reported 't' values in the window: end at CLIP_END_QUANTILE,
+# start CLIP_BACK_SECONDS before CLIP_START_QUANTILE (e.g. 0.25 / 0.75 to widen clips for spread-out reactions)
+CLIP_END_QUANTILE = float(os.getenv("CLIP_END_QUANTILE", 0.5))
+CLIP_START_QUANTILE = float(os.getenv("CLIP_START_QUANTILE", CLIP_END_QUANTILE))
+if REACTION_COUNTER not in ("exact", "hll"):
+    raise RuntimeError("REACTION_COUNTER must be 'exact' or 'hll'")
+if not 4 <= HLL_PRECISION <= 16:
+    raise RuntimeError("HLL_PRECISION must be between 4 and 16")
+if not (0.0 <= CLIP_START_QUANTILE <= 1.0 and 0.0 <= CLIP_END_QUANTILE <= 1.0):
+    raise RuntimeError("CLIP_START_QUANTILE and CLIP_END_QUANTILE must be between 0 and 1")
+REACTION_QUANTILES = tuple(sorted({CLIP_START_QUANTILE, CLIP_END_QUANTILE}))
+# Where reaction windows live: "memory" (this process only), "shm" (a shared-memory segment used by every
+# worker on the host) or "redis" (REDIS_URL, shared across hosts; "memory://" is an in-process stand-in).
+# shm and redis always count unique users approximately (HyperLogLog), whatever REACTION_COUNTER says.
+REACTION_BACKEND = os.getenv("REACTION_BACKEND", "memory").lower()
+REACTION_SHM_NAME = os.getenv("REACTION_SHM_NAME", "autoclip_reactions")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "autoclip:")
+if REACTION_BACKEND not in ("memory", "shm", "redis"):
+    raise RuntimeError("REACTION_BACKEND must be 'memory', 'shm' or 'redis'")
 CLIP_BACK_SECONDS = int(os.getenv("CLIP_BACK_SECONDS", 30))
+CLIP_FRAME_ACCURATE = os.getenv("CLIP_FRAME_ACCURATE", "0").lower() in ("1", "true", "yes")  # re-encode partial GOPs at clip edges
+CLIP_WORKERS = int(os.getenv("CLIP_WORKERS", 2))  # concurrent ffmpeg clip jobs
+CLIP_QUEUE_SIZE = int(os.getenv("CLIP_QUEUE_SIZE", 16))  # pending jobs before /react answers 503
+CLIP_JOB_TTL_SEC = int(os.getenv("CLIP_JOB_TTL_SEC", 3600))  # how long finished jobs stay queryable
+# Hot moments of the same reaction within CLIP_COOLDOWN_SEC of the last one are merged into its clip while that
+# job is still queued (up to CLIP_MAX_SECONDS long), and dropped once it is being cut
+CLIPS_DB_PATH = os.getenv("CLIPS_DB_PATH", "clips.db")  # local clip catalogue (SQLite)
+CLIP_CATALOG_REFRESH_SEC = int(os.getenv("CLIP_CATALOG_REFRESH_SEC", 300))  # background re-sync with storage
+CLIPS_PAGE_SIZE = 50
+CLIPS_MAX_PAGE_SIZE = 500
+CLIP_LIST_PAGE = 1000  # objects per storage list call during a refresh
+CLIP_COOLDOWN_SEC = float(os.getenv("CLIP_COOLDOWN_SEC", 30))
+CLIP_MAX_SECONDS = float(os.getenv("CLIP_MAX_SECONDS", 120))
+
+def _parse_abr_ladder(spec: str):
+    """[(height, max kbit/s)] from ABR_LADDER, tallest first."""
+    heights = set()
+    for part in spec.split(","):
+        part = part.strip().lower().rstrip("p")
+        if not part:
+            continue
+        if not part.isdigit() or int(part) not in ABR_MAX_BITRATES:
+            raise RuntimeError(f"ABR_LADDER heights must be among {sorted(ABR_MAX_BITRATES)}, got {part!r}")
+        heights.add(int(part))
+    return [(h, ABR_MAX_BITRATES[h]) for h in sorted(heights, reverse=True)]
+
+ABR_RENDITIONS = _parse_abr_ladder(ABR_LADDER)
+ABR_VARIANTS = [f"{h}p" for h, _ in ABR_RENDITIONS]  # variant directory names under HLS_OUTPUT_DIR
+# media playlists ffmpeg writes, relative to HLS_OUTPUT_DIR; the first one (top rendition) feeds the clip engine
+MEDIA_PLAYLISTS = [f"{v}/{VARIANT_PLAYLIST_NAME}" for v in ABR_VARIANTS] or [PLAYLIST_NAME]
+if LL_HLS and ABR_VARIANTS:
+    raise RuntimeError("LL_HLS cannot be combined with ABR_LADDER")
+# Transcode bypass: sources that are already H.264 (yuv420p, <= the height/bitrate caps) with keyframes at least as
+# often as the stream profile needs are segmented with -c copy; non-AAC audio alone is re-encoded. ABR always encodes.
+TRANSCODE_BYPASS = os.getenv("TRANSCODE_BYPASS", "1").lower() in ("1", "true", "yes")
+TRANSCODE_BYPASS_MAX_KBPS = int(os.getenv("TRANSCODE_BYPASS_MAX_KBPS", 8000))
+TRANSCODE_BYPASS_MAX_HEIGHT = int(os.getenv("TRANSCODE_BYPASS_MAX_HEIGHT", 1080))
+TRANSCODE_PROBE_SEC = float(os.getenv("TRANSCODE_PROBE_SEC", 60))  # keyframe spacing is read from this much input
+BYPASS_H264_PROFILES = ("Constrained Baseline", "Baseline", "Main", "High")
+# Stream registry: channels started by POST /streams run next to the default one while the host has CPU headroom
+DEFAULT_STREAM_ID = "default"  # /start_stream, unprefixed /live and /stream paths, reactions without ?stream=
+STREAMS_DIR = os.getenv("STREAMS_DIR", "streams")  # local HLS output of the other streams, one directory each
+STREAM_MAX_COUNT = int(os.getenv("STREAM_MAX_COUNT", 32))  # streams per process, the default one included
+STREAM_CPU_MAX_UTIL = float(os.getenv("STREAM_CPU_MAX_UTIL", 0.85))  # share of the host's cores streams may fill
+STREAM_CPU_COST_ENCODE = float(os.getenv("STREAM_CPU_COST_ENCODE", 1.0))  # expected cores per encoded rendition
+STREAM_CPU_COST_COPY = float(os.getenv("STREAM_CPU_COST_COPY", 0.1))  # expected cores for a copy / copy-video remux
+STREAM_CPU_SETTLE_SEC = 15  # a new encoder is not trusted to show in the measured host load before this
+STREAM_CPU_SAMPLE_SEC = float(os.getenv("STREAM_CPU_SAMPLE_SEC", 1.0))  # host load sampling period (background)
+STREAM_ID_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789-_"
 
 # ---- state ----
-CURRENT_FFMPEG_PROCESS = None
-CURRENT_VIDEO_SOURCE = VIDEO_SOURCE
-CURRENT_INPUT_HEADERS = None  # list of header lines like ["Authorization: Bearer ..."] or None
-
-# In-memory reaction aggregation: {reaction_type: [ {time: server_ts, user_id: str, t: float} ]}
-REACTION_EVENTS = {
-    "heart": [],
-    "dislike": [],
-}
+# Per-stream state (ffmpeg process, source, profile, segment index, ...) lives on LiveStream objects in STREAMS
+
+# Clip jobs: {job_id: {id, status: queued|processing|ready|failed, start, end, reaction, ...}}
+CLIP_JOBS = {}
+CLIP_JOBS_LOCK = threading.Lock()
+CLIP_JOB_QUEUE = queue.Queue(maxsize=CLIP_QUEUE_SIZE)
 
 # create directories
 os.makedirs(HLS_OUTPUT_DIR, exist_ok=True)
+for _variant in ABR_VARIANTS:
+    os.makedirs(os.path.join(HLS_OUTPUT_DIR, _variant), exist_ok=True)
 os.makedirs(CLIPS_DIR, exist_ok=True)
+os.makedirs(DVR_DIR, exist_ok=True)
+os.makedirs(STREAMS_DIR, exist_ok=True)
 
 # Ensure permissive CORS headers (in addition to flask-cors defaults)
 @app.after_request
 def add_cors_headers(response):
     response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers.setdefault("Access-Control-Allow-Headers", "Content-Type, Authorization")
+    response.headers.setdefault("Access-Control-Allow-Headers", "Content-Type, Authorization, Range, If-None-Match, If-Modified-Since")
     response.headers.setdefault("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-    response.headers.setdefault("Access-Control-Expose-Headers", "Content-Type, Content-Disposition")
+    response.headers.setdefault("Access-Control-Expose-Headers", "Content-Type, Content-Disposition, Content-Range, ETag, X-Cache")
     response.headers.setdefault("Access-Control-Max-Age", "86400")
     return response
 
+# ---- /live edge cache: byte-bounded LRU with TTLs and request coalescing ----
+class LiveCache:
+    """
+    In-process cache for upstream storage responses. Concurrent misses for the
+    same key are coalesced: acquire() makes the first caller the leader that goes
+    upstream, the others wait() for the entry it complete()s, so upstream load is
+    O(1) per object instead of O(viewers).
+    Entries are dicts {status, content_type, etag, last_modified, body, expires}.
+    """
+
+    def __init__(self, max_bytes: int, inflight_timeout: float = 30.0):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max(1, max_bytes // 8)
+        self.inflight_timeout = inflight_timeout
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> entry, least recently used first
+        self._bytes = 0
+        self._inflight = {}  # key -> token {"event", "entry", "started", "done"}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def acquire(self, key: str, lead: bool = True):
+        """
+        ('HIT', entry) for a fresh entry, ('LEAD', token) if the caller must fetch and
+        complete(), ('WAIT', token) if another caller is fetching, or ('MISS', None)
+        when lead=False and nothing usable is cached or in flight.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry["expires"] > now:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return "HIT", entry
+            token = self._inflight.get(key)
+            if token is not None and now - token["started"] < self.inflight_timeout:
+                self.coalesced += 1
+                return "WAIT", token
+            self.misses += 1
+            if not lead:
+                return "MISS", None
+            # a leader that never completed is taken over after inflight_timeout
+            token = {"event": threading.Event(), "entry": None, "started": now, "done": False}
+            self._inflight[key] = token
+            return "LEAD", token
+
+    def wait(self, token: dict):
+        """Entry fetched by the leader, or None if it failed or was not cacheable."""
+        token["event"].wait(timeout=self.inflight_timeout)
+        return token["entry"]
+
+    def complete(self, key: str, token: dict, entry, ttl: float):
+        """Publish the leader's result (None = not cacheable / failed). Safe to call twice."""
+        with self._lock:
+            if token["done"]:
+                return
+            token["done"] = True
+            if self._inflight.get(key) is token:
+                del self._inflight[key]
+        if entry is not None:
+            entry["expires"] = time.time() + (ttl if entry["status"] == 200 else min(ttl, LIVE_NEGATIVE_TTL_SEC))
+            self._store(key, entry)
+        token["entry"] = entry
+        token["event"].set()
+
+    def _store(self, key: str, entry: dict):
+        size = len(entry["body"])
+        if size > self.max_item_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old["body"])
+            self._items[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted["body"])
+
+    def clear(self, match=None):
+        """Drop every entry, or only those whose key match(key) accepts."""
+        with self._lock:
+            if match is None:
+                self._items.clear()
+                self._bytes = 0
+                return
+            for key in [k for k in self._items if match(k)]:
+                self._bytes -= len(self._items.pop(key)["body"])
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+
+LIVE_CACHE = LiveCache(LIVE_CACHE_MAX_BYTES)
+
+# Pooled keep-alive session for upstream storage reads
+live_session = requests.Session()
+_live_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LIVE_POOL_SIZE)
+live_session.mount("https://", _live_adapter)
+live_session.mount("http://", _live_adapter)
+
+FORWARDED_REQUEST_HEADERS = ("Range", "If-None-Match", "If-Modified-Since")
+PASSTHROUGH_RESPONSE_HEADERS = ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified")
+
+def _open_live(filename: str, headers: dict = None):
+    url = public_url_for(f"live/{filename}")
+    return live_session.get(url, headers=headers or None, stream=True, timeout=(5, 20))
+
+def _live_cache_control(status: int, is_playlist: bool) -> str:
+    if status not in (200, 206, 304):
+        return "no-cache, no-store, must-revalidate"
+    if is_playlist:
+        # playlist changes every segment: let browsers/CDNs hold it for at most the cache TTL
+        return f"public, max-age={max(1, int(LIVE_PLAYLIST_TTL_SEC))}"
+    # segment names are unique per stream run, so their bytes never change
+    return f"public, max-age={int(LIVE_SEGMENT_TTL_SEC)}, immutable"
+
+def _cached_live_response(entry: dict, source: str, is_playlist: bool):
+    headers = {"X-Cache": source, "Cache-Control": _live_cache_control(entry["status"], is_playlist)}
+    # Pass through content-type if present
+    if entry["content_type"]:
+        headers["Content-Type"] = entry["content_type"]
+    if entry["etag"]:
+        headers["ETag"] = entry["etag"]
+    if entry["last_modified"]:
+        headers["Last-Modified"] = entry["last_modified"]
+    resp = Response(entry["body"], status=entry["status"], headers=headers)
+    if entry["status"] != 200:
+        return resp
+    if not entry["etag"]:
+        resp.add_etag()
+    # answers If-None-Match / If-Modified-Since with 304 and Range with 206 from memory
+    return resp.make_conditional(request, accept_ranges=True, complete_length=len(entry["body"]))
+
+def _relay_live(r, source: str, is_playlist: bool):
+    """Stream an upstream response to the client chunk by chunk."""
+    headers = {h: r.headers[h] for h in PASSTHROUGH_RESPONSE_HEADERS if h in r.headers}
+    headers["X-Cache"] = source
+    headers["Cache-Control"] = _live_cache_control(r.status_code, is_playlist)
+    resp = Response(r.iter_content(LIVE_CHUNK_BYTES), status=r.status_code, headers=headers)
+    resp.call_on_close(r.close)
+    return resp
+
+def _lead_live_fetch(filename: str, token: dict, ttl: float, is_playlist: bool, cache_key: str = None):
+    """Fetch as cache leader: stream to this client while filling the cache for the waiters."""
+    cache_key = cache_key or filename
+    try:
+        r = _open_live(filename)
+    except Exception:
+        LIVE_CACHE.complete(cache_key, token, None, ttl)
+        raise
+    entry = {
+        "status": r.status_code,
+        "content_type": r.headers.get("Content-Type"),
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "body": b"",
+    }
+    if r.status_code != 200:
+        entry["body"] = r.content
+        r.close()
+        LIVE_CACHE.complete(cache_key, token, entry, ttl)
+        return _cached_live_response(entry, "MISS", is_playlist)
+    if int(r.headers.get("Content-Length") or 0) > LIVE_CACHE.max_item_bytes:
+        # too large to cache: waiters fetch their own copy
+        LIVE_CACHE.complete(cache_key, token, None, ttl)
+        return _relay_live(r, "BYPASS", is_playlist)
+
+    def generate():
+        chunks, done = [], False
+        try:
+            for chunk in r.iter_content(LIVE_CHUNK_BYTES):
+                chunks.append(chunk)
+                yield chunk
+            done = True
+        finally:
+            if not done:
+                # our client went away: finish the download for the coalesced waiters
+                try:
+                    for chunk in r.iter_content(LIVE_CHUNK_BYTES):
+                        chunks.append(chunk)
+                    done = True
+                except Exception:
+                    pass
+            r.close()
+            entry["body"] = b"".join(chunks)
+            LIVE_CACHE.complete(cache_key, token, entry if done else None, ttl)
+
+    headers = {h: r.headers[h] for h in PASSTHROUGH_RESPONSE_HEADERS if h in r.headers}
+    headers["X-Cache"] = "MISS"
+    headers["Cache-Control"] = _live_cache_control(200, is_playlist)
+    resp = Response(generate(), status=200, headers=headers)
+    # if the response is closed before the body is iterated, don't leave waiters hanging
+    resp.call_on_close(lambda: LIVE_CACHE.complete(cache_key, token, None, ttl))
+    return resp
+
+def _ll_hold(stream, filename: str, published: bool):
+    """
+    LL-HLS blocking reload. A playlist request with _HLS_msn (and _HLS_part) or a request
+    for a part that is not out yet (the preload hint) is held until the stream's playlist
+    lists it, up to three target durations. filename is relative to the stream.
+    Returns (error response or None, awaited position or None).
+    """
+    if filename == PLAYLIST_NAME:
+        if "_HLS_msn" not in request.args:
+            if "_HLS_part" in request.args:
+                return (jsonify({"error": "_HLS_part requires _HLS_msn"}), 400), None
+            return None, None
+        try:
+            msn = int(request.args["_HLS_msn"])
+            part = int(request.args["_HLS_part"]) if "_HLS_part" in request.args else None
+        except ValueError:
+            return (jsonify({"error": "_HLS_msn and _HLS_part must be integers"}), 400), None
+        # without a part, wait for the whole segment: the next one has no parts out yet
+        target = (msn, part) if part is not None else (msn + 1, -1)
+    else:
+        target = stream.ll.part_position(posixpath.basename(filename))
+        if target is None:
+            return None, None
+    if target[0] > stream.ll.position(published)[0] + 2:
+        return (jsonify({"error": "Requested media sequence is too far ahead of the live edge"}), 400), None
+    if not stream.ll.wait_for(target, published, timeout=3 * stream.profile.segment_sec):
+        return (jsonify({"error": "Timed out waiting for the live edge"}), 503), None
+    return None, target
+
+def _stream_for_path(filename: str):
+    """(stream, path inside it) for /live and /stream paths: streams/<id>/... or the default stream's files."""
+    if filename.startswith("streams/"):
+        _, stream_id, rest = (filename.split("/", 2) + ["", ""])[:3]
+        return STREAMS.get(stream_id), rest
+    return STREAMS.get(DEFAULT_STREAM_ID), filename
+
+def _live_path_ok(filename: str) -> bool:
+    """Only a stream's live objects: a top-level file or one inside an ABR variant directory."""
+    parts = filename.split("/")
+    if any(p in ("", ".", "..") for p in parts):
+        return False
+    return len(parts) == 1 or (len(parts) == 2 and parts[0] in ABR_VARIANTS)
+
 @app.route("/live/<path:filename>", methods=["GET"])
 def proxy_live(filename):
+    stream, rel = _stream_for_path(filename)
+    if stream is None or not _live_path_ok(rel):
+        return jsonify({"error": "Not found"}), 404
+    cache_key = filename
+    if LL_HLS:
+        # blocking reload: wait until the requested part is published to storage
+        held, target = _ll_hold(stream, rel, published=True)
+        if held is not None:
+            return held
+        if target is not None and rel == PLAYLIST_NAME:
+            # everyone blocked on the same part shares one fetch made after it was published
+            cache_key = f"{filename}?{target[0]}.{target[1]}"
     try:
-        # Build public storage URL: {SUPABASE_URL}/storage/v1/object/public/{BUCKET}/live/{filename}
-        base = SUPABASE_URL.rstrip("/")
-        url = f"{base}/storage/v1/object/public/{SUPABASE_BUCKET}/live/{filename}"
-        r = requests.get(url, timeout=20)
-        # Pass through content-type if present
-        headers = {}
-        ctype = r.headers.get("Content-Type")
-        if ctype:
-            headers["Content-Type"] = ctype
-        # avoid caching playlist/segments
-        headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        headers["Pragma"] = "no-cache"
-        headers["Expires"] = "0"
-        return Response(r.content, status=r.status_code, headers=headers)
+        is_playlist = filename.endswith(".m3u8")
+        ttl = LIVE_PLAYLIST_TTL_SEC if is_playlist else LIVE_SEGMENT_TTL_SEC
+        forwarded = {h: request.headers[h] for h in FORWARDED_REQUEST_HEADERS if h in request.headers}
+        # Range / conditional requests are answered from a fresh cache entry, but never lead a cache fill
+        state, value = LIVE_CACHE.acquire(cache_key, lead=not forwarded)
+        if state == "HIT":
+            return _cached_live_response(value, "HIT", is_playlist)
+        if state == "WAIT":
+            entry = LIVE_CACHE.wait(value)
+            if entry is not None:
+                return _cached_live_response(entry, "COALESCED", is_playlist)
+        elif state == "LEAD":
+            return _lead_live_fetch(filename, value, ttl, is_playlist, cache_key=cache_key)
+        return _relay_live(_open_live(filename, forwarded), "BYPASS", is_playlist)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route("/clips", methods=["GET"])
-def list_clips():
+# ---- clip catalogue: clip metadata store, so listing never calls storage ----
+def _storage_time(value):
+    """Epoch seconds from a storage timestamp like 2025-01-01T12:00:00.000Z (None if unparsable)."""
     try:
-        # Attempt to list objects in 'clips/' folder from the configured bucket
-        items = []
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+class ClipStore(abc.ABC):
+    """
+    Clip metadata shaped like the PRD's `clips` collection (clipId, fileName,
+    filePath, startTime, endTime, reaction, engagementCount, status, created).
+    Listing is newest first with keyset cursors over (created, clip_id), so a
+    page costs the same however many clips exist.
+    """
+
+    FIELDS = ("clip_id", "file_name", "file_path", "start_time", "end_time", "reaction",
+              "engagement_count", "status", "created", "updated", "size")
+
+    @staticmethod
+    def encode_cursor(clip: dict) -> str:
+        raw = json.dumps([clip["created"], clip["clip_id"]]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        """(created, clip_id) from a cursor; ValueError if it is malformed."""
         try:
-            # supabase-py list signature differs across versions; handle common patterns
+            created, clip_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            return float(created), str(clip_id)
+        except Exception:
+            raise ValueError("invalid cursor")
+
+    @abc.abstractmethod
+    def put(self, clips):
+        """Insert or replace clips (dicts with FIELDS) by clip_id."""
+
+    @abc.abstractmethod
+    def delete(self, clip_ids):
+        """Remove clips by id."""
+
+    @abc.abstractmethod
+    def prune(self, before: float, statuses):
+        """Remove clips in the given statuses created before `before`."""
+
+    @abc.abstractmethod
+    def stored_files(self):
+        """{file_path: clip} for every clip that has a file in storage."""
+
+    @abc.abstractmethod
+    def list(self, limit: int, cursor: str = None, reaction: str = None, statuses=("ready",),
+             since: float = None, until: float = None):
+        """(clips newest first, next cursor or None), filtered by reaction, status and created range."""
+
+    @abc.abstractmethod
+    def version(self) -> int:
+        """Changes on every write (from any process sharing the store)."""
+
+class SQLiteClipStore(ClipStore):
+    """ClipStore in a local SQLite file (WAL, so gunicorn workers can share it)."""
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS clips ("
+        "clip_id TEXT PRIMARY KEY, file_name TEXT, file_path TEXT UNIQUE, start_time REAL, end_time REAL, "
+        "reaction TEXT, engagement_count INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, "
+        "created REAL NOT NULL, updated REAL, size INTEGER)"
+    )
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._migrate()
+            self._db.execute(self._SCHEMA)
+            self._db.execute("CREATE INDEX IF NOT EXISTS clips_created ON clips (created, clip_id)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS clips_reaction_created ON clips (reaction, created, clip_id)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS clips_meta (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+            self._db.execute("INSERT OR IGNORE INTO clips_meta (id, version) VALUES (1, 0)")
+
+    def _migrate(self):
+        # the first catalogue keyed clips by storage path; carry its rows over as ready clips
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(clips)")]
+        if columns and "clip_id" not in columns:
+            self._db.execute("ALTER TABLE clips RENAME TO clips_v1")
+            self._db.execute(self._SCHEMA)
+            self._db.execute(
+                "INSERT INTO clips SELECT CASE WHEN name LIKE '%.mp4' THEN substr(name, 1, length(name) - 4) ELSE name END, "
+                "name, path, start, \"end\", reaction, COALESCE(engagement_count, 0), "
+                "'ready', COALESCE(created, 0), created, size FROM clips_v1"
+            )
+            self._db.execute("DROP TABLE clips_v1")
+
+    def _bump(self):
+        self._db.execute("UPDATE clips_meta SET version = version + 1 WHERE id = 1")
+
+    def put(self, clips):
+        rows = [[clip.get(f) for f in self.FIELDS] for clip in clips]
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO clips ({', '.join(self.FIELDS)}) VALUES ({', '.join('?' * len(self.FIELDS))})",
+                rows,
+            )
+            self._bump()
+
+    def delete(self, clip_ids):
+        clip_ids = list(clip_ids)
+        if not clip_ids:
+            return
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM clips WHERE clip_id = ?", [(c,) for c in clip_ids])
+            self._bump()
+
+    def prune(self, before: float, statuses):
+        statuses = list(statuses)
+        with self._lock, self._db:
+            cur = self._db.execute(
+                f"DELETE FROM clips WHERE created < ? AND status IN ({', '.join('?' * len(statuses))})",
+                [before, *statuses],
+            )
+            if cur.rowcount:
+                self._bump()
+
+    def _rows(self, cur):
+        return [dict(zip(self.FIELDS, row)) for row in cur.fetchall()]
+
+    def stored_files(self):
+        with self._lock:
+            cur = self._db.execute(f"SELECT {', '.join(self.FIELDS)} FROM clips WHERE file_path IS NOT NULL")
+            return {clip["file_path"]: clip for clip in self._rows(cur)}
+
+    def list(self, limit: int, cursor: str = None, reaction: str = None, statuses=("ready",),
+             since: float = None, until: float = None):
+        where, params = [], []
+        if reaction:
+            where.append("reaction = ?")
+            params.append(reaction)
+        if statuses:
+            where.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if since is not None:
+            where.append("created >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created < ?")
+            params.append(until)
+        if cursor:
+            where.append("(created, clip_id) < (?, ?)")
+            params.extend(self.decode_cursor(cursor))
+        sql = f"SELECT {', '.join(self.FIELDS)} FROM clips"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created DESC, clip_id DESC LIMIT ?"
+        with self._lock:
+            clips = self._rows(self._db.execute(sql, [*params, limit + 1]))
+        next_cursor = self.encode_cursor(clips[limit - 1]) if len(clips) > limit else None
+        return clips[:limit], next_cursor
+
+    def version(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT version FROM clips_meta WHERE id = 1").fetchone()[0]
+
+class ClipCatalog:
+    """
+    Keeps a ClipStore in step with clip jobs and with storage. Jobs are recorded
+    at every status change; a background thread re-lists clips/ every
+    CLIP_CATALOG_REFRESH_SEC to pick up uploads from elsewhere, drop deleted
+    objects and prune jobs that never finished.
+    """
+
+    def __init__(self, store: ClipStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def track_job(self, job: dict):
+        path = job.get("path")
+        self.store.put([{
+            "clip_id": job["id"],
+            "file_name": os.path.basename(path) if path else None,
+            "file_path": path,
+            "start_time": job["start"],
+            "end_time": job["end"],
+            "reaction": job["reaction"],
+            "engagement_count": job["engagement_count"],
+            "status": job["status"],
+            "created": job["created"],
+            "updated": job["updated"],
+            "size": job.get("size"),
+        }])
+
+    def _list_storage(self):
+        """All objects under clips/, fetched in pages (the storage API returns 100 per call by default)."""
+        objects, offset = [], 0
+        while True:
+            batch = storage_bucket.list("clips", {"limit": CLIP_LIST_PAGE, "offset": offset}) or []
+            objects.extend(batch)
+            if len(batch) < CLIP_LIST_PAGE:
+                return objects
+            offset += len(batch)
+
+    def refresh_from_storage(self):
+        """Re-list clips/ in storage; adds new objects, updates sizes, drops deleted ones. Returns True on changes."""
+        started = time.time()
+        listed = {}
+        for obj in self._list_storage():
+            name = obj.get("name") if isinstance(obj, dict) else None
+            if not name:
+                continue
+            listed[f"clips/{name}"] = {
+                "file_name": name,
+                "size": (obj.get("metadata") or {}).get("size"),
+                "created": _storage_time(obj.get("created_at") or obj.get("updated_at") or obj.get("last_modified")) or started,
+            }
+        known = self.store.stored_files()
+        upserts = []
+        for path, info in listed.items():
+            current = known.get(path)
+            if current is None:
+                upserts.append({"clip_id": os.path.splitext(info["file_name"])[0], "file_path": path,
+                                "status": "ready", "engagement_count": 0, "updated": started, **info})
+            elif info["size"] is not None and current["size"] != info["size"]:
+                upserts.append({**current, "size": info["size"], "updated": started})
+        # clips that became ready while the listing was in flight are not deletions
+        gone = [c["clip_id"] for p, c in known.items()
+                if p not in listed and c["status"] == "ready" and (c["updated"] or 0) < started]
+        self.store.put(upserts)
+        self.store.delete(gone)
+        # jobs that failed, or were lost with a restarted worker
+        self.store.prune(started - CLIP_JOB_TTL_SEC, ("queued", "processing", "failed"))
+        return bool(upserts or gone)
+
+    def _refresh_loop(self):
+        while True:
             try:
-                resp = supabase.storage.from_(SUPABASE_BUCKET).list(path="clips")
-            except TypeError:
-                # fallback older signature
-                resp = supabase.storage.from_(SUPABASE_BUCKET).list("clips")
-            for obj in resp or []:
-                # obj may be dict with keys: name, id, updated_at, created_at, last_modified, metadata, size
-                name = obj.get("name") if isinstance(obj, dict) else None
-                if not name:
-                    continue
-                path = f"clips/{name}"
-                # public url
-                try:
-                    pub = supabase.storage.from_(SUPABASE_BUCKET).get_public_url(path)
-                    public_url = pub.get("publicUrl") if isinstance(pub, dict) else pub
-                except Exception:
-                    public_url = None
-                items.append({
-                    "name": name,
-                    "path": path,
-                    "size": obj.get("metadata", {}).get("size") if isinstance(obj, dict) else None,
-                    "last_modified": obj.get("updated_at") or obj.get("last_modified") if isinstance(obj, dict) else None,
-                    "public_url": public_url,
-                })
-        except Exception as e:
-            return jsonify({"error": f"Failed to list clips: {e}"}), 500
+                if self.refresh_from_storage():
+                    print("[CLIPS] Catalogue refreshed from storage")
+            except Exception as e:
+                print("[CLIPS] Refresh error:", e)
+            time.sleep(CLIP_CATALOG_REFRESH_SEC)
+
+    def ensure_refresher(self):
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name="clip-catalog", daemon=True)
+                self._refresher.start()
 
-        # newest first by last_modified if present; else by name
+def _clip_json(clip: dict) -> dict:
+    created = clip["created"]
+    return {
+        **clip,
+        "name": clip["file_name"],
+        "path": clip["file_path"],
+        "start": clip["start_time"],
+        "end": clip["end_time"],
+        "last_modified": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(created)) if created else None,
+        "public_url": public_url_for(clip["file_path"]) if clip["file_path"] else None,
+    }
+
+CLIP_CATALOG = ClipCatalog(SQLiteClipStore(CLIPS_DB_PATH))
+
+@app.route("/clips", methods=["GET"])
+def list_clips():
+    """
+    Newest clips first from the clip store. Query: limit, cursor (from next_cursor),
+    reaction, status (comma-separated, default ready; "all" for every status),
+    since / until (epoch seconds). ETag / If-None-Match aware.
+    """
+    try:
+        CLIP_CATALOG.ensure_refresher()
+        args = request.args
         try:
-            items.sort(key=lambda x: x.get("last_modified") or x.get("name"), reverse=True)
-        except Exception:
-            pass
+            limit = min(CLIPS_MAX_PAGE_SIZE, max(1, int(args.get("limit", CLIPS_PAGE_SIZE))))
+            since = float(args["since"]) if args.get("since") else None
+            until = float(args["until"]) if args.get("until") else None
+            cursor = args.get("cursor") or None
+            if cursor:
+                ClipStore.decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({"error": f"bad query: {e}"}), 400
+        status = args.get("status", "ready")
+        statuses = () if status == "all" else tuple(s for s in status.split(",") if s)
+        reaction = args.get("reaction") or None
 
-        return jsonify({"clips": items})
+        query_key = hashlib.blake2b(request.query_string, digest_size=6).hexdigest()
+        etag = f"{CLIP_CATALOG.store.version()}-{query_key}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            clips, next_cursor = CLIP_CATALOG.store.list(limit, cursor=cursor, reaction=reaction, statuses=statuses,
+                                                         since=since, until=until)
+            response = jsonify({"clips": [_clip_json(c) for c in clips], "limit": limit, "next_cursor": next_cursor})
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -181,85 +851,510 @@ HTML_PAGE = """
 """.replace("{{playlist}}", PLAYLIST_NAME)
 
 # ---- helper: stop ffmpeg ----
-def stop_transcoding():
-    global CURRENT_FFMPEG_PROCESS
-    if CURRENT_FFMPEG_PROCESS and CURRENT_FFMPEG_PROCESS.poll() is None:
-        print("Stopping current FFmpeg process...")
+# ---- stream profile: segment length, keyframe cadence and GOP of the live encode ----
+class StreamProfile:
+    """
+    Segmenting and keyframe settings of the live encode. keyframe_sec is the forced keyframe
+    cadence and must divide segment_sec, so every segment starts on a keyframe; a stream-copy
+    clip starts on the keyframe at/before the requested time, so keyframe_sec bounds clip
+    precision while shorter segments mean more upload requests. gop_frames caps the distance
+    between keyframes (x264 keyint) and scenecut lets x264 add keyframes at scene changes.
+    In LL-HLS mode keyframe_sec is the part length and segment_sec the segment built from parts.
+    Invalid settings raise ValueError.
+    """
+    FIELDS = ("segment_sec", "keyframe_sec", "gop_frames", "scenecut", "list_size")
+
+    def __init__(self, segment_sec: float, keyframe_sec: float = None, gop_frames: int = None,
+                 scenecut: bool = True, list_size: int = HLS_LIST_SIZE, low_latency: bool = LL_HLS):
         try:
-            CURRENT_FFMPEG_PROCESS.terminate()
-            CURRENT_FFMPEG_PROCESS.wait(timeout=5)
-        except Exception:
-            try:
-                CURRENT_FFMPEG_PROCESS.kill()
-            except Exception:
-                pass
-        CURRENT_FFMPEG_PROCESS = None
+            self.segment_sec = float(segment_sec)
+            self.keyframe_sec = float(keyframe_sec) if keyframe_sec is not None else self.segment_sec
+            self.gop_frames = (int(gop_frames) if gop_frames is not None
+                               else min(round(self.keyframe_sec * OUTPUT_FPS), X264_KEYINT))
+            self.list_size = int(list_size)
+        except (TypeError, ValueError):
+            raise ValueError("segment_sec and keyframe_sec must be numbers, gop_frames and list_size integers")
+        if not isinstance(scenecut, bool):
+            raise ValueError("scenecut must be true or false")
+        self.scenecut = scenecut
+        self.low_latency = low_latency
+        self._validate()
 
-# ---- start transcoding: strict live mode ----
-def start_transcoding(video_file: str = None, input_headers=None):
-    global CURRENT_FFMPEG_PROCESS, CURRENT_VIDEO_SOURCE, CURRENT_INPUT_HEADERS
+    def _validate(self):
+        if self.low_latency:
+            if not 0.2 <= self.keyframe_sec <= 5.0:
+                raise ValueError("keyframe_sec (the LL-HLS part length) must be between 0.2 and 5 seconds")
+        elif not 1.0 <= self.segment_sec <= 60.0:
+            raise ValueError("segment_sec must be between 1 and 60 seconds")
+        frames = self.keyframe_sec * OUTPUT_FPS
+        if frames < 1 or abs(frames - round(frames)) > 1e-6:
+            raise ValueError(f"keyframe_sec must be a whole number of frames (multiple of {1 / OUTPUT_FPS:g}s)")
+        ratio = self.segment_sec / self.keyframe_sec
+        if ratio < 1 or abs(ratio - round(ratio)) > 1e-6:
+            raise ValueError("segment_sec must be a whole multiple of keyframe_sec")
+        if self.low_latency and round(ratio) > 20:
+            raise ValueError("an LL-HLS segment holds at most 20 parts")
+        if not 1 <= self.gop_frames <= round(frames):
+            raise ValueError(f"gop_frames must be between 1 and {round(frames)} (the keyframe cadence)")
+        if not 3 <= self.list_size <= 1000:
+            raise ValueError("list_size must be between 3 and 1000 segments")
 
-    if video_file:
-        CURRENT_VIDEO_SOURCE = video_file
-        CURRENT_INPUT_HEADERS = list(input_headers) if input_headers else None
+    @property
+    def max_keyframe_gap(self) -> float:
+        """Longest distance between keyframes this profile produces when encoding."""
+        return min(self.keyframe_sec, self.gop_frames / OUTPUT_FPS)
 
-    stop_transcoding()
+    @property
+    def parts_per_segment(self) -> int:
+        return round(self.segment_sec / self.keyframe_sec)
 
-    # clean local hls directory
-    for f in os.listdir(HLS_OUTPUT_DIR):
-        if f.endswith(".ts") or f.endswith(".m3u8"):
-            try:
-                os.remove(os.path.join(HLS_OUTPUT_DIR, f))
-            except Exception:
-                pass
+    def replace(self, overrides: dict) -> "StreamProfile":
+        """A new profile with the given fields changed (unknown fields raise ValueError)."""
+        if not isinstance(overrides, dict):
+            raise ValueError("profile must be a preset name or an object")
+        unknown = set(overrides) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"unknown profile fields: {', '.join(sorted(unknown))}")
+        values = self.to_dict()
+        if "segment_sec" in overrides and "keyframe_sec" not in overrides and not self.low_latency:
+            values["keyframe_sec"] = None  # follows the new segment length
+        if "keyframe_sec" in overrides or "segment_sec" in overrides:
+            values["gop_frames"] = None
+        values.update(overrides)
+        return StreamProfile(low_latency=self.low_latency, **values)
 
-    print(f"[FFMPEG] Starting transcoding for: {CURRENT_VIDEO_SOURCE}")
+    def to_dict(self) -> dict:
+        return {f: getattr(self, f) for f in self.FIELDS}
 
-    command = [
-        "ffmpeg",
-        "-re",
+try:
+    DEFAULT_STREAM_PROFILE = (
+        StreamProfile(LL_PART_SEC * LL_PARTS_PER_SEGMENT, LL_PART_SEC) if LL_HLS else
+        StreamProfile(HLS_TIME, HLS_KEYFRAME_SEC, HLS_GOP_FRAMES, HLS_SCENECUT)
+    )
+except ValueError as e:
+    raise RuntimeError(f"Invalid stream profile settings: {e}")
+# Overrides on the default profile, picked by name in /start_stream; validated when used
+STREAM_PRESETS = {
+    "precise": {"segment_sec": 4, "keyframe_sec": 1},  # clips start within 1 s, ~2 upload requests per 4 s
+    "balanced": {"segment_sec": 6, "keyframe_sec": 2},
+    "efficient": {"segment_sec": 20, "keyframe_sec": 20},  # the original fixed settings
+}
+
+def resolve_stream_profile(spec, current: StreamProfile = None) -> StreamProfile:
+    """None keeps the current profile; a preset name or a dict of overrides applies to the default one."""
+    if spec is None:
+        return current or DEFAULT_STREAM_PROFILE
+    if isinstance(spec, str):
+        if spec == "default":
+            return DEFAULT_STREAM_PROFILE
+        if spec not in STREAM_PRESETS:
+            raise ValueError(f"unknown profile preset {spec!r} (known: default, {', '.join(STREAM_PRESETS)})")
+        spec = STREAM_PRESETS[spec]
+    return DEFAULT_STREAM_PROFILE.replace(spec)
+
+# ---- start transcoding: strict live mode ----
+def _keyframe_args(profile: StreamProfile):
+    args = [
+        # keyframes every keyframe_sec, so segment boundaries (and clip starts) land on them
+        "-force_key_frames", f"expr:gte(t,n_forced*{profile.keyframe_sec:g})",
+        "-g", str(profile.gop_frames),
+    ]
+    if not profile.scenecut:
+        args += ["-sc_threshold", "0"]
+    return args
+
+def _hls_muxer_args(profile: StreamProfile, split_by_time: bool = True):
+    # HLS options for strict live sliding window; a copied video stream can only be cut on its own keyframes
+    return [
+        "-f", "hls",
+        "-hls_time", f"{profile.segment_sec:g}",
+        "-hls_list_size", str(profile.list_size),
+        "-hls_flags", "delete_segments+program_date_time" + ("+split_by_time" if split_by_time else ""),
+        "-hls_segment_type", "mpegts",
     ]
 
-    # For local files, loop indefinitely; for URLs, many servers auto-loop. We keep loop only for local files.
-    is_url = isinstance(CURRENT_VIDEO_SOURCE, str) and CURRENT_VIDEO_SOURCE.startswith(("http://", "https://"))
-    if not is_url:
-        command += ["-stream_loop", "-1"]
+def _codec_args(profile: StreamProfile, path: str = "transcode", tune: str = None):
+    """Video/audio codec arguments for a transcode path: "transcode", "copy" or "copy-video" (audio to AAC)."""
+    if path == "transcode":
+        video = [
+            # force constant frame rate & regenerate timestamps
+            "-vf", f"fps={OUTPUT_FPS}",
+            "-fflags", "+genpts",
+            # encode
+            "-c:v", "libx264",
+            "-preset", "veryfast",
+        ] + (["-tune", tune] if tune else []) + ["-crf", "23"] + _keyframe_args(profile)
+    else:
+        video = ["-fflags", "+genpts", "-c:v", "copy"]
+    audio = ["-c:a", "copy"] if path == "copy" else ["-c:a", "aac", "-b:a", "128k"]
+    return video + audio
 
-    # Optional input headers for remote sources (e.g., Google Photos)
-    if CURRENT_INPUT_HEADERS:
-        # ffmpeg expects CRLF-joined headers string
-        headers_str = "\r\n".join(CURRENT_INPUT_HEADERS)
-        command += ["-headers", headers_str]
+def _single_encode_args(profile: StreamProfile, run: str, out_dir: str, path: str = "transcode"):
+    return _codec_args(profile, path) + _hls_muxer_args(profile, split_by_time=path == "transcode") + [
+        "-hls_segment_filename", os.path.join(out_dir, SEGMENT_PATTERN.format(run=run)),
+        os.path.join(out_dir, PLAYLIST_NAME)
+    ]
 
-    command += [
-        "-i", CURRENT_VIDEO_SOURCE,
-        # force constant frame rate & regenerate timestamps
-        "-vf", "fps=25",
-        "-fflags", "+genpts",
-        # encode
+def _abr_encode_args(profile: StreamProfile, run: str, out_dir: str, with_audio: bool = True):
+    """
+    Encoder and muxer arguments for the ABR ladder: one decode, the fps filter once, then a split into
+    a capped-CRF encode per rendition. Forced keyframes land on the same timestamps in every rendition
+    so players can switch at any segment boundary. Every variant carries its own audio copy because
+    clips are cut from the top rendition's segments.
+    """
+    n = len(ABR_RENDITIONS)
+    graph = f"[0:v]fps={OUTPUT_FPS},split={n}" + "".join(f"[s{i}]" for i in range(n)) + ";" + ";".join(
+        f"[s{i}]scale=-2:{h}[v{i}]" for i, (h, _) in enumerate(ABR_RENDITIONS))
+    args = ["-filter_complex", graph, "-fflags", "+genpts"]
+    for i in range(n):
+        args += ["-map", f"[v{i}]"]
+        if with_audio:
+            args += ["-map", "0:a:0"]
+    args += [
         "-c:v", "libx264",
         "-preset", "veryfast",
         "-crf", "23",
-        # keyframes every HLS_TIME seconds
-        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_TIME})",
-        "-c:a", "aac",
-        "-b:a", "128k",
-        # HLS options for strict live sliding window
+    ] + _keyframe_args(profile)
+    for i, (_, kbps) in enumerate(ABR_RENDITIONS):
+        # maxrate also gives the master playlist its BANDWIDTH for each variant
+        args += [f"-maxrate:v:{i}", f"{kbps}k", f"-bufsize:v:{i}", f"{2 * kbps}k"]
+    if with_audio:
+        args += ["-c:a", "aac", "-b:a", "128k"]
+    stream_map = " ".join(
+        f"v:{i}" + (f",a:{i}" if with_audio else "") + f",name:{name}" for i, name in enumerate(ABR_VARIANTS))
+    return args + _hls_muxer_args(profile) + [
+        "-var_stream_map", stream_map,
+        # written next to the %v directories, i.e. out_dir/PLAYLIST_NAME
+        "-master_pl_name", PLAYLIST_NAME,
+        "-hls_segment_filename", os.path.join(out_dir, "%v", SEGMENT_PATTERN.format(run=run)),
+        os.path.join(out_dir, "%v", VARIANT_PLAYLIST_NAME),
+    ]
+
+def _ll_encode_args(profile: StreamProfile, run: str, out_dir: str, path: str = "transcode"):
+    """
+    Encoder and muxer arguments for LL-HLS: every ffmpeg "segment" is one fMP4 part starting on a
+    keyframe (forced, or the source's own when copying), so any part is independent and any run of
+    parts concatenates into a segment. zerolatency drops B-frames and lookahead, which would
+    otherwise hold frames back.
+    """
+    return _codec_args(profile, path, tune="zerolatency") + [
         "-f", "hls",
-        "-hls_time", str(HLS_TIME),
-        "-hls_list_size", str(HLS_LIST_SIZE),
-        "-hls_flags", "delete_segments+split_by_time+program_date_time",
-        "-hls_segment_type", "mpegts",
-        "-hls_segment_filename", os.path.join(HLS_OUTPUT_DIR, SEGMENT_PATTERN),
-        os.path.join(HLS_OUTPUT_DIR, PLAYLIST_NAME)
+        "-hls_time", f"{profile.keyframe_sec:g}",
+        # enough parts for the segment builder to catch up, plus the parts still listed by the playlist
+        "-hls_list_size", str(profile.parts_per_segment * (LL_PART_WINDOW + 2)),
+        "-hls_flags", "delete_segments+program_date_time+independent_segments",
+        "-hls_segment_type", "fmp4",
+        "-hls_fmp4_init_filename", f"init_{run}.mp4",
+        "-hls_segment_filename", os.path.join(out_dir, LL_PART_PATTERN.format(run=run)),
+        os.path.join(out_dir, LL_PARTS_PLAYLIST),
     ]
 
-    # run ffmpeg
-    CURRENT_FFMPEG_PROCESS = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    # start uploader thread if not started
-    if not any(t.name == "uploader" for t in threading.enumerate()):
-        uploader = threading.Thread(target=upload_new_segments, name="uploader", daemon=True)
-        uploader.start()
+def transcode_args(profile: StreamProfile, run: str, out_dir: str = HLS_OUTPUT_DIR, with_audio: bool = True,
+                   path: str = "transcode"):
+    """
+    ffmpeg arguments after the input for the configured output mode (ABR ladder, LL-HLS or single
+    rendition) and transcode path (see choose_transcode_path; the ABR ladder always encodes).
+    """
+    if ABR_RENDITIONS:
+        return _abr_encode_args(profile, run, out_dir, with_audio)
+    if LL_HLS:
+        return _ll_encode_args(profile, run, out_dir, path)
+    return _single_encode_args(profile, run, out_dir, path)
+
+def _ffprobe_json(command):
+    result = subprocess.run(command, capture_output=True, text=True, timeout=30)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"ffprobe exited with {result.returncode}")
+    return json.loads(result.stdout or "{}")
+
+def probe_source(source: str, input_headers=None, seconds: float = TRANSCODE_PROBE_SEC):
+    """
+    Codecs, bitrate and keyframe spacing of a source, or None if ffprobe fails. Keyframes come
+    from packet flags over the first `seconds` (no decode). keyframe_gap_max also counts the
+    stretch after the last keyframe seen, so a single keyframe reads as a gap of the whole window.
+    """
+    base = ["ffprobe", "-v", "error"]
+    if input_headers:
+        base += ["-headers", "\r\n".join(input_headers)]
+    try:
+        info = _ffprobe_json(base + [
+            "-show_entries", "stream=codec_type,codec_name,profile,pix_fmt,width,height,bit_rate:format=bit_rate",
+            "-of", "json", source,
+        ])
+        streams = info.get("streams", [])
+        video = next((st for st in streams if st.get("codec_type") == "video"), None)
+        audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+        keyframes, last = [], None
+        if video:
+            packets = _ffprobe_json(base + [
+                "-select_streams", "v:0",
+                "-read_intervals", f"%+{seconds:g}",
+                "-show_entries", "packet=pts_time,flags",
+                "-of", "json", source,
+            ]).get("packets", [])
+            for p in packets:
+                if p.get("pts_time") in (None, "N/A"):
+                    continue
+                t = float(p["pts_time"])
+                last = t if last is None else max(last, t)
+                if "K" in p.get("flags", ""):
+                    keyframes.append(t)
+    except (OSError, ValueError, RuntimeError, subprocess.TimeoutExpired) as e:
+        print(f"[FFMPEG] probe failed for {source}: {e}")
+        return None
+    keyframes.sort()
+    gaps = [b - a for a, b in zip(keyframes, keyframes[1:])]
+    if keyframes and last is not None:
+        gaps.append(last - keyframes[-1])
+    bit_rate = info.get("format", {}).get("bit_rate") or (video or {}).get("bit_rate")
+    return {
+        "video": {k: video.get(k) for k in ("codec_name", "profile", "pix_fmt", "width", "height")} if video else None,
+        "audio": {"codec_name": audio.get("codec_name")} if audio else None,
+        "bitrate_kbps": int(bit_rate) // 1000 if bit_rate and str(bit_rate).isdigit() else None,
+        "keyframes": len(keyframes),
+        "keyframe_gap_max": round(max(gaps), 3) if gaps else None,
+    }
+
+def choose_transcode_path(probe, profile: StreamProfile):
+    """
+    ("copy" | "copy-video" | "transcode", reasons). Video is copied only when it is H.264 in a
+    profile every HLS player decodes, within the height/bitrate caps, with keyframes at least as
+    often as this profile would encode them; audio is copied when it is AAC (or absent).
+    """
+    if not TRANSCODE_BYPASS:
+        return "transcode", ["bypass disabled (TRANSCODE_BYPASS=0)"]
+    if ABR_RENDITIONS:
+        return "transcode", ["the ABR ladder encodes every rendition"]
+    if probe is None:
+        return "transcode", ["source probe failed"]
+    video = probe["video"]
+    if not video:
+        return "transcode", ["no video stream"]
+    reasons = []
+    if video["codec_name"] != "h264":
+        reasons.append(f"video codec {video['codec_name']} is not h264")
+    elif video["profile"] not in BYPASS_H264_PROFILES:
+        reasons.append(f"h264 profile {video['profile']} is not widely decodable")
+    if video["pix_fmt"] != "yuv420p":
+        reasons.append(f"pixel format {video['pix_fmt']} is not yuv420p")
+    if (video["height"] or 0) > TRANSCODE_BYPASS_MAX_HEIGHT:
+        reasons.append(f"height {video['height']} is over {TRANSCODE_BYPASS_MAX_HEIGHT}")
+    if probe["bitrate_kbps"] is None or probe["bitrate_kbps"] > TRANSCODE_BYPASS_MAX_KBPS:
+        reasons.append(f"bitrate {probe['bitrate_kbps']} kbps is unknown or over {TRANSCODE_BYPASS_MAX_KBPS}")
+    gap, allowed = probe["keyframe_gap_max"], profile.max_keyframe_gap + 1.0 / OUTPUT_FPS
+    if gap is None or gap > allowed:
+        reasons.append(f"keyframe gap {gap}s is over the profile's {profile.max_keyframe_gap:g}s")
+    if reasons:
+        return "transcode", reasons
+    audio = probe["audio"]
+    if audio and audio["codec_name"] != "aac":
+        return "copy-video", [f"audio codec {audio['codec_name']} is re-encoded to aac"]
+    return "copy", []
+
+def _drain_ffmpeg_log(proc):
+    for line in iter(proc.stderr.readline, b""):
+        text = line.decode(errors="replace").rstrip()
+        if text:
+            print(f"[FFMPEG] {text}")
+
+def _process_cpu_seconds(pid: int):
+    """CPU seconds (user + system) a process has used, from /proc; None where that is unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def stream_cpu_cost(path: str) -> float:
+    """Expected encoder cores for a transcode path; the ABR ladder encodes every rendition."""
+    if path != "transcode":
+        return STREAM_CPU_COST_COPY
+    return STREAM_CPU_COST_ENCODE * max(1, len(ABR_RENDITIONS))
+
+class LiveStream:
+    """
+    One live channel: its ffmpeg process, local HLS directory, uploader thread and playlist
+    publisher, segment index, DVR ring, LL-HLS playlist and reaction windows. The default
+    stream keeps the original layout (HLS_OUTPUT_DIR, DVR_DIR, live/ in storage); any other
+    stream uses STREAMS_DIR/<id>, DVR_DIR/<id> and live/streams/<id>/, so its playlists and
+    segments are served under /live/streams/<id>/ and /stream/streams/<id>/.
+    """
+
+    def __init__(self, stream_id: str, out_dir: str, dvr_dir: str, remote_prefix: str):
+        self.id = stream_id
+        self.out_dir = out_dir
+        self.remote_prefix = remote_prefix
+        self.source = VIDEO_SOURCE
+        self.input_headers = None  # list of header lines like ["Authorization: Bearer ..."] or None
+        self.profile = DEFAULT_STREAM_PROFILE
+        self.transcode = {"path": None, "reasons": [], "probe": None}  # how the running stream is produced
+        self.process = None
+        self.started = None
+        self.cpu_estimate = 0.0  # cores reserved for the encoder when the stream was admitted
+        self.admitted = None
+        for d in [out_dir] + [os.path.join(out_dir, v) for v in ABR_VARIANTS]:
+            os.makedirs(d, exist_ok=True)
+        os.makedirs(dvr_dir, exist_ok=True)
+        self.dvr = SegmentRing(dvr_dir, DVR_MAX_BYTES, DVR_MAX_AGE_SEC)
+        self.index = SegmentIndex(os.path.join(out_dir, MEDIA_PLAYLISTS[0]), on_segment=self.dvr.retain,
+                                  segment_sec=self.profile.segment_sec)
+        self.ll = LowLatencyPlaylist(out_dir, self.profile.parts_per_segment, self.profile.keyframe_sec,
+                                     self.profile.list_size)
+        self.reactions = _new_reaction_backend(stream_id)
+        # playlists publish in order per stream; a slow segment upload never holds up another stream's playlists
+        self.publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"publish-{stream_id}")
+        self.closed = threading.Event()
+        self._uploader = None
+        self._lock = threading.Lock()  # one start/stop at a time
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def owns_cache_key(self, key: str) -> bool:
+        """Whether a /live cache key (path under live/) belongs to this stream."""
+        if self.id == DEFAULT_STREAM_ID:
+            return not key.startswith("streams/")
+        return key.startswith(f"streams/{self.id}/")
+
+    def live_path(self, rel: str) -> str:
+        """Path of a stream file below /live/ and /stream/."""
+        return rel if self.id == DEFAULT_STREAM_ID else f"streams/{self.id}/{rel}"
+
+    def stop(self):
+        with self._lock:
+            self._stop_process()
+
+    def _stop_process(self):
+        proc = self.process
+        if proc and proc.poll() is None:
+            print(f"Stopping FFmpeg process of stream {self.id}...")
+            try:
+                proc.terminate()
+                proc.wait(timeout=5)
+            except Exception:
+                try:
+                    proc.kill()
+                except Exception:
+                    pass
+        self.process = None
+
+    def start(self, video_file: str = None, input_headers=None, profile: StreamProfile = None, admit=None):
+        """
+        (Re)start ffmpeg for this stream. The source is probed first and admit(stream, cores)
+        may refuse the start by raising; the running encoder is only replaced once admitted.
+        """
+        with self._lock:
+            source = video_file or self.source
+            headers = (list(input_headers) if input_headers else None) if video_file else self.input_headers
+            profile = profile or self.profile
+            print(f"[FFMPEG] Starting transcoding for: {source} (stream {self.id})")
+            print(f"[FFMPEG] Profile: {profile.to_dict()}")
+            probe = probe_source(source, headers) if TRANSCODE_BYPASS or ABR_RENDITIONS else None
+            path, reasons = choose_transcode_path(probe, profile)
+            print(f"[FFMPEG] Path: {path}" + (f" ({'; '.join(reasons)})" if reasons else ""))
+            if admit is not None:
+                admit(self, stream_cpu_cost(path))
+            self.source, self.input_headers, self.profile = source, headers, profile
+            self.transcode = {"path": path, "reasons": reasons, "probe": probe}
+
+            self._stop_process()
+
+            # clean local hls directory (and the variant directories of the ABR ladder)
+            for d in [self.out_dir] + [os.path.join(self.out_dir, v) for v in ABR_VARIANTS]:
+                os.makedirs(d, exist_ok=True)
+                for f in os.listdir(d):
+                    if f.endswith(LIVE_MEDIA_SUFFIXES + (".m3u8", ".tmp")):
+                        try:
+                            os.remove(os.path.join(d, f))
+                        except Exception:
+                            pass
+            self.index.reset(profile.segment_sec)
+            self.dvr.clear()
+            LIVE_CACHE.clear(self.owns_cache_key)
+            TRIGGERS.reset(self.id)
+
+            command = [
+                "ffmpeg",
+                "-hide_banner",
+                "-nostats",
+                "-loglevel", "warning",
+                "-re",
+            ]
+
+            # For local files, loop indefinitely; for URLs, many servers auto-loop. We keep loop only for local files.
+            is_url = isinstance(source, str) and source.startswith(("http://", "https://"))
+            if not is_url:
+                command += ["-stream_loop", "-1"]
+
+            # Optional input headers for remote sources (e.g., Google Photos)
+            if headers:
+                # ffmpeg expects CRLF-joined headers string
+                headers_str = "\r\n".join(headers)
+                command += ["-headers", headers_str]
+
+            run = uuid.uuid4().hex[:6]
+            self.ll.reset(run, profile.parts_per_segment, profile.keyframe_sec, profile.list_size)
+            # a failed probe assumes audio, as ffmpeg's own stream selection would
+            with_audio = probe is None or probe["audio"] is not None
+            command += ["-i", source] + transcode_args(profile, run, self.out_dir, with_audio, path)
+
+            # run ffmpeg; stderr is drained by a thread so a full pipe never stalls the encoder
+            self.process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.PIPE)
+            self.started = time.time()
+            threading.Thread(target=_drain_ffmpeg_log, args=(self.process,), name=f"ffmpeg-log-{self.id}",
+                             daemon=True).start()
+            # start uploader thread if not started
+            if self._uploader is None or not self._uploader.is_alive():
+                self._uploader = threading.Thread(target=upload_new_segments, args=(self,),
+                                                  name=f"uploader-{self.id}", daemon=True)
+                self._uploader.start()
+
+    def close(self):
+        """Stop for good: end the uploader and drop the stream's local files and reaction windows."""
+        with self._lock:
+            self._stop_process()
+            self.closed.set()
+        if self._uploader is not None:
+            self._uploader.join(timeout=5)
+        self.publisher.shutdown(wait=False)
+        self.dvr.clear()
+        LIVE_CACHE.clear(self.owns_cache_key)
+        TRIGGERS.reset(self.id)
+        if isinstance(self.reactions, SharedMemoryReactions):
+            self.reactions.destroy()
+        else:
+            self.reactions.clear()
+        if self.id != DEFAULT_STREAM_ID:
+            shutil.rmtree(self.out_dir, ignore_errors=True)
+            shutil.rmtree(self.dvr.directory, ignore_errors=True)
+
+    def status(self) -> dict:
+        proc = self.process
+        cpu_sec = _process_cpu_seconds(proc.pid) if proc is not None and proc.poll() is None else None
+        uptime = time.time() - self.started if self.started and self.running else None
+        return {
+            "id": self.id,
+            "running": self.running,
+            "exit_code": proc.poll() if proc is not None else None,
+            "source": self.source,
+            "profile": self.profile.to_dict(),
+            "transcode": {"path": self.transcode["path"], "reasons": self.transcode["reasons"]},
+            "started": self.started,
+            "cpu_estimate": self.cpu_estimate,
+            # average cores used by ffmpeg since it started
+            "cpu_cores": round(cpu_sec / uptime, 3) if cpu_sec is not None and uptime else None,
+            "live_edge": self.index.live_edge(),
+            "playlist": f"/live/{self.live_path(PLAYLIST_NAME)}",
+            "local_playlist": f"/stream/{self.live_path(PLAYLIST_NAME)}",
+            "dvr": self.dvr.stats(),
+        }
+
+def start_transcoding(video_file: str = None, input_headers=None, profile: StreamProfile = None):
+    """(Re)start the default stream; it is always admitted (see StreamRegistry)."""
+    STREAMS.get(DEFAULT_STREAM_ID).start(video_file, input_headers, profile, admit=STREAMS.admit)
 
 @app.route("/start_stream_url", methods=["POST"])
 def start_stream_url():
@@ -275,8 +1370,12 @@ def start_stream_url():
                 headers_list.append(f"{k}: {v}")
         elif isinstance(headers_obj, list):
             headers_list = [str(h) for h in headers_obj]
-        start_transcoding(url, headers_list or None)
-        return jsonify({"ok": True, "current": url})
+        try:
+            profile = resolve_stream_profile(data.get("profile"), STREAMS.get(DEFAULT_STREAM_ID).profile)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid profile: {e}"}), 400
+        start_transcoding(url, headers_list or None, profile=profile)
+        return jsonify({"ok": True, "current": url, "profile": profile.to_dict()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -306,277 +1405,2735 @@ def start_stream_gphotos():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-# ---- uploader: upload stable files to Supabase Storage ----
-def is_file_stable(path: str, delay: float = 0.5) -> bool:
-    """Return True if file size is stable for 'delay' seconds (not being written)."""
-    try:
-        size1 = os.path.getsize(path)
-        time.sleep(delay)
-        size2 = os.path.getsize(path)
-        return size1 == size2 and size1 > 0
-    except Exception:
-        return False
+# ---- DVR ring: keep finished segments on local disk after ffmpeg deletes them ----
+class SegmentRing:
+    """
+    Size- and age-bounded local copy of finished segments. Segments are hard-linked
+    (copied across filesystems) into DVR_DIR as soon as they are indexed, so
+    ffmpeg's delete_segments only drops the live-window name. Eviction is LRU
+    (clip reads refresh a segment) once the byte budget is exceeded, and by age.
+    """
 
-def upload_to_supabase(local_path: str, remote_path: str, content_type: str = None):
-    """Upload a file to Supabase storage bucket (overwrites if exists)."""
-    try:
-        with open(local_path, "rb") as f:
-            data = f.read()
-        # supabase.storage.from().upload signature may vary on client versions.
-        # Using upsert behavior by deleting then uploading ensures replace.
-        # Attempt to upload; if fails with conflict, remove and re-upload.
+    def __init__(self, directory: str, max_bytes: int, max_age_sec: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # uri -> {path, size, added}, least recently used first
+        self._bytes = 0
+
+    def retain(self, segment: dict):
+        if segment.get("init"):
+            # fMP4 segments are only playable behind their init segment
+            self._retain_file(segment["init"], os.path.join(os.path.dirname(segment["path"]), segment["init"]))
+        self._retain_file(segment["uri"], segment["path"])
+
+    def _retain_file(self, uri: str, src: str):
+        dest = os.path.join(self.directory, uri)
+        with self._lock:
+            item = self._items.get(uri)
+            if item is not None:
+                # shared files (init segments) stay as young as the newest segment using them
+                item["added"] = time.time()
+                self._items.move_to_end(uri)
+                return
         try:
-            supabase.storage.from_(SUPABASE_BUCKET).upload(remote_path, data)
-        except Exception as e:
-            # fallback: try remove then upload (some clients enforce unique paths)
+            if os.path.exists(dest):
+                os.remove(dest)
             try:
-                supabase.storage.from_(SUPABASE_BUCKET).remove([remote_path])
-            except Exception:
+                os.link(src, dest)
+            except OSError:
+                shutil.copy2(src, dest)
+            size = os.path.getsize(dest)
+        except OSError as e:
+            print(f"[DVR] could not retain {src}: {e}")
+            return
+        with self._lock:
+            self._items[uri] = {"path": dest, "size": size, "added": time.time()}
+            self._bytes += size
+        self.evict()
+
+    def path_for(self, uri: str):
+        """Local path of a retained segment (marks it recently used), or None."""
+        with self._lock:
+            item = self._items.get(uri)
+            if item is None:
+                return None
+            self._items.move_to_end(uri)
+            return item["path"]
+
+    def evict(self, now_ts: float = None):
+        now_ts = now_ts or time.time()
+        victims = []
+        with self._lock:
+            cutoff = now_ts - self.max_age_sec
+            for uri in [u for u, it in self._items.items() if it["added"] < cutoff]:
+                victims.append(self._pop(uri))
+            while self._bytes > self.max_bytes and self._items:
+                victims.append(self._pop(next(iter(self._items))))
+        for path in victims:
+            try:
+                os.remove(path)
+            except OSError:
                 pass
-            supabase.storage.from_(SUPABASE_BUCKET).upload(remote_path, data)
-        # Optionally set metadata (not required)
-        print(f"[UP] Uploaded {local_path} -> {remote_path}")
-    except Exception as e:
-        print(f"[UP-ERR] Failed upload {local_path} -> {remote_path}: {e}")
 
-def upload_new_segments():
+    def _pop(self, uri: str):
+        item = self._items.pop(uri)
+        self._bytes -= item["size"]
+        return item["path"]
+
+    def clear(self):
+        with self._lock:
+            paths = [it["path"] for it in self._items.values()]
+            self._items.clear()
+            self._bytes = 0
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"segments": len(self._items), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "max_age_sec": self.max_age_sec}
+
+# ---- segment index: stream time -> local segment files, fed by the live playlist ----
+class SegmentIndex:
     """
-    Poll HLS_OUTPUT_DIR for new stable files and upload to Supabase.
-    Tracks uploaded filenames to avoid re-upload storms.
-    Always re-upload playlist when modified.
+    Rolling in-memory index of the HLS segments ffmpeg has finished, built by
+    re-parsing the playlist whenever it changes. Each entry is a dict:
+    {seq, uri, path, duration, start, pdt, init} where 'start' is the cumulative
+    start time in stream seconds, 'pdt' the EXT-X-PROGRAM-DATE-TIME (epoch) and
+    'init' the EXT-X-MAP uri of fMP4 segments (None for mpegts).
+    Entries stay after they slide out of the playlist (up to max_entries); the
+    files themselves outlive the live window only through the DVR ring.
     """
-    uploaded = set()
-    last_playlist_mtime = None
 
-    while True:
+    def __init__(self, playlist_path: str, max_entries: int = 10000, on_segment=None,
+                 segment_sec: float = DEFAULT_STREAM_PROFILE.segment_sec):
+        self.playlist_path = playlist_path
+        self.base_dir = os.path.dirname(playlist_path)
+        self.max_entries = max_entries
+        self.on_segment = on_segment  # called with each newly indexed entry (e.g. DVR retention)
+        self.segment_sec = segment_sec  # profile segment length, for start times across gaps
+        self.generation = 0  # bumped on reset so consumers can restart their cursors
+        self._lock = threading.Lock()
+        self._entries = []
+        self._starts = []  # parallel to _entries, for bisect
+        self._mtime = None
+
+    def reset(self, segment_sec: float = None):
+        with self._lock:
+            self._entries = []
+            self._starts = []
+            self._mtime = None
+            self.segment_sec = segment_sec or self.segment_sec
+            self.generation += 1
+
+    def refresh(self) -> bool:
+        """Re-parse the playlist if it changed. Returns True if new segments were added."""
         try:
-            # upload segments
-            for fname in sorted(os.listdir(HLS_OUTPUT_DIR)):
-                if not (fname.endswith(".ts") or fname.endswith(".m3u8")):
-                    continue
-                local = os.path.join(HLS_OUTPUT_DIR, fname)
+            mtime = os.path.getmtime(self.playlist_path)
+        except OSError:
+            return False
+        with self._lock:
+            if self._mtime is not None and mtime == self._mtime:
+                return False
+            self._mtime = mtime
+        try:
+            with open(self.playlist_path, "r") as f:
+                lines = [ln.strip() for ln in f]
+        except OSError:
+            return False
 
-                # upload playlist every time it's updated, not only new
-                if fname.endswith(".m3u8"):
-                    try:
-                        mtime = os.path.getmtime(local)
-                        if last_playlist_mtime is None or mtime > last_playlist_mtime:
-                            if is_file_stable(local, delay=0.2):
-                                upload_to_supabase(local, f"live/{fname}", content_type="application/x-mpegURL")
-                                last_playlist_mtime = mtime
-                    except Exception as e:
-                        print("[UP] playlist upload error:", e)
+        seq, duration, pdt, init, parsed = 0, None, None, None, []
+        for ln in lines:
+            if ln.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                seq = int(ln.split(":", 1)[1])
+            elif ln.startswith("#EXT-X-MAP:"):
+                init = _hls_attr(ln, "URI")
+            elif ln.startswith("#EXTINF:"):
+                duration = float(ln.split(":", 1)[1].split(",", 1)[0])
+            elif ln.startswith("#EXT-X-PROGRAM-DATE-TIME:"):
+                try:
+                    pdt = datetime.fromisoformat(ln.split(":", 1)[1]).timestamp()
+                except ValueError:
+                    pdt = None
+            elif ln and not ln.startswith("#") and duration is not None:
+                parsed.append((seq, ln, duration, pdt, init))
+                seq += 1
+                duration, pdt = None, None
+
+        added = []
+        with self._lock:
+            last_seq = self._entries[-1]["seq"] if self._entries else None
+            if last_seq is not None and parsed and parsed[-1][0] < last_seq:
+                # sequence went backwards: ffmpeg restarted without reset()
+                self._entries, self._starts, last_seq = [], [], None
+                self.generation += 1
+            for seq, uri, duration, pdt, init in parsed:
+                if last_seq is not None and seq <= last_seq:
                     continue
+                if self._entries and seq == self._entries[-1]["seq"] + 1:
+                    start = self._entries[-1]["start"] + self._entries[-1]["duration"]
+                else:
+                    # first entry or a gap: assume earlier segments were as long as the profile's
+                    start = seq * self.segment_sec
+                self._entries.append({
+                    "seq": seq,
+                    "uri": uri,
+                    "path": os.path.join(self.base_dir, uri),
+                    "duration": duration,
+                    "start": start,
+                    "pdt": pdt,
+                    "init": init,
+                })
+                self._starts.append(start)
+                last_seq = seq
+                added.append(dict(self._entries[-1]))
+            if len(self._entries) > self.max_entries:
+                drop = len(self._entries) - self.max_entries
+                del self._entries[:drop]
+                del self._starts[:drop]
+        if self.on_segment:
+            for entry in added:
+                self.on_segment(entry)
+        return bool(added)
 
-                # for segments, ensure stable then upload once
-                if fname not in uploaded and os.path.isfile(local):
-                    if is_file_stable(local, delay=0.4):
-                        # upload
-                        ctype = "video/MP2T"
-                        try:
-                            upload_to_supabase(local, f"live/{fname}", content_type=ctype)
-                            uploaded.add(fname)
-                        except Exception as e:
-                            print("[UP] segment upload err:", e)
+    def overlapping(self, t0: float, t1: float):
+        """Entries whose [start, start + duration) overlaps [t0, t1], oldest first. O(log n + k)."""
+        with self._lock:
+            i = max(0, bisect.bisect_right(self._starts, t0) - 1)
+            out = []
+            while i < len(self._entries) and self._entries[i]["start"] < t1:
+                e = self._entries[i]
+                if e["start"] + e["duration"] > t0:
+                    out.append(dict(e))
+                i += 1
+            return out
 
-        except Exception as e:
-            print("[UP] watcher loop error:", e)
+    def live_edge(self):
+        """Stream time at the end of the newest indexed segment (0.0 when empty)."""
+        with self._lock:
+            if not self._entries:
+                return 0.0
+            return self._entries[-1]["start"] + self._entries[-1]["duration"]
 
-        time.sleep(POLL_INTERVAL)
+# ---- low-latency HLS: segments and playlist built from ffmpeg's fMP4 parts ----
+def _hls_attr(line: str, name: str):
+    """Quoted or bare attribute value from an HLS tag line, e.g. URI from #EXT-X-MAP:URI="init.mp4"."""
+    for item in line.split(":", 1)[-1].split(","):
+        key, sep, value = item.partition("=")
+        if sep and key.strip() == name:
+            return value.strip().strip('"')
+    return None
 
-# ---- routes ----
-@app.route("/")
-def index():
-    # Render the HTML that plays local playlist by default (but your React front-end
-    # can point to the supabase public URL if you prefer).
-    return render_template_string(HTML_PAGE)
+class LowLatencyPlaylist:
+    """
+    LL-HLS playlist built from ffmpeg's playlist of fMP4 parts. Every parts_per_segment
+    consecutive parts are concatenated into a segment file (fMP4 fragments concatenate into
+    a valid segment) and PLAYLIST_NAME is rewritten with the segments, EXT-X-PART entries
+    for the newest ones and a preload hint for the next part. Positions are (media sequence,
+    part index) of the newest listed part; part -1 means that segment has no parts out yet.
+    Blocking reloads wait on the local position, or on the published one for /live.
+    """
 
-@app.route("/videos", methods=["GET"])
-def list_videos():
-    videos = [f for f in os.listdir(".") if f.endswith(".mp4")]
-    return jsonify({"videos": videos, "current": CURRENT_VIDEO_SOURCE})
+    def __init__(self, directory: str, parts_per_segment: int, part_sec: float, list_size: int):
+        self.directory = directory
+        self.parts_per_segment = parts_per_segment
+        self.part_sec = part_sec
+        self.list_size = list_size
+        self._cond = threading.Condition()
+        self.reset()
 
-@app.route("/upload", methods=["POST"])
-def upload_video():
-    if "file" not in request.files:
-        return jsonify({"error": "No file part"}), 400
-    f = request.files["file"]
-    if f.filename == "":
-        return jsonify({"error": "No selected file"}), 400
-    if not f.filename.endswith(".mp4"):
-        return jsonify({"error": "Invalid file type"}), 400
-    dest = os.path.join(UPLOAD_DIR, f.filename)
-    f.save(dest)
-    return jsonify({"message": "File uploaded", "filename": f.filename})
+    def reset(self, run: str = "", parts_per_segment: int = None, part_sec: float = None, list_size: int = None):
+        with self._cond:
+            self.run = run
+            self.parts_per_segment = parts_per_segment or self.parts_per_segment
+            self.part_sec = part_sec or self.part_sec
+            self.list_size = list_size or self.list_size
+            self._mtime = None
+            self._init = None
+            self._parts = {}  # part seq -> (uri, duration, pdt line)
+            self._segments = []  # {msn, uri, duration, pdt, gap}, oldest first
+            self._retired = []  # segment files that left the playlist, deleted a little later
+            self._local = (0, -1)
+            self._published = (0, -1)
+            self._cond.notify_all()
 
-@app.route("/start_stream", methods=["POST"])
-def switch_stream():
-    data = request.get_json() or {}
-    filename = data.get("filename")
-    if not filename or not os.path.exists(filename):
-        return jsonify({"error": "File not found"}), 404
-    start_transcoding(filename)
-    return jsonify({"message": f"Streaming {filename}"})
+    def part_name(self, seq: int) -> str:
+        return LL_PART_PATTERN.replace("%d", str(seq)).format(run=self.run)
 
-@app.route("/clip", methods=["POST"])
-def create_clip():
-    try:
-        data = request.get_json()
-        start_time = float(data.get("start_time", 0))
-        end_time = float(data.get("end_time", 30))
-        if start_time < 0 or end_time <= start_time:
-            return jsonify({"error": "Invalid times"}), 400
-        duration = end_time - start_time
-        clip_filename = f"clip_{uuid.uuid4().hex[:8]}_{int(start_time)}_{int(end_time)}.mp4"
-        clip_path = os.path.join(CLIPS_DIR, clip_filename)
-        command = [
-            "ffmpeg",
-            "-ss", str(start_time),
-            "-i", CURRENT_VIDEO_SOURCE,
-            "-t", str(duration),
-            "-c:v", "libx264",
-            "-c:a", "aac",
-            "-preset", "ultrafast",
-            "-y",
-            clip_path
-        ]
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode != 0:
-            print("Clip ffmpeg err:", result.stderr)
-            return jsonify({"error": "Clip creation failed"}), 500
-        return send_file(clip_path, as_attachment=True, download_name=os.path.basename(clip_path))
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    def segment_name(self, msn: int) -> str:
+        return f"{SEGMENT_PREFIX}{self.run}_{msn}.m4s"
 
-# ---- reaction aggregation and server-side clipping ----
-def _purge_old_events(now_ts: float):
-    cutoff = now_ts - REACTION_WINDOW_SEC
-    for key in list(REACTION_EVENTS.keys()):
-        REACTION_EVENTS[key] = [e for e in REACTION_EVENTS[key] if e["time"] >= cutoff]
+    def part_position(self, name: str):
+        """(media sequence, part index) of a part file name of this run, or None."""
+        prefix, suffix = self.part_name(0)[:-len("0.m4s")], ".m4s"
+        if not (name.startswith(prefix) and name.endswith(suffix)):
+            return None
+        seq = name[len(prefix):-len(suffix)]
+        if not seq.isdigit():
+            return None
+        return divmod(int(seq), self.parts_per_segment)
 
-def _clip_async(start_time: float, end_time: float):
-    try:
-        duration = max(0.1, end_time - start_time)
-        clip_filename = f"clip_{uuid.uuid4().hex[:8]}_{int(start_time)}_{int(end_time)}.mp4"
-        clip_path = os.path.join(CLIPS_DIR, clip_filename)
-        command = [
-            "ffmpeg",
-            "-ss", str(start_time),
-            "-i", CURRENT_VIDEO_SOURCE,
-            "-t", str(duration),
-            "-c:v", "libx264",
-            "-c:a", "aac",
-            "-preset", "ultrafast",
-            "-y",
-            clip_path
-        ]
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode != 0:
-            print("[CLIP] ffmpeg error:", result.stderr)
-        else:
-            print(f"[CLIP] Created {clip_path}")
-    except Exception as e:
+    @staticmethod
+    def position_of(data: bytes):
+        """Position of the newest part listed in a rendered playlist."""
+        msn, parts = 0, 0
+        for ln in data.decode(errors="replace").splitlines():
+            if ln.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                msn = int(ln.split(":", 1)[1])
+            elif ln.startswith("#EXT-X-PART:"):
+                parts += 1
+            elif ln.strip() and not ln.startswith("#"):
+                msn, parts = msn + 1, 0
+        return (msn, parts - 1)
+
+    def position(self, published: bool = False):
+        with self._cond:
+            return self._published if published else self._local
+
+    def wait_for(self, target, published: bool = False, timeout: float = None) -> bool:
+        """Block until the local (or published) position reaches target; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: (self._published if published else self._local) >= target, timeout)
+
+    def mark_published(self, data: bytes):
+        pos = self.position_of(data)
+        with self._cond:
+            if pos > self._published:
+                self._published = pos
+                self._cond.notify_all()
+
+    def refresh(self) -> bool:
+        """Re-read the parts playlist; on change, build finished segments and rewrite PLAYLIST_NAME."""
+        path = os.path.join(self.directory, LL_PARTS_PLAYLIST)
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, "r") as f:
+                lines = [ln.strip() for ln in f]
+        except OSError:
+            return False
+        with self._cond:
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            seq, duration, pdt, listed = 0, None, None, []
+            for ln in lines:
+                if ln.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                    seq = int(ln.split(":", 1)[1])
+                elif ln.startswith("#EXT-X-MAP:"):
+                    self._init = _hls_attr(ln, "URI")
+                elif ln.startswith("#EXTINF:"):
+                    duration = float(ln.split(":", 1)[1].split(",", 1)[0])
+                elif ln.startswith("#EXT-X-PROGRAM-DATE-TIME:"):
+                    pdt = ln
+                elif ln and not ln.startswith("#") and duration is not None:
+                    self._parts.setdefault(seq, (ln, duration, pdt))
+                    listed.append(seq)
+                    seq += 1
+                    duration, pdt = None, None
+            if not listed:
+                return False
+            self._build_segments(oldest_listed=listed[0])
+            data = self._render(newest=max(self._parts))
+            tmp = os.path.join(self.directory, PLAYLIST_NAME + ".tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.directory, PLAYLIST_NAME))
+            self._local = self.position_of(data)
+            self._cond.notify_all()
+            return True
+
+    def _next_msn(self) -> int:
+        if self._segments:
+            return self._segments[-1]["msn"] + 1
+        # parts from before the first whole segment are never listed
+        return -(-min(self._parts) // self.parts_per_segment)
+
+    def _build_segments(self, oldest_listed: int):
+        P = self.parts_per_segment
+        while True:
+            msn = self._next_msn()
+            seqs = range(msn * P, (msn + 1) * P)
+            missing = [s for s in seqs if s not in self._parts]
+            if missing and missing[0] >= oldest_listed:
+                break  # still being encoded
+            uri = self.segment_name(msn)
+            gap = bool(missing)
+            if not gap:
+                tmp = os.path.join(self.directory, uri + ".tmp")
+                try:
+                    with open(tmp, "wb") as out:
+                        for s in seqs:
+                            with open(os.path.join(self.directory, self._parts[s][0]), "rb") as f:
+                                shutil.copyfileobj(f, out)
+                    os.replace(tmp, os.path.join(self.directory, uri))
+                except OSError as e:
+                    print(f"[LL] could not build {uri}: {e}")
+                    gap = True
+            if gap:
+                # parts deleted before they were seen (e.g. a stalled uploader): keep numbering, mark the hole
+                print(f"[LL] segment {msn} is a gap")
+            self._segments.append({
+                "msn": msn,
+                "uri": uri,
+                "duration": sum(self._parts[s][1] for s in seqs if s in self._parts) or P * self.part_sec,
+                "pdt": next((self._parts[s][2] for s in seqs if s in self._parts), None),
+                "gap": gap,
+            })
+        # keep parts only for the segments that still list them (and the one in progress)
+        keep_from = (self._next_msn() - LL_PART_WINDOW) * P
+        for s in [s for s in self._parts if s < keep_from]:
+            del self._parts[s]
+        while len(self._segments) > self.list_size:
+            self._retired.append(self._segments.pop(0)["uri"])
+        # like ffmpeg's delete_segments: drop the live name a little after it leaves the playlist
+        while len(self._retired) > 2:
+            try:
+                os.remove(os.path.join(self.directory, self._retired.pop(0)))
+            except OSError:
+                pass
+
+    def _render(self, newest: int) -> bytes:
+        P = self.parts_per_segment
+        target = max([self.part_sec * P] + [seg["duration"] for seg in self._segments])
+        next_msn = self._next_msn()
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:9",
+            f"#EXT-X-TARGETDURATION:{math.ceil(target)}",
+            f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * self.part_sec:.3f}",
+            f"#EXT-X-PART-INF:PART-TARGET={self.part_sec:.3f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self._segments[0]['msn'] if self._segments else next_msn}",
+            "#EXT-X-INDEPENDENT-SEGMENTS",
+        ]
+        if self._init:
+            lines.append(f'#EXT-X-MAP:URI="{self._init}"')
+
+        def part_lines(msn):
+            out = []
+            for s in range(msn * P, (msn + 1) * P):
+                if s in self._parts:
+                    uri, duration, _ = self._parts[s]
+                    out.append(f'#EXT-X-PART:DURATION={duration:.3f},URI="{uri}",INDEPENDENT=YES')
+            return out
+
+        for seg in self._segments:
+            if seg["pdt"]:
+                lines.append(seg["pdt"])
+            if seg["msn"] >= next_msn - LL_PART_WINDOW and not seg["gap"]:
+                lines += part_lines(seg["msn"])
+            if seg["gap"]:
+                lines.append("#EXT-X-GAP")
+            lines += [f"#EXTINF:{seg['duration']:.3f},", seg["uri"]]
+        in_progress = part_lines(next_msn)
+        if in_progress:
+            pdt = self._parts[next_msn * P][2] if next_msn * P in self._parts else None
+            if pdt:
+                lines.append(pdt)
+            lines += in_progress
+        lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{self.part_name(newest + 1)}"')
+        return ("\n".join(lines) + "\n").encode()
+
+# ---- directory watcher: inotify on Linux, mtime polling elsewhere ----
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+_INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+class DirWatcher:
+    """
+    Reports files that were finished in a directory: closed after writing
+    (IN_CLOSE_WRITE) or renamed into it (IN_MOVED_TO, how ffmpeg publishes
+    playlists). Without inotify it polls playlist mtimes every poll_interval
+    and segments are discovered through the playlist instead. Files in the
+    given subdirectories are reported as "subdir/name".
+    """
+
+    def __init__(self, directory: str, poll_interval: float = POLL_INTERVAL, subdirs=()):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.prefixes = [""] + [f"{d}/" for d in subdirs]
+        self._fd = None
+        self._wds = {}  # watch descriptor -> name prefix
+        self._mtimes = {}
+        if sys.platform.startswith("linux"):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+                if fd < 0:
+                    raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+                for prefix in self.prefixes:
+                    path = os.path.join(directory, prefix)
+                    os.makedirs(path, exist_ok=True)
+                    wd = libc.inotify_add_watch(fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO)
+                    if wd < 0:
+                        err = ctypes.get_errno()
+                        os.close(fd)
+                        raise OSError(err, "inotify_add_watch failed")
+                    self._wds[wd] = prefix
+                self._fd = fd
+            except (OSError, AttributeError) as e:
+                print(f"[WATCH] inotify unavailable, polling {directory}: {e}")
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._fd is not None else "poll"
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def wait(self, timeout: float = 1.0):
+        """Block up to timeout and return the names finished since the last call."""
+        if self._fd is None:
+            time.sleep(self.poll_interval)
+            return self._poll()
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        names = []
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset + _INOTIFY_EVENT.size <= len(buf):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(buf, offset)
+            offset += _INOTIFY_EVENT.size
+            name = buf[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped: make the caller re-read the playlist
+                names.append(PLAYLIST_NAME)
+            elif name:
+                names.append(self._wds.get(wd, "") + name)
+        return names
+
+    def _poll(self):
+        changed = []
+        for prefix in self.prefixes:
+            try:
+                with os.scandir(os.path.join(self.directory, prefix)) as it:
+                    for entry in it:
+                        if not entry.name.endswith(".m3u8"):
+                            continue
+                        name = prefix + entry.name
+                        mtime = entry.stat().st_mtime
+                        if self._mtimes.get(name) != mtime:
+                            self._mtimes[name] = mtime
+                            changed.append(name)
+            except OSError:
+                pass
+        return changed
+
+# ---- uploader: push finished segments and playlists to Supabase Storage ----
+class UploadStats:
+    """Per-kind upload latency histograms (cumulative buckets, Prometheus style) and skip counts."""
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+
+    def _kind(self, kind: str) -> dict:
+        return self._kinds.setdefault(kind, {"count": 0, "errors": 0, "skipped": 0, "sum": 0.0,
+                                             "buckets": [0] * (len(self.BUCKETS) + 1)})
+
+    def skip(self, kind: str):
+        """Count an upload that was not attempted (e.g. a playlist whose segments failed)."""
+        with self._lock:
+            self._kind(kind)["skipped"] += 1
+
+    def observe(self, kind: str, seconds: float, ok: bool = True):
+        with self._lock:
+            h = self._kind(kind)
+            h["count"] += 1
+            h["sum"] += seconds
+            if not ok:
+                h["errors"] += 1
+            h["buckets"][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            out = {}
+            for kind, h in self._kinds.items():
+                cumulative, running = {}, 0
+                for le, n in zip([str(b) for b in self.BUCKETS] + ["+Inf"], h["buckets"]):
+                    running += n
+                    cumulative[le] = running
+                out[kind] = {
+                    "count": h["count"],
+                    "errors": h["errors"],
+                    "skipped": h["skipped"],
+                    "sum": round(h["sum"], 4),
+                    "avg": round(h["sum"] / h["count"], 4) if h["count"] else None,
+                    "buckets": cumulative,
+                }
+            return out
+
+UPLOAD_STATS = UploadStats()
+
+def _upload_kind(remote_path: str) -> str:
+    if remote_path.endswith(".m3u8"):
+        return "playlist"
+    if remote_path.endswith((".ts", ".m4s")):
+        return "segment"
+    if remote_path.startswith("clips/"):
+        return "clip"
+    return "other"
+
+# mimetypes maps .ts to Qt translation files, so media types are explicit
+MEDIA_CONTENT_TYPES = {
+    ".ts": "video/MP2T",
+    ".m4s": "video/iso.segment",
+    ".m3u8": "application/x-mpegURL",
+    ".mp4": "video/mp4",
+}
+
+def _content_type_for(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    return MEDIA_CONTENT_TYPES.get(ext) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+def _storage_upload(remote_path: str, data, content_type: str = None):
+    """data is bytes or an open binary file; files are streamed by httpx in 64 KiB chunks."""
+    # Single POST with x-upsert: overwrites in place, so the live playlist never disappears
+    file_options = {
+        "content-type": content_type or _content_type_for(remote_path),
+        "upsert": "true",
+    }
+    storage_bucket.upload(remote_path, data, file_options=file_options)
+
+TUS_THRESHOLD_BYTES = int(os.getenv("TUS_THRESHOLD_BYTES", 20 * 1024 * 1024))  # resumable upload above this size
+TUS_CHUNK_BYTES = 6 * 1024 * 1024  # Supabase requires 6 MB chunks for resumable uploads
+
+def _tus_upload(local_path: str, remote_path: str, content_type: str = None):
+    """
+    Resumable (TUS) upload, one TUS_CHUNK_BYTES chunk in memory at a time. After a
+    failed chunk the server's Upload-Offset is fetched and the upload resumes there.
+    """
+    size = os.path.getsize(local_path)
+    endpoint = f"{SUPABASE_URL.rstrip('/')}/storage/v1/upload/resumable"
+    headers = {"Authorization": f"Bearer {SUPABASE_KEY}", "apikey": SUPABASE_KEY, "Tus-Resumable": "1.0.0"}
+
+    def b64(value: str) -> str:
+        return base64.b64encode(value.encode()).decode()
+
+    metadata = ",".join([
+        f"bucketName {b64(SUPABASE_BUCKET)}",
+        f"objectName {b64(remote_path)}",
+        f"contentType {b64(content_type or _content_type_for(remote_path))}",
+    ])
+    r = storage_http.post(endpoint, headers={**headers, "Upload-Length": str(size), "Upload-Metadata": metadata, "x-upsert": "true"})
+    r.raise_for_status()
+    location = str(r.url.join(r.headers["Location"]))
+
+    offset, failures = 0, 0
+    with open(local_path, "rb") as f:
+        while offset < size:
+            f.seek(offset)
+            chunk = f.read(TUS_CHUNK_BYTES)
+            try:
+                r = storage_http.patch(location, content=chunk, headers={
+                    **headers,
+                    "Upload-Offset": str(offset),
+                    "Content-Type": "application/offset+octet-stream",
+                })
+                r.raise_for_status()
+                offset = int(r.headers.get("Upload-Offset", offset + len(chunk)))
+            except httpx.HTTPError as e:
+                failures += 1
+                if failures > UPLOAD_RETRIES:
+                    raise
+                print(f"[UP] resumable chunk at {offset} failed ({e}), resuming")
+                head = storage_http.head(location, headers=headers)
+                head.raise_for_status()
+                offset = int(head.headers["Upload-Offset"])
+
+def upload_to_supabase(local_path: str, remote_path: str, content_type: str = None) -> bool:
+    """
+    Upload a file to Supabase storage bucket (overwrites if exists). Returns True on success.
+    The file is streamed from disk; files over TUS_THRESHOLD_BYTES use a resumable upload.
+    """
+    started = time.time()
+    try:
+        if os.path.getsize(local_path) >= TUS_THRESHOLD_BYTES:
+            _tus_upload(local_path, remote_path, content_type=content_type)
+        else:
+            with open(local_path, "rb") as f:
+                _storage_upload(remote_path, f, content_type=content_type)
+        UPLOAD_STATS.observe(_upload_kind(remote_path), time.time() - started)
+        print(f"[UP] Uploaded {local_path} -> {remote_path}")
+        return True
+    except Exception as e:
+        UPLOAD_STATS.observe(_upload_kind(remote_path), time.time() - started, ok=False)
+        print(f"[UP-ERR] Failed upload {local_path} -> {remote_path}: {e}")
+        return False
+
+# ---- upload pipeline: segments upload in parallel, playlists publish in order once their segments landed ----
+UPLOAD_POOL = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")  # shared by every stream
+_publish_lock = threading.Lock()
+_publish_versions = {}  # remote playlist path -> newest queued snapshot
+
+def _upload_with_retry(local_path: str, remote_path: str, content_type: str = None) -> bool:
+    for attempt in range(UPLOAD_RETRIES + 1):
+        if upload_to_supabase(local_path, remote_path, content_type=content_type):
+            return True
+        time.sleep(0.2 * (attempt + 1))
+    return False
+
+def submit_upload(local_path: str, remote_path: str, content_type: str = None):
+    return UPLOAD_POOL.submit(_upload_with_retry, local_path, remote_path, content_type)
+
+def _upload_failed(fut) -> bool:
+    """True for a finished upload future that raised or returned False."""
+    return fut.done() and (fut.exception() is not None or not fut.result())
+
+def _publish_playlist(version: int, data: bytes, waits, remote_path: str, on_published=None, on_skipped=None):
+    failed = 0
+    for fut in waits:
+        try:
+            if not fut.result(timeout=120):
+                failed += 1
+        except Exception as e:
+            print("[UP] segment upload before playlist failed:", e)
+            failed += 1
+    with _publish_lock:
+        if version < _publish_versions.get(remote_path, 0):
+            return  # a newer copy of this playlist is already queued behind us
+    if failed:
+        # never point players at missing segments: the previous playlist stays up until a retry lands
+        UPLOAD_STATS.skip("playlist")
+        print(f"[UP-ERR] Skipped playlist {remote_path}: {failed} segment upload(s) failed")
+        if on_skipped:
+            on_skipped()
+        return
+    started = time.time()
+    try:
+        _storage_upload(remote_path, data, content_type="application/x-mpegURL")
+        UPLOAD_STATS.observe("playlist", time.time() - started)
+        if on_published:
+            on_published(data)
+    except Exception as e:
+        UPLOAD_STATS.observe("playlist", time.time() - started, ok=False)
+        print(f"[UP-ERR] Failed playlist publish {remote_path}: {e}")
+
+def playlist_uris(data: bytes):
+    """
+    Files a playlist snapshot references: URI lines (segments, or variant playlists in a master)
+    plus the EXT-X-MAP init segment and EXT-X-PART parts. Preload hints don't exist yet.
+    """
+    uris = []
+    for ln in data.decode(errors="replace").splitlines():
+        ln = ln.strip()
+        if ln.startswith(("#EXT-X-MAP:", "#EXT-X-PART:")):
+            uri = _hls_attr(ln, "URI")
+            if uri:
+                uris.append(uri)
+        elif ln and not ln.startswith("#"):
+            uris.append(ln)
+    return uris
+
+def publish_playlist(publisher: ThreadPoolExecutor, data: bytes, remote_path: str, waits=(), on_published=None,
+                     on_skipped=None):
+    """
+    Upload a playlist snapshot once every future in waits (its segment uploads)
+    has finished, then call on_published(data). If any of them failed the
+    snapshot is not published and on_skipped() is called instead. Playlists
+    handed to the same single-worker publisher (one per stream) publish one at
+    a time in submission order, and an older snapshot of the same playlist
+    still waiting is dropped.
+    """
+    with _publish_lock:
+        version = _publish_versions.get(remote_path, 0) + 1
+        _publish_versions[remote_path] = version
+    return publisher.submit(_publish_playlist, version, data, list(waits), remote_path, on_published, on_skipped)
+
+def _sync_media_playlist(stream, rel_playlist: str, pending: dict, on_skipped=None) -> bool:
+    """
+    Submit the segments a media playlist lists that are not uploading yet (or
+    whose upload failed), then publish the playlist behind them. Paths are
+    relative to the stream's directory.
+    """
+    local_playlist = os.path.join(stream.out_dir, rel_playlist)
+    try:
+        with open(local_playlist, "rb") as f:
+            data = f.read()
+    except OSError:
+        return False
+    base = posixpath.dirname(rel_playlist)
+    waits = []
+    for uri in playlist_uris(data):
+        key = posixpath.join(base, uri)
+        if key not in pending or _upload_failed(pending[key]):
+            local = os.path.join(stream.out_dir, key)
+            if not os.path.isfile(local):
+                continue
+            pending[key] = submit_upload(local, f"{stream.remote_prefix}/{key}", content_type=_content_type_for(key))
+        waits.append(pending[key])
+    publish_playlist(stream.publisher, data, f"{stream.remote_prefix}/{rel_playlist}", waits,
+                     on_published=stream.ll.mark_published if LL_HLS else None, on_skipped=on_skipped)
+    return True
+
+def upload_new_segments(stream):
+    """
+    Watch a stream's directory (and the ABR variant directories) and upload to Supabase
+    as soon as ffmpeg finishes a file, until the stream is closed. A segment is handed to the upload pool on
+    its close event; when a media playlist changes, any listed segment not seen
+    yet is submitted too (this is also the only path in polling mode), and the
+    playlist is published after the segments it lists have landed. With an ABR
+    ladder the master playlist is published once every variant playlist has been.
+    In LL-HLS mode each change of ffmpeg's parts playlist rebuilds PLAYLIST_NAME first.
+    """
+    watcher = DirWatcher(stream.out_dir, subdirs=ABR_VARIANTS)
+    print(f"[UP] Watching {stream.out_dir} ({watcher.mode}, playlists: {', '.join(MEDIA_PLAYLISTS)})")
+    pending = {}  # segment path relative to the stream directory -> Future, until it drops out of its playlist
+    published = {}  # playlist path -> mtime of the last snapshot handed to the publisher
+    generation = stream.index.generation
+    last_sweep = 0.0
+
+    while not stream.closed.is_set():
+        try:
+            names = watcher.wait(timeout=1.0)
+            if generation != stream.index.generation:
+                # stream restarted: segment names and playlists start over
+                generation = stream.index.generation
+                pending.clear()
+                published.clear()
+            for name in names:
+                if name.endswith(LIVE_MEDIA_SUFFIXES) and name not in pending:
+                    local = os.path.join(stream.out_dir, name)
+                    if os.path.isfile(local):
+                        pending[name] = submit_upload(local, f"{stream.remote_prefix}/{name}",
+                                                      content_type=_content_type_for(name))
+
+            # periodic sweep guards against missed events
+            if PLAYLIST_NAME not in names and LL_PARTS_PLAYLIST not in names \
+                    and not any(p in names for p in MEDIA_PLAYLISTS) and time.time() - last_sweep < 5.0:
+                continue
+            last_sweep = time.time()
+            if LL_HLS:
+                stream.ll.refresh()
+            stream.index.refresh()
+            playlists = MEDIA_PLAYLISTS + ([PLAYLIST_NAME] if ABR_VARIANTS else [])
+            for rel in playlists:
+                local_playlist = os.path.join(stream.out_dir, rel)
+                try:
+                    mtime = os.path.getmtime(local_playlist)
+                except OSError:
+                    continue
+                if published.get(rel) == mtime:
+                    continue
+                if rel in MEDIA_PLAYLISTS:
+                    # a skipped snapshot is synced again on the next sweep, re-submitting its failed segments
+                    published[rel] = mtime
+                    if not _sync_media_playlist(stream, rel, pending, on_skipped=lambda rel=rel: published.pop(rel, None)):
+                        del published[rel]
+                elif all(p in published for p in MEDIA_PLAYLISTS):
+                    # master last: the publisher is FIFO, so every variant it names is already up
+                    with open(local_playlist, "rb") as f:
+                        publish_playlist(stream.publisher, f.read(), f"{stream.remote_prefix}/{rel}")
+                    published[rel] = mtime
+            # forget finished uploads of segments that left the live window
+            for key in [k for k, fut in pending.items() if fut.done() and not os.path.exists(os.path.join(stream.out_dir, k))]:
+                del pending[key]
+        except Exception as e:
+            print("[UP] watcher loop error:", e)
+            time.sleep(POLL_INTERVAL)
+    watcher.close()
+    print(f"[UP] Stopped watching {stream.out_dir}")
+
+# ---- clip engine: build clips from the already-encoded HLS segments ----
+def _segments_for_range(stream, start_time: float, end_time: float):
+    """
+    Locally available segments of a stream covering the range, read from its DVR ring
+    when the live copy has already been deleted. Only the newest contiguous run is
+    returned so an evicted segment never silently cuts a hole in the middle of a clip.
+    """
+    stream.index.refresh()
+    run = []
+    for seg in stream.index.overlapping(start_time, end_time):
+        path = stream.dvr.path_for(seg["uri"])
+        if not path and os.path.isfile(seg["path"]):
+            path = seg["path"]
+        if path and seg["init"]:
+            live_init = os.path.join(os.path.dirname(seg["path"]), seg["init"])
+            seg["init_path"] = stream.dvr.path_for(seg["init"]) or (live_init if os.path.isfile(live_init) else None)
+            if not seg["init_path"]:
+                path = None
+        if not path or (run and seg["seq"] != run[-1]["seq"] + 1):
+            run = []
+        if path:
+            seg["path"] = path
+            run.append(seg)
+    return run
+
+def _fmp4_to_ts(segments, work_dir: str) -> bool:
+    """
+    Remux fMP4 (LL-HLS) segments into standalone mpegts files in work_dir, in place in the
+    segment dicts, so the concat/keyframe/accurate-cut code works on them unchanged.
+    """
+    for i, seg in enumerate(segments):
+        if not seg.get("init_path"):
+            continue
+        out = os.path.join(work_dir, f"seg{i:04d}.ts")
+        # the concat protocol joins init + fragment byte-wise into one playable fMP4 stream
+        command = ["ffmpeg", "-i", f"concat:{seg['init_path']}|{seg['path']}", "-c", "copy", "-f", "mpegts", "-y", out]
+        if not _run_ffmpeg(command):
+            return False
+        seg["path"] = out
+    return True
+
+def _run_ffmpeg(command, tag: str = "[CLIP]") -> bool:
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"{tag} ffmpeg error:", result.stderr)
+        return False
+    return True
+
+def _probe_keyframes(path: str):
+    """Return (start_time, [keyframe pts]) of a segment in its own timestamps, read from packet flags (no decode)."""
+    command = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "format=start_time:packet=pts_time,flags",
+        "-of", "json",
+        path,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {path}: {result.stderr}")
+    info = json.loads(result.stdout or "{}")
+    start = float(info.get("format", {}).get("start_time") or 0.0)
+    keyframes = sorted(
+        float(p["pts_time"]) for p in info.get("packets", [])
+        if "K" in p.get("flags", "") and p.get("pts_time") not in (None, "N/A")
+    )
+    return start, keyframes
+
+def _encode_piece(src: str, from_ts: float, to_ts: float, file_start: float, out_path: str) -> bool:
+    """Frame-accurately re-encode [from_ts, to_ts) of one segment (segment timestamps) to an mpegts piece."""
+    command = [
+        "ffmpeg",
+        "-ss", f"{from_ts - file_start:.3f}",
+        "-i", src,
+        "-t", f"{to_ts - from_ts:.3f}",
+        "-c:v", "libx264",
+        "-preset", "ultrafast",
+        "-c:a", "aac",
+        "-b:a", "128k",
+        "-f", "mpegts",
+        "-y",
+        out_path,
+    ]
+    return _run_ffmpeg(command)
+
+def _concat_copy(entries, out_path: str, work_dir: str, start_offset: float = None, duration: float = None) -> bool:
+    """Concatenate [(path, inpoint, outpoint)] with the concat demuxer and stream copy into an mp4."""
+    list_path = os.path.join(work_dir, "concat.txt")
+    with open(list_path, "w") as f:
+        for path, inpoint, outpoint in entries:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+            if inpoint is not None:
+                f.write(f"inpoint {inpoint:.6f}\n")
+            if outpoint is not None:
+                f.write(f"outpoint {outpoint:.6f}\n")
+    command = ["ffmpeg"]
+    if start_offset is not None:
+        # input-side seek with stream copy snaps to the keyframe at/before the offset
+        command += ["-ss", f"{start_offset:.3f}"]
+    command += ["-f", "concat", "-safe", "0", "-i", list_path]
+    if duration is not None:
+        command += ["-t", f"{duration:.3f}"]
+    command += [
+        "-c", "copy",
+        "-bsf:a", "aac_adtstoasc",
+        "-movflags", "+faststart",
+        "-y",
+        out_path,
+    ]
+    return _run_ffmpeg(command)
+
+def _accurate_entries(segments, start_time: float, end_time: float, work_dir: str):
+    """
+    Concat entries for a frame-accurate clip: only the partial GOPs at both ends are
+    re-encoded, everything between the first and last cut keyframe is stream-copied.
+    """
+    first, last = segments[0], segments[-1]
+    first_start, first_kf = _probe_keyframes(first["path"])
+    cut_in = first_start + max(0.0, start_time - first["start"])
+    if last is first:
+        last_start, last_kf = first_start, first_kf
+    else:
+        last_start, last_kf = _probe_keyframes(last["path"])
+    cut_out = last_start + min(last["duration"], end_time - last["start"])
+
+    head_kf = next((k for k in first_kf if k >= cut_in), None)
+    tail_kf = next((k for k in reversed(last_kf) if k <= cut_out), None)
+    min_piece = 0.04  # ~one frame at 25 fps
+
+    if last is first and (head_kf is None or tail_kf is None or tail_kf < head_kf):
+        # no whole GOP inside the range: re-encode the short span
+        piece = os.path.join(work_dir, "piece.ts")
+        if not _encode_piece(first["path"], cut_in, cut_out, first_start, piece):
+            return None
+        return [(piece, None, None)]
+
+    entries = []
+    if head_kf is None:
+        head_end = first_start + first["duration"]
+    else:
+        head_end = head_kf
+    if head_end - cut_in > min_piece:
+        head = os.path.join(work_dir, "head.ts")
+        if not _encode_piece(first["path"], cut_in, head_end, first_start, head):
+            return None
+        entries.append((head, None, None))
+
+    if last is first:
+        if tail_kf > head_kf:
+            entries.append((first["path"], head_kf, tail_kf))
+    else:
+        if head_kf is not None:
+            entries.append((first["path"], head_kf, None))
+        entries += [(s["path"], None, None) for s in segments[1:-1]]
+        if tail_kf is not None and tail_kf > last_start + min_piece:
+            entries.append((last["path"], None, tail_kf))
+
+    tail_from = tail_kf if tail_kf is not None else last_start
+    if cut_out - tail_from > min_piece:
+        tail = os.path.join(work_dir, "tail.ts")
+        if not _encode_piece(last["path"], tail_from, cut_out, last_start, tail):
+            return None
+        entries.append((tail, None, None))
+    return entries
+
+def build_clip_from_segments(stream, start_time: float, end_time: float, clip_path: str, accurate: bool = False) -> bool:
+    """
+    Build a clip from a stream's local HLS segments covering [start_time, end_time] (stream time).
+    Default mode stream-copies and starts on the keyframe at/before start_time; accurate
+    mode re-encodes only the partial GOPs at the two ends. Returns False if the range
+    is not available locally so the caller can fall back to the source.
+    """
+    segments = _segments_for_range(stream, start_time, end_time)
+    if not segments:
+        return False
+    covered_start = segments[0]["start"]
+    covered_end = segments[-1]["start"] + segments[-1]["duration"]
+    if start_time < covered_start or end_time > covered_end:
+        print(f"[CLIP] Range {start_time:.2f}-{end_time:.2f} clamped to local segments {covered_start:.2f}-{covered_end:.2f}")
+        start_time = max(start_time, covered_start)
+        end_time = min(end_time, covered_end)
+    work_dir = tempfile.mkdtemp(prefix="clipwork_", dir=CLIPS_DIR)
+    try:
+        if not _fmp4_to_ts(segments, work_dir):
+            return False
+        if accurate:
+            entries = _accurate_entries(segments, start_time, end_time, work_dir)
+            if not entries:
+                return False
+            return _concat_copy(entries, clip_path, work_dir)
+        entries = [(s["path"], None, None) for s in segments]
+        return _concat_copy(entries, clip_path, work_dir,
+                            start_offset=start_time - covered_start,
+                            duration=end_time - start_time)
+    except Exception as e:
+        print("[CLIP] segment clip error:", e)
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _clip_from_source(stream, start_time: float, end_time: float, clip_path: str) -> bool:
+    """Fallback: re-decode the stream's original source and re-encode the range."""
+    duration = max(0.1, end_time - start_time)
+    command = [
+        "ffmpeg",
+        "-ss", str(start_time),
+        "-i", stream.source,
+        "-t", str(duration),
+        "-c:v", "libx264",
+        "-c:a", "aac",
+        "-preset", "ultrafast",
+        "-y",
+        clip_path
+    ]
+    return _run_ffmpeg(command)
+
+# ---- routes ----
+@app.route("/")
+def index():
+    # Render the HTML that plays local playlist by default (but your React front-end
+    # can point to the supabase public URL if you prefer).
+    return render_template_string(HTML_PAGE)
+
+@app.route("/videos", methods=["GET"])
+def list_videos():
+    videos = [f for f in os.listdir(".") if f.endswith(".mp4")]
+    stream = STREAMS.get(DEFAULT_STREAM_ID)
+    return jsonify({"videos": videos, "current": stream.source, "profile": stream.profile.to_dict(),
+                    "transcode": stream.transcode, "dvr": stream.dvr.stats()})
+
+@app.route("/profiles", methods=["GET"])
+def list_profiles():
+    """Running, default and preset stream profiles (presets invalid in this mode are reported with the error)."""
+    presets = {}
+    for name, overrides in STREAM_PRESETS.items():
+        try:
+            presets[name] = DEFAULT_STREAM_PROFILE.replace(overrides).to_dict()
+        except ValueError as e:
+            presets[name] = {"error": str(e)}
+    return jsonify({"current": STREAMS.get(DEFAULT_STREAM_ID).profile.to_dict(), "default": DEFAULT_STREAM_PROFILE.to_dict(),
+                    "presets": presets, "low_latency": LL_HLS})
+
+@app.route("/upload", methods=["POST"])
+def upload_video():
+    if "file" not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    f = request.files["file"]
+    if f.filename == "":
+        return jsonify({"error": "No selected file"}), 400
+    if not f.filename.endswith(".mp4"):
+        return jsonify({"error": "Invalid file type"}), 400
+    dest = os.path.join(UPLOAD_DIR, f.filename)
+    f.save(dest)
+    return jsonify({"message": "File uploaded", "filename": f.filename})
+
+@app.route("/start_stream", methods=["POST"])
+def switch_stream():
+    data = request.get_json() or {}
+    filename = data.get("filename")
+    if not filename or not os.path.exists(filename):
+        return jsonify({"error": "File not found"}), 404
+    try:
+        profile = resolve_stream_profile(data.get("profile"), STREAMS.get(DEFAULT_STREAM_ID).profile)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid profile: {e}"}), 400
+    start_transcoding(filename, profile=profile)
+    return jsonify({"message": f"Streaming {filename}", "profile": profile.to_dict()})
+
+@app.route("/clip", methods=["POST"])
+def create_clip():
+    stream = _request_stream()
+    if stream is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    try:
+        data = request.get_json()
+        start_time = float(data.get("start_time", 0))
+        end_time = float(data.get("end_time", 30))
+        if start_time < 0 or end_time <= start_time:
+            return jsonify({"error": "Invalid times"}), 400
+        accurate = bool(data.get("accurate", CLIP_FRAME_ACCURATE))
+        clip_path = _clip_async(stream, start_time, end_time, accurate=accurate)
+        if not clip_path:
+            return jsonify({"error": "Clip creation failed"}), 500
+        return send_file(clip_path, as_attachment=True, download_name=os.path.basename(clip_path))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ---- reaction aggregation and server-side clipping ----
+class SlidingQuantile:
+    """
+    One quantile of a multiset with inserts and removals: two heaps split at the
+    quantile position, with lazy deletion. Items are (value, id) tokens so a
+    removal always hits the exact copy that was inserted. insert()/remove() are
+    O(log n) amortised, query() is O(1) and interpolates linearly between the
+    neighbouring order statistics (the median of an even count is the mean of
+    the middle two).
+    """
+
+    def __init__(self, q: float):
+        self.q = q
+        self._low = []  # max-heap of (-value, -id): the smallest floor(q*(n-1))+1 items
+        self._high = []  # min-heap of (value, id)
+        self._n_low = 0  # live counts (heaps may still hold removed items)
+        self._n_high = 0
+        self._removed = set()
+
+    def __len__(self):
+        return self._n_low + self._n_high
+
+    def _low_top(self):
+        v, i = self._low[0]
+        return -v, -i
+
+    def _prune(self):
+        while self._low and self._low_top() in self._removed:
+            self._removed.discard(self._low_top())
+            heapq.heappop(self._low)
+        while self._high and self._high[0] in self._removed:
+            self._removed.discard(self._high[0])
+            heapq.heappop(self._high)
+
+    def _rebalance(self):
+        n = len(self)
+        target = int(math.floor(self.q * (n - 1))) + 1 if n else 0
+        while self._n_low > target:
+            heapq.heappush(self._high, self._low_top())
+            heapq.heappop(self._low)
+            self._n_low -= 1
+            self._n_high += 1
+            self._prune()
+        while self._n_low < target:
+            v, i = heapq.heappop(self._high)
+            heapq.heappush(self._low, (-v, -i))
+            self._n_low += 1
+            self._n_high -= 1
+            self._prune()
+
+    def insert(self, token):
+        if self._low and token <= self._low_top():
+            heapq.heappush(self._low, (-token[0], -token[1]))
+            self._n_low += 1
+        else:
+            heapq.heappush(self._high, token)
+            self._n_high += 1
+        self._rebalance()
+
+    def remove(self, token):
+        # tokens are unique, so side membership is exact: everything in low is <= its top
+        if self._low and token <= self._low_top():
+            self._n_low -= 1
+        else:
+            self._n_high -= 1
+        self._removed.add(token)
+        self._prune()
+        self._rebalance()
+        if len(self._removed) > 64 and len(self._removed) > len(self):
+            self._compact()
+
+    def _compact(self):
+        self._low = [x for x in self._low if (-x[0], -x[1]) not in self._removed]
+        self._high = [x for x in self._high if x not in self._removed]
+        heapq.heapify(self._low)
+        heapq.heapify(self._high)
+        self._removed.clear()
+
+    def query(self):
+        if not len(self):
+            return None
+        value = self._low_top()[0]
+        frac = self.q * (len(self) - 1) % 1
+        if frac and self._high:
+            value += frac * (self._high[0][0] - value)
+        return value
+
+class QuantileSet:
+    """SlidingQuantile for each configured q, fed with the same values."""
+
+    def __init__(self, quantiles=REACTION_QUANTILES):
+        self._ids = itertools.count()
+        self._by_q = {q: SlidingQuantile(q) for q in quantiles}
+
+    def insert(self, value: float):
+        token = (value, next(self._ids))
+        for sq in self._by_q.values():
+            sq.insert(token)
+        return token
+
+    def remove(self, token):
+        for sq in self._by_q.values():
+            sq.remove(token)
+
+    def query(self, q: float):
+        return self._by_q[q].query()
+
+    def clear(self):
+        self._by_q = {q: SlidingQuantile(q) for q in self._by_q}
+
+class ReactionWindow:
+    """
+    Sliding window of one reaction type, kept as a ring of REACTION_BUCKET_SEC
+    buckets. Only each user's latest reaction is tracked: a user is unique while
+    that reaction's bucket is inside the window. Each bucket remembers which users
+    it holds, so expiring a bucket touches only those users; add() and
+    unique_count() are amortised O(1). The users' latest t values are kept in a
+    QuantileSet (O(log n) per change, O(1) per quantile query).
+    """
+
+    def __init__(self, window_sec: float, bucket_sec: float):
+        self.bucket_sec = bucket_sec
+        self.n_buckets = max(1, math.ceil(window_sec / bucket_sec))
+        self._latest = {}  # user_id -> (bucket_no, quantile token)
+        self._buckets = deque()  # (bucket_no, {user_id}), oldest first
+        self._quantiles = QuantileSet()
+
+    def _expire(self, now_bucket: int):
+        cutoff = now_bucket - self.n_buckets
+        while self._buckets and self._buckets[0][0] <= cutoff:
+            bucket_no, users = self._buckets.popleft()
+            for user_id in users:
+                latest = self._latest.get(user_id)
+                if latest is not None and latest[0] == bucket_no:
+                    del self._latest[user_id]
+                    self._quantiles.remove(latest[1])
+
+    def add(self, user_id: str, t: float, now_ts: float):
+        bucket_no = int(now_ts // self.bucket_sec)
+        if self._buckets and bucket_no < self._buckets[-1][0]:
+            bucket_no = self._buckets[-1][0]  # late arrival (clock read before a racing add): newest bucket
+        self._expire(bucket_no)
+        if not self._buckets or self._buckets[-1][0] != bucket_no:
+            self._buckets.append((bucket_no, set()))
+        # an older bucket may still list this user; it is ignored on expiry
+        self._buckets[-1][1].add(user_id)
+        previous = self._latest.get(user_id)
+        if previous is not None:
+            self._quantiles.remove(previous[1])
+        self._latest[user_id] = (bucket_no, self._quantiles.insert(t))
+
+    def unique_count(self, now_ts: float) -> int:
+        self._expire(int(now_ts // self.bucket_sec))
+        return len(self._latest)
+
+    def quantile(self, q: float, now_ts: float):
+        """Quantile q (one of REACTION_QUANTILES) of the unique users' latest t values."""
+        self._expire(int(now_ts // self.bucket_sec))
+        return self._quantiles.query(q)
+
+    def clear(self):
+        self._latest.clear()
+        self._buckets.clear()
+        self._quantiles.clear()
+
+def _hash64(value: str) -> int:
+    # stable across processes (unlike hash()), so sketches can be merged between workers
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+_HLL_POW2 = [2.0 ** -r for r in range(65)]
+
+def hll_register(h: int, precision: int):
+    """(register index, rank) of a 64-bit hash."""
+    index = h >> (64 - precision)
+    rest = h & ((1 << (64 - precision)) - 1)
+    return index, (64 - precision) - rest.bit_length() + 1
+
+def hll_estimate(inv_sum: float, zeros: int, m: int) -> float:
+    """HyperLogLog cardinality from sum(2^-register) and the number of zero registers."""
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / inv_sum
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)  # linear counting for small cardinalities
+    return estimate
+
+class HLLReactionWindow:
+    """
+    Same interface as ReactionWindow, but unique users are estimated with one
+    HyperLogLog sketch (2 ** precision one-byte registers) per bucket, merged by
+    register-wise max across the window. Memory is fixed regardless of audience
+    size. The merged sketch is updated in O(1) per reaction and rebuilt only when
+    a bucket expires. Client 't' values are kept as a per-bucket reservoir sample
+    feeding a QuantileSet.
+    """
+
+    def __init__(self, window_sec: float, bucket_sec: float, precision: int = HLL_PRECISION, t_sample: int = HLL_T_SAMPLE):
+        self.bucket_sec = bucket_sec
+        self.n_buckets = max(1, math.ceil(window_sec / bucket_sec))
+        self.precision = precision
+        self.m = 1 << precision
+        self.t_sample = t_sample
+        self._buckets = deque()  # (bucket_no, registers, sample tokens, seen), oldest first
+        self._quantiles = QuantileSet()
+        self._reset_merged()
+
+    def _reset_merged(self):
+        self._merged = bytearray(self.m)
+        self._inv_sum = float(self.m)
+        self._zeros = self.m
+
+    def _rebuild_merged(self):
+        self._reset_merged()
+        if self._buckets:
+            regs = [b[1] for b in self._buckets]
+            self._merged = bytearray(map(max, *regs)) if len(regs) > 1 else bytearray(regs[0])
+            self._inv_sum = sum(_HLL_POW2[r] for r in self._merged)
+            self._zeros = self._merged.count(0)
+
+    def _expire(self, now_bucket: int):
+        cutoff = now_bucket - self.n_buckets
+        expired = False
+        while self._buckets and self._buckets[0][0] <= cutoff:
+            for token in self._buckets.popleft()[2]:
+                self._quantiles.remove(token)
+            expired = True
+        if expired:
+            self._rebuild_merged()
+
+    def add(self, user_id: str, t: float, now_ts: float):
+        bucket_no = int(now_ts // self.bucket_sec)
+        if self._buckets and bucket_no < self._buckets[-1][0]:
+            bucket_no = self._buckets[-1][0]  # late arrival (clock read before a racing add): newest bucket
+        self._expire(bucket_no)
+        if not self._buckets or self._buckets[-1][0] != bucket_no:
+            self._buckets.append((bucket_no, bytearray(self.m), [], [0]))
+        _, registers, samples, seen = self._buckets[-1]
+        index, rank = hll_register(_hash64(user_id), self.precision)
+        if rank > registers[index]:
+            registers[index] = rank
+        old = self._merged[index]
+        if rank > old:
+            self._merged[index] = rank
+            self._inv_sum += _HLL_POW2[rank] - _HLL_POW2[old]
+            if old == 0:
+                self._zeros -= 1
+        # reservoir sample of t values for this bucket
+        seen[0] += 1
+        if len(samples) < self.t_sample:
+            samples.append(self._quantiles.insert(t))
+        else:
+            j = random.randrange(seen[0])
+            if j < self.t_sample:
+                self._quantiles.remove(samples[j])
+                samples[j] = self._quantiles.insert(t)
+
+    def unique_count(self, now_ts: float) -> int:
+        self._expire(int(now_ts // self.bucket_sec))
+        if self._zeros == self.m:
+            return 0
+        return int(round(hll_estimate(self._inv_sum, self._zeros, self.m)))
+
+    def quantile(self, q: float, now_ts: float):
+        self._expire(int(now_ts // self.bucket_sec))
+        return self._quantiles.query(q)
+
+    def clear(self):
+        self._buckets.clear()
+        self._quantiles.clear()
+        self._reset_merged()
+
+def quantile_of(sorted_values, q: float):
+    """Quantile of an already sorted list, interpolated the same way as SlidingQuantile."""
+    if not sorted_values:
+        return None
+    pos = q * (len(sorted_values) - 1)
+    lo = int(math.floor(pos))
+    value = sorted_values[lo]
+    if pos > lo:
+        value += (pos - lo) * (sorted_values[lo + 1] - value)
+    return value
+
+def clip_bounds(quantile):
+    """(start_time, end_time) for a trigger, given q -> quantile of the window's t values."""
+    # choose end_time as a quantile (median by default) of client-reported t's to reduce outliers
+    end_time = quantile(CLIP_END_QUANTILE)
+    anchor = min(quantile(CLIP_START_QUANTILE), end_time)
+    return max(0.0, anchor - CLIP_BACK_SECONDS), end_time
+
+def _new_reaction_window():
+    if REACTION_COUNTER == "hll":
+        return HLLReactionWindow(REACTION_WINDOW_SEC, REACTION_BUCKET_SEC)
+    return ReactionWindow(REACTION_WINDOW_SEC, REACTION_BUCKET_SEC)
+
+def _group_by_type(events):
+    """{reaction_type: [(user_id, t), ...]} in arrival order."""
+    grouped = {}
+    for reaction_type, user_id, t in events:
+        grouped.setdefault(reaction_type, []).append((user_id, t))
+    return grouped
+
+class ReactionAggregator:
+    """
+    Reaction windows sharded by reaction type, one lock per shard, so request
+    threads (gunicorn --threads) never see a half-updated window and a burst
+    that crosses the threshold triggers exactly one clip: recording the
+    reaction, checking the threshold and resetting the window happen in one
+    critical section. Different reaction types never contend.
+    """
+
+    def __init__(self, reaction_types=REACTION_TYPES, threshold: int = REACTION_THRESHOLD,
+                 window_factory=None):
+        self.threshold = threshold
+        self._factory = window_factory or _new_reaction_window
+        self._shards = {r: (threading.Lock(), self._factory()) for r in reaction_types}
+
+    def __contains__(self, reaction_type):
+        return reaction_type in self._shards
+
+    def record(self, reaction_type: str, user_id: str, t: float, now_ts: float = None):
+        """
+        Add one reaction. Returns (triggered, start_time, end_time, unique_count);
+        on a trigger the window has already been reset.
+        """
+        now_ts = time.time() if now_ts is None else now_ts
+        lock, window = self._shards[reaction_type]
+        with lock:
+            window.add(user_id, t, now_ts)
+            return self._check_and_reset(window, now_ts)
+
+    def record_many(self, events, now_ts: float = None):
+        """
+        Add (reaction_type, user_id, t) events, taking each shard's lock once.
+        The threshold is still checked after every event, so a batch can trigger
+        (and reset) a window more than once. Returns ([(reaction_type, start_time,
+        end_time, unique_count) per trigger], {reaction_type: unique_count}).
+        """
+        now_ts = time.time() if now_ts is None else now_ts
+        triggers, counts = [], {}
+        for reaction_type, batch in _group_by_type(events).items():
+            lock, window = self._shards[reaction_type]
+            with lock:
+                for user_id, t in batch:
+                    window.add(user_id, t, now_ts)
+                    triggered, start_time, end_time, unique_count = self._check_and_reset(window, now_ts)
+                    if triggered:
+                        triggers.append((reaction_type, start_time, end_time, unique_count))
+                counts[reaction_type] = window.unique_count(now_ts)
+        return triggers, counts
+
+    def _check_and_reset(self, window, now_ts: float):
+        unique_count = window.unique_count(now_ts)
+        if unique_count < self.threshold:
+            return False, None, None, unique_count
+        start_time, end_time = clip_bounds(lambda q: window.quantile(q, now_ts))
+        # Reset reaction window to avoid duplicate triggers
+        window.clear()
+        return True, start_time, end_time, unique_count
+
+    def unique_count(self, reaction_type: str, now_ts: float = None):
+        now_ts = time.time() if now_ts is None else now_ts
+        lock, window = self._shards[reaction_type]
+        with lock:
+            return window.unique_count(now_ts)
+
+    def clear(self):
+        for lock, window in self._shards.values():
+            with lock:
+                window.clear()
+
+class SharedMemoryReactions:
+    """
+    Reaction windows in one multiprocessing.shared_memory segment, so every
+    gunicorn worker on the host counts into the same windows. Each reaction type
+    is a shard holding a ring of per-bucket HyperLogLog sketches, the merged
+    sketch of the window, and a reservoir of t values per bucket. A shard is
+    guarded by an fcntl byte-range lock (between processes) plus a
+    threading.Lock (between threads of one process), so add, threshold check
+    and reset are atomic host-wide and only one worker fires the trigger.
+    """
+
+    MAGIC = 0x41435231
+    _HEADER = struct.Struct("<Idqq")  # magic, inv_sum and zeros of the merged sketch, newest bucket_no + 1
+    _SLOT = struct.Struct("<qq")  # bucket_no + 1 (0 = empty), reactions seen in the bucket
+
+    def __init__(self, name: str = REACTION_SHM_NAME, reaction_types=REACTION_TYPES,
+                 threshold: int = REACTION_THRESHOLD, window_sec: float = REACTION_WINDOW_SEC,
+                 bucket_sec: float = REACTION_BUCKET_SEC, precision: int = HLL_PRECISION,
+                 t_sample: int = HLL_T_SAMPLE):
+        import fcntl
+        from multiprocessing import resource_tracker, shared_memory
+
+        self._fcntl = fcntl
+        self.threshold = threshold
+        self.bucket_sec = bucket_sec
+        self.n_buckets = max(1, math.ceil(window_sec / bucket_sec))
+        self.m = 1 << precision
+        self.precision = precision
+        self.t_sample = t_sample
+        self._types = {r: i for i, r in enumerate(reaction_types)}
+        n = self.n_buckets
+        self._slots_off = self._HEADER.size
+        self._merged_off = self._slots_off + n * self._SLOT.size
+        self._registers_off = self._merged_off + self.m
+        self._samples_off = self._registers_off + n * self.m
+        self._shard_size = self._samples_off + n * t_sample * 8
+        size = self._shard_size * len(self._types)
+        # the layout is part of the name, so workers with different settings never share a segment
+        name = f"{name}_{'_'.join(reaction_types)}_p{precision}_n{n}_s{t_sample}"
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        if self._shm.size < size:
+            raise RuntimeError(f"Shared memory segment {name} is smaller than expected")
+        try:
+            # the segment outlives any single worker; keep the resource tracker from unlinking it at exit
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        except Exception:
+            pass
+        self._buf = self._shm.buf
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_locks = {r: threading.Lock() for r in self._types}
+
+    def __contains__(self, reaction_type):
+        return reaction_type in self._types
+
+    @contextlib.contextmanager
+    def _locked(self, reaction_type: str):
+        """Hold the shard lock; yields the shard's offset in the segment."""
+        shard = self._types[reaction_type]
+        with self._thread_locks[reaction_type]:
+            self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_EX, 1, shard)
+            try:
+                base = shard * self._shard_size
+                if self._HEADER.unpack_from(self._buf, base)[0] != self.MAGIC:
+                    self._reset(base)
+                yield base
+            finally:
+                self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_UN, 1, shard)
+
+    def _reset(self, base: int):
+        self._buf[base:base + self._shard_size] = bytes(self._shard_size)
+        self._HEADER.pack_into(self._buf, base, self.MAGIC, float(self.m), self.m, 0)
+
+    def _slots(self, base: int):
+        """{slot: (bucket_no, reactions seen)} for every occupied slot."""
+        slots = {}
+        for slot in range(self.n_buckets):
+            stored, seen = self._SLOT.unpack_from(self._buf, base + self._slots_off + slot * self._SLOT.size)
+            if stored:
+                slots[slot] = (stored - 1, seen)
+        return slots
+
+    def _advance(self, base: int, now_bucket: int) -> int:
+        """Move the window head to now_bucket, expiring buckets that fell out. Returns the bucket to count in."""
+        _, inv_sum, zeros, newest = self._HEADER.unpack_from(self._buf, base)
+        if newest and now_bucket <= newest - 1:
+            # same bucket, or a late arrival (clock read before a racing add): count it in the newest bucket
+            return newest - 1
+        self._HEADER.pack_into(self._buf, base, self.MAGIC, inv_sum, zeros, now_bucket + 1)
+        slots = self._slots(base)
+        expired = [slot for slot, (b, _) in slots.items() if b <= now_bucket - self.n_buckets]
+        if expired:
+            for slot in expired:
+                self._SLOT.pack_into(self._buf, base + self._slots_off + slot * self._SLOT.size, 0, 0)
+                off = base + self._registers_off + slot * self.m
+                self._buf[off:off + self.m] = bytes(self.m)
+            self._rebuild_merged(base, sorted(slots.keys() - set(expired)))
+        return now_bucket
+
+    def _rebuild_merged(self, base: int, slots):
+        sketches = [bytes(self._buf[base + self._registers_off + s * self.m:base + self._registers_off + (s + 1) * self.m])
+                    for s in slots]
+        merged = bytes(map(max, *sketches)) if len(sketches) > 1 else (sketches[0] if sketches else bytes(self.m))
+        self._buf[base + self._merged_off:base + self._merged_off + self.m] = merged
+        newest = self._HEADER.unpack_from(self._buf, base)[3]
+        self._HEADER.pack_into(self._buf, base, self.MAGIC, sum(_HLL_POW2[r] for r in merged), merged.count(0), newest)
+
+    def _estimate(self, base: int) -> int:
+        _, inv_sum, zeros, _ = self._HEADER.unpack_from(self._buf, base)
+        return int(round(hll_estimate(inv_sum, zeros, self.m)))
+
+    def record(self, reaction_type: str, user_id: str, t: float, now_ts: float = None):
+        now_ts = time.time() if now_ts is None else now_ts
+        with self._locked(reaction_type) as base:
+            return self._record_locked(base, user_id, t, now_ts)
+
+    def record_many(self, events, now_ts: float = None):
+        """Same contract as ReactionAggregator.record_many; one shard lock per reaction type."""
+        now_ts = time.time() if now_ts is None else now_ts
+        triggers, counts = [], {}
+        for reaction_type, batch in _group_by_type(events).items():
+            with self._locked(reaction_type) as base:
+                for user_id, t in batch:
+                    triggered, start_time, end_time, unique_count = self._record_locked(base, user_id, t, now_ts)
+                    if triggered:
+                        triggers.append((reaction_type, start_time, end_time, unique_count))
+                counts[reaction_type] = self._estimate(base)
+        return triggers, counts
+
+    def _record_locked(self, base: int, user_id: str, t: float, now_ts: float):
+        bucket_no = self._advance(base, int(now_ts // self.bucket_sec))
+        slot = bucket_no % self.n_buckets
+        slot_off = base + self._slots_off + slot * self._SLOT.size
+        stored, seen = self._SLOT.unpack_from(self._buf, slot_off)
+        seen = seen + 1 if stored else 1  # any older bucket in this slot was expired by _advance
+        self._SLOT.pack_into(self._buf, slot_off, bucket_no + 1, seen)
+        index, rank = hll_register(_hash64(user_id), self.precision)
+        reg = base + self._registers_off + slot * self.m + index
+        if self._buf[reg] < rank:
+            self._buf[reg] = rank
+        merged = base + self._merged_off + index
+        old = self._buf[merged]
+        if old < rank:
+            self._buf[merged] = rank
+            _, inv_sum, zeros, newest = self._HEADER.unpack_from(self._buf, base)
+            self._HEADER.pack_into(self._buf, base, self.MAGIC, inv_sum + _HLL_POW2[rank] - _HLL_POW2[old],
+                                   zeros - (old == 0), newest)
+        # reservoir sample of t values for this bucket
+        j = seen - 1 if seen <= self.t_sample else random.randrange(seen)
+        if j < self.t_sample:
+            struct.pack_into("<d", self._buf, base + self._samples_off + (slot * self.t_sample + j) * 8, t)
+
+        unique_count = self._estimate(base)
+        if unique_count < self.threshold:
+            return False, None, None, unique_count
+        values = []
+        for s, (_, s_seen) in self._slots(base).items():
+            count = min(s_seen, self.t_sample)
+            values.extend(struct.unpack_from(f"<{count}d", self._buf, base + self._samples_off + s * self.t_sample * 8))
+        values.sort()
+        start_time, end_time = clip_bounds(lambda q: quantile_of(values, q))
+        self._reset(base)
+        return True, start_time, end_time, unique_count
+
+    def unique_count(self, reaction_type: str, now_ts: float = None):
+        now_ts = time.time() if now_ts is None else now_ts
+        with self._locked(reaction_type) as base:
+            self._advance(base, int(now_ts // self.bucket_sec))
+            return self._estimate(base)
+
+    def clear(self):
+        for reaction_type in self._types:
+            with self._locked(reaction_type) as base:
+                self._reset(base)
+
+    def destroy(self):
+        """Remove the segment and its lock file (benchmarks/tests; workers leave it for each other)."""
+        from multiprocessing import resource_tracker
+
+        resource_tracker.register(self._shm._name, "shared_memory")  # unlink() unregisters it again
+        self._shm.close()
+        self._shm.unlink()
+        os.close(self._lock_fd)
+        try:
+            os.remove(self._lock_path)
+        except OSError:
+            pass
+
+class MemoryRedis:
+    """
+    In-process stand-in for the few Redis commands RedisReactions uses
+    (REDIS_URL=memory://), with the same expiry and SET NX PX semantics.
+    PFCOUNT is exact. Scripts run the Python twin registered in SCRIPTS for
+    their Lua source, under the store lock. Only shared within one process:
+    for local runs and tests.
+    """
+    SCRIPTS = {}  # Lua source -> fn(store, keys, args)
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+        self._expires = {}
+
+    def _get(self, key):
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        with self._lock:
+            if nx and self._get(key) is not None:
+                return None
+            self._data[key] = str(value)
+            self._expires.pop(key, None)
+            if px:
+                self._expires[key] = time.time() + px / 1000.0
+            return True
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._get(key) or 0) + 1
+            self._data[key] = str(value)
+            return value
+
+    def pexpire(self, key, ms):
+        with self._lock:
+            if self._get(key) is None:
+                return False
+            self._expires[key] = time.time() + ms / 1000.0
+            return True
+
+    def pfadd(self, key, *values):
+        with self._lock:
+            members = self._get(key)
+            if members is None:
+                members = self._data[key] = set()
+            before = len(members)
+            members.update(str(v) for v in values)
+            return int(len(members) > before)
+
+    def pfcount(self, *keys):
+        with self._lock:
+            union = set()
+            for key in keys:
+                union |= self._get(key) or set()
+            return len(union)
+
+    def lpush(self, key, *values):
+        with self._lock:
+            items = self._get(key)
+            if items is None:
+                items = self._data[key] = []
+            for v in values:
+                items.insert(0, str(v))
+            return len(items)
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            items = self._get(key)
+            if items is not None:
+                items[:] = items[start:None if end == -1 else end + 1]
+            return True
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            items = self._get(key) or []
+            return list(items[start:None if end == -1 else end + 1])
+
+    def pipeline(self):
+        return _MemoryPipeline(self)
+
+    def register_script(self, script: str):
+        fn = self.SCRIPTS[script]
+
+        def run(keys=(), args=()):
+            with self._lock:
+                return fn(self, list(keys), [str(a) for a in args])
+        return run
+
+class _MemoryPipeline:
+    """Queued commands run back to back under the store lock (like MULTI/EXEC)."""
+
+    def __init__(self, store: MemoryRedis):
+        self._store = store
+        self._calls = []
+
+    def __getattr__(self, name):
+        def queue_call(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        return queue_call
+
+    def execute(self):
+        with self._store._lock:
+            calls, self._calls = self._calls, []
+            return [getattr(self._store, name)(*args, **kwargs) for name, args, kwargs in calls]
+
+class RedisReactions:
+    """
+    Reaction windows in Redis, shared by all workers on all hosts. Per reaction
+    type and epoch, each bucket is a PFADD sketch of user ids plus a capped list
+    of the latest t values, both expiring one window after their bucket; the
+    window count is PFCOUNT (union) over the live bucket keys. Recording a
+    batch, counting the window and, on a crossing, bumping the epoch run as one
+    Lua script, so exactly one batch fires per epoch and no reaction is written
+    into an epoch that another worker has already rolled over.
+    """
+    # KEYS: epoch key. ARGV: prefix, type, now bucket, buckets, ttl ms, t sample, threshold, n, n user ids, n t values.
+    # Returns {unique count, 1 if triggered}, followed on a trigger by the window's t values.
+    RECORD_SCRIPT = """
+local epoch = tonumber(redis.call('GET', KEYS[1]) or '0')
+local base = ARGV[1] .. ARGV[2] .. ':' .. epoch .. ':'
+local now_bucket, n_buckets = tonumber(ARGV[3]), tonumber(ARGV[4])
+local ttl, t_sample, threshold, n = tonumber(ARGV[5]), tonumber(ARGV[6]), tonumber(ARGV[7]), tonumber(ARGV[8])
+local users_key, times_key = base .. 'u:' .. now_bucket, base .. 't:' .. now_bucket
+redis.call('PFADD', users_key, unpack(ARGV, 9, 8 + n))
+redis.call('PEXPIRE', users_key, ttl)
+redis.call('LPUSH', times_key, unpack(ARGV, 9 + n, 8 + 2 * n))
+redis.call('LTRIM', times_key, 0, t_sample - 1)
+redis.call('PEXPIRE', times_key, ttl)
+local live = {}
+for b = now_bucket - n_buckets + 1, now_bucket do table.insert(live, base .. 'u:' .. b) end
+local count = redis.call('PFCOUNT', unpack(live))
+if count < threshold then return {count, 0} end
+redis.call('INCR', KEYS[1])
+local out = {count, 1}
+for b = now_bucket - n_buckets + 1, now_bucket do
+  for _, t in ipairs(redis.call('LRANGE', base .. 't:' .. b, 0, -1)) do table.insert(out, t) end
+end
+return out
+"""
+
+    def __init__(self, client, reaction_types=REACTION_TYPES, threshold: int = REACTION_THRESHOLD,
+                 window_sec: float = REACTION_WINDOW_SEC, bucket_sec: float = REACTION_BUCKET_SEC,
+                 t_sample: int = HLL_T_SAMPLE, prefix: str = REDIS_PREFIX):
+        self._r = client
+        self._types = set(reaction_types)
+        self.threshold = threshold
+        self.bucket_sec = bucket_sec
+        self.n_buckets = max(1, math.ceil(window_sec / bucket_sec))
+        self.t_sample = t_sample
+        self.prefix = prefix
+        self._ttl_ms = int((window_sec + bucket_sec) * 1000)
+        self._record_script = client.register_script(self.RECORD_SCRIPT)
+
+    def __contains__(self, reaction_type):
+        return reaction_type in self._types
+
+    def _epoch(self, reaction_type: str) -> int:
+        return int(self._r.get(f"{self.prefix}{reaction_type}:epoch") or 0)
+
+    def _key(self, reaction_type: str, epoch: int, kind: str, bucket_no=None) -> str:
+        key = f"{self.prefix}{reaction_type}:{epoch}:{kind}"
+        return key if bucket_no is None else f"{key}:{bucket_no}"
+
+    def _live_keys(self, reaction_type: str, epoch: int, kind: str, now_bucket: int):
+        return [self._key(reaction_type, epoch, kind, b) for b in range(now_bucket - self.n_buckets + 1, now_bucket + 1)]
+
+    def record(self, reaction_type: str, user_id: str, t: float, now_ts: float = None):
+        now_ts = time.time() if now_ts is None else now_ts
+        return self._record_batch(reaction_type, [(user_id, t)], now_ts)
+
+    def record_many(self, events, now_ts: float = None):
+        """
+        Same contract as ReactionAggregator.record_many, but each reaction type's
+        batch is one pipeline and the threshold is checked once per batch.
+        """
+        now_ts = time.time() if now_ts is None else now_ts
+        triggers, counts = [], {}
+        for reaction_type, batch in _group_by_type(events).items():
+            triggered, start_time, end_time, unique_count = self._record_batch(reaction_type, batch, now_ts)
+            if triggered:
+                triggers.append((reaction_type, start_time, end_time, unique_count))
+                unique_count = 0  # the winner moved on to a fresh epoch
+            counts[reaction_type] = unique_count
+        return triggers, counts
+
+    def _record_batch(self, reaction_type: str, batch, now_ts: float):
+        args = [self.prefix, reaction_type, int(now_ts // self.bucket_sec), self.n_buckets, self._ttl_ms,
+                self.t_sample, self.threshold, len(batch)]
+        args += [user_id for user_id, _ in batch] + [repr(float(t)) for _, t in batch]
+        result = self._record_script(keys=[f"{self.prefix}{reaction_type}:epoch"], args=args)
+        unique_count = int(result[0])
+        if not int(result[1]):
+            return False, None, None, unique_count
+        values = sorted(float(v) for v in result[2:])
+        start_time, end_time = clip_bounds(lambda q: quantile_of(values, q))
+        return True, start_time, end_time, unique_count
+
+    @staticmethod
+    def _record_in_memory(store: MemoryRedis, keys, args):
+        """RECORD_SCRIPT for MemoryRedis; runs under the store lock, so it is just as atomic."""
+        epoch = int(store.get(keys[0]) or 0)
+        base = f"{args[0]}{args[1]}:{epoch}:"
+        now_bucket, n_buckets, ttl, t_sample, threshold, n = (int(a) for a in args[2:8])
+        users_key, times_key = f"{base}u:{now_bucket}", f"{base}t:{now_bucket}"
+        store.pfadd(users_key, *args[8:8 + n])
+        store.pexpire(users_key, ttl)
+        store.lpush(times_key, *args[8 + n:8 + 2 * n])
+        store.ltrim(times_key, 0, t_sample - 1)
+        store.pexpire(times_key, ttl)
+        buckets = range(now_bucket - n_buckets + 1, now_bucket + 1)
+        count = store.pfcount(*(f"{base}u:{b}" for b in buckets))
+        if count < threshold:
+            return [count, 0]
+        store.incr(keys[0])
+        return [count, 1] + [t for b in buckets for t in store.lrange(f"{base}t:{b}", 0, -1)]
+
+    def unique_count(self, reaction_type: str, now_ts: float = None):
+        now_ts = time.time() if now_ts is None else now_ts
+        epoch = self._epoch(reaction_type)
+        return int(self._r.pfcount(*self._live_keys(reaction_type, epoch, "u", int(now_ts // self.bucket_sec))))
+
+    def clear(self):
+        for reaction_type in self._types:
+            self._r.incr(f"{self.prefix}{reaction_type}:epoch")
+
+
+MemoryRedis.SCRIPTS[RedisReactions.RECORD_SCRIPT] = RedisReactions._record_in_memory
+
+def _redis_client(url: str):
+    if url.startswith("memory://"):
+        return MemoryRedis()
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("REACTION_BACKEND=redis needs the 'redis' package (pip install redis)")
+    return redis.Redis.from_url(url)
+
+def _new_reaction_backend(stream_id: str = DEFAULT_STREAM_ID):
+    """
+    Reaction windows of one stream: {reaction_type: window}, in this process, in shared memory,
+    or in Redis. The default stream keeps the configured segment name and key prefix.
+    """
+    default = stream_id == DEFAULT_STREAM_ID
+    if REACTION_BACKEND == "shm":
+        return SharedMemoryReactions(REACTION_SHM_NAME if default else f"{REACTION_SHM_NAME}_{stream_id}")
+    if REACTION_BACKEND == "redis":
+        return RedisReactions(_redis_client(REDIS_URL),
+                              prefix=REDIS_PREFIX if default else f"{REDIS_PREFIX}stream:{stream_id}:")
+    return ReactionAggregator()
+
+def _clip_async(stream, start_time: float, end_time: float, accurate: bool = CLIP_FRAME_ACCURATE):
+    """Cut [start_time, end_time] of a stream into CLIPS_DIR. Returns the clip path, or None on failure."""
+    try:
+        clip_filename = f"clip_{uuid.uuid4().hex[:8]}_{int(start_time)}_{int(end_time)}.mp4"
+        clip_path = os.path.join(CLIPS_DIR, clip_filename)
+        started = time.time()
+        if build_clip_from_segments(stream, start_time, end_time, clip_path, accurate=accurate):
+            print(f"[CLIP] Created {clip_path} from segments in {time.time() - started:.2f}s")
+            return clip_path
+        # range no longer (or not yet) in the local segments: re-encode from the source
+        if not _clip_from_source(stream, start_time, end_time, clip_path):
+            return None
+        print(f"[CLIP] Created {clip_path} from source in {time.time() - started:.2f}s")
+        return clip_path
+    except Exception as e:
         print("[CLIP] Exception:", e)
+        return None
+
+# ---- stream registry: many channels per process, admitted while the host has CPU headroom ----
+class HostCpuSampler:
+    """
+    Busy cores on the host, measured from /proc/stat every STREAM_CPU_SAMPLE_SEC on a
+    background thread so request handlers only read the last value and never wait for
+    a sample. Before the first sample, or without /proc/stat, it is the 1-minute load average.
+    """
+
+    def __init__(self, period: float):
+        self.period = period
+        self._busy = None
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    @staticmethod
+    def _read():
+        with open("/proc/stat") as f:
+            values = [int(v) for v in f.readline().split()[1:9]]  # user .. steal (guest time is inside user)
+        return sum(values), values[3] + values[4]  # total, idle + iowait
+
+    def _sample_loop(self):
+        last = None
+        while True:
+            try:
+                total, idle = self._read()
+            except (OSError, ValueError, IndexError) as e:
+                print("[STREAMS] CPU sampling unavailable, using the load average:", e)
+                self._busy = None
+                return
+            if last and total > last[0]:
+                self._busy = (os.cpu_count() or 1) * (1.0 - (idle - last[1]) / (total - last[0]))
+            last = (total, idle)
+            time.sleep(self.period)
+
+    def ensure_sampler(self):
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name="cpu-sampler", daemon=True)
+                self._sampler.start()
+
+    def busy(self) -> float:
+        self.ensure_sampler()
+        if self._busy is not None:
+            return self._busy
+        try:
+            return os.getloadavg()[0]
+        except (OSError, AttributeError):
+            return 0.0
+
+HOST_CPU = HostCpuSampler(STREAM_CPU_SAMPLE_SEC)
+
+def _valid_stream_id(stream_id) -> bool:
+    return (isinstance(stream_id, str) and 0 < len(stream_id) <= 64 and stream_id[0] not in "-_"
+            and all(c in STREAM_ID_CHARS for c in stream_id))
+
+class AdmissionRejected(Exception):
+    """A stream start refused by admission control (the message says why)."""
+
+class StreamRegistry:
+    """
+    Streams of this process by id. The default stream always exists and keeps the original
+    endpoints (/start_stream, /live/stream.m3u8, reactions without ?stream=); others are
+    started by POST /streams and removed by DELETE /streams/<id>.
+    Admission: a start goes ahead only if the new encoder's estimated cores (stream_cpu_cost
+    of the probed transcode path) fit under STREAM_CPU_MAX_UTIL of the host's cores, after the
+    measured busy cores and the estimates of streams admitted too recently to show in that
+    measurement. The default stream is always admitted, so the main channel never fails to
+    (re)start on a busy host, but its estimate counts against the others.
+    With several gunicorn workers each has its own registry: run the stream manager in one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {DEFAULT_STREAM_ID: LiveStream(DEFAULT_STREAM_ID, HLS_OUTPUT_DIR, DVR_DIR, "live")}
+        self._starting = {}  # stream id -> LiveStream being created, until its first start finishes
+
+    def get(self, stream_id: str):
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def all(self):
+        with self._lock:
+            return list(self._streams.values())
+
+    def start(self, stream_id: str, source: str, input_headers=None, profile: StreamProfile = None) -> bool:
+        """
+        Start a stream, or restart it with a new source/profile. Returns True if it was created.
+        Raises ValueError for a bad id and AdmissionRejected when the host has no room for it.
+        """
+        if not _valid_stream_id(stream_id):
+            raise ValueError("stream id must be 1-64 characters of a-z, 0-9, '-' and '_', starting with a letter or digit")
+        with self._lock:
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                if stream_id in self._starting:
+                    raise AdmissionRejected(f"stream {stream_id} is already starting")
+                if len(self._streams) + len(self._starting) >= STREAM_MAX_COUNT:
+                    raise AdmissionRejected(f"stream limit reached ({STREAM_MAX_COUNT})")
+                stream = LiveStream(stream_id, os.path.join(STREAMS_DIR, stream_id),
+                                    os.path.join(DVR_DIR, stream_id), f"live/streams/{stream_id}")
+                self._starting[stream_id] = stream
+                created = True
+            else:
+                created = False
+        try:
+            stream.start(source, input_headers, profile, admit=self.admit)
+        except Exception:
+            if created:
+                with self._lock:
+                    del self._starting[stream_id]
+                stream.close()
+            raise
+        if created:
+            with self._lock:
+                del self._starting[stream_id]
+                self._streams[stream_id] = stream
+            print(f"[STREAMS] Added {stream_id} ({len(self._streams)} running)")
+        return created
+
+    def stop(self, stream_id: str) -> bool:
+        """Stop a stream; any but the default one is also removed with its local files. False if unknown."""
+        with self._lock:
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                return False
+            if stream_id != DEFAULT_STREAM_ID:
+                del self._streams[stream_id]
+        if stream_id == DEFAULT_STREAM_ID:
+            stream.stop()
+        else:
+            stream.close()
+            print(f"[STREAMS] Removed {stream_id}")
+        return True
+
+    def admit(self, stream, cost: float):
+        """Reserve cost cores for a stream's encoder, or raise AdmissionRejected (see the class docstring)."""
+        busy = HOST_CPU.busy() if stream.id != DEFAULT_STREAM_ID else 0.0
+        with self._lock:
+            now_ts = time.time()
+            if stream.id != DEFAULT_STREAM_ID:
+                capacity, recent = self._capacity(), self._recent_estimates(now_ts, exclude=stream)
+                # a restart replaces the stream's own encoder, whose load is part of the measurement
+                free = capacity - busy - recent + (stream.cpu_estimate if stream.running else 0.0)
+                if cost > free:
+                    print(f"[STREAMS] Rejected {stream.id}: needs ~{cost:g} cores, {max(0.0, free):.2f} free")
+                    raise AdmissionRejected(
+                        f"not enough CPU headroom: needs ~{cost:g} cores, {max(0.0, free):.2f} of {capacity:.2f} free")
+            stream.cpu_estimate, stream.admitted = cost, now_ts
+
+    def _capacity(self) -> float:
+        return (os.cpu_count() or 1) * STREAM_CPU_MAX_UTIL
+
+    def _recent_estimates(self, now_ts: float, exclude=None) -> float:
+        streams = list(self._streams.values()) + list(self._starting.values())
+        return sum(s.cpu_estimate for s in streams if s is not exclude and s.admitted
+                   and now_ts - s.admitted < STREAM_CPU_SETTLE_SEC)
+
+    def capacity(self) -> dict:
+        busy = HOST_CPU.busy()
+        with self._lock:
+            recent = self._recent_estimates(time.time())
+            count = len(self._streams)
+        capacity = self._capacity()
+        return {"cores": os.cpu_count() or 1, "max_util": STREAM_CPU_MAX_UTIL, "busy_cores": round(busy, 2),
+                "settling_cores": round(recent, 2), "free_cores": round(max(0.0, capacity - busy - recent), 2),
+                "streams": count, "max_streams": STREAM_MAX_COUNT}
+
+STREAMS = StreamRegistry()
+
+def _request_stream():
+    """Stream named by ?stream= (the default stream without it), or None if it is not running here."""
+    return STREAMS.get(request.args.get("stream") or DEFAULT_STREAM_ID)
+
+@app.route("/streams", methods=["GET"])
+def list_streams():
+    return jsonify({"streams": [s.status() for s in STREAMS.all()], "capacity": STREAMS.capacity()})
+
+@app.route("/streams", methods=["POST"])
+def start_stream():
+    """
+    Start a stream: {"id", "source" (local file or http(s) URL), "headers", "profile"}.
+    Starting an existing id restarts it. 201 when created, 503 when admission refuses it.
+    """
+    try:
+        data = request.get_json() or {}
+        stream_id = data.get("id")
+        source = data.get("source")
+        if not source or not isinstance(source, str):
+            return jsonify({"error": "source is required"}), 400
+        if not source.startswith(("http://", "https://")) and not os.path.exists(source):
+            return jsonify({"error": "File not found"}), 404
+        headers_obj = data.get("headers") or {}
+        if isinstance(headers_obj, dict):
+            headers_list = [f"{k}: {v}" for k, v in headers_obj.items()]
+        else:
+            headers_list = [str(h) for h in headers_obj] if isinstance(headers_obj, list) else []
+        existing = STREAMS.get(stream_id) if isinstance(stream_id, str) else None
+        try:
+            profile = resolve_stream_profile(data.get("profile"), existing.profile if existing else None)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid profile: {e}"}), 400
+        try:
+            created = STREAMS.start(stream_id, source, headers_list or None, profile)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except AdmissionRejected as e:
+            return jsonify({"error": str(e), "capacity": STREAMS.capacity()}), 503
+        return jsonify({"ok": True, "stream": STREAMS.get(stream_id).status()}), 201 if created else 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-def _maybe_trigger_clip(reaction_type: str):
+@app.route("/streams/<stream_id>", methods=["GET"])
+def stream_status(stream_id):
+    stream = STREAMS.get(stream_id)
+    if stream is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    return jsonify({"ok": True, "stream": stream.status()})
+
+@app.route("/streams/<stream_id>", methods=["DELETE"])
+def stop_stream(stream_id):
+    """Stop a stream; the default one only stops its ffmpeg, any other is removed."""
+    try:
+        if not STREAMS.stop(stream_id):
+            return jsonify({"error": "Unknown stream"}), 404
+        return jsonify({"ok": True, "stopped": stream_id, "removed": stream_id != DEFAULT_STREAM_ID})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ---- clip job queue: /react enqueues, a small worker pool runs ffmpeg + upload ----
+def _update_clip_job(job_id: str, **fields):
+    with CLIP_JOBS_LOCK:
+        job = CLIP_JOBS.get(job_id)
+        if job is not None:
+            job.update(fields)
+            job["updated"] = time.time()
+            snapshot = dict(job)
+    if job is not None:
+        _clip_job_changed(snapshot)
+
+def _clip_job_changed(snapshot: dict):
+    """Record a job's new state in the clip store and push it to realtime clients."""
+    try:
+        CLIP_CATALOG.track_job(snapshot)
+    except Exception as e:
+        print("[CLIPS] store error:", e)
+    REALTIME.publish({"type": "clip_job", "job": snapshot}, snapshot["stream"])
+
+def _prune_clip_jobs(now_ts: float):
+    cutoff = now_ts - CLIP_JOB_TTL_SEC
+    with CLIP_JOBS_LOCK:
+        for job_id in [k for k, j in CLIP_JOBS.items() if j["status"] in ("ready", "failed") and j["updated"] < cutoff]:
+            del CLIP_JOBS[job_id]
+
+def enqueue_clip_job(start_time: float, end_time: float, reaction_type: str = None, engagement_count: int = 0,
+                     stream_id: str = DEFAULT_STREAM_ID):
+    """Register a clip job and hand it to the worker pool. Returns the job dict, or None if the queue is full."""
     now_ts = time.time()
-    _purge_old_events(now_ts)
-    events = REACTION_EVENTS.get(reaction_type, [])
-    # Map latest event per user within window
-    latest_by_user = {}
-    for e in events:
-        latest_by_user[e["user_id"]] = e
-    unique_count = len(latest_by_user)
-    if unique_count >= REACTION_THRESHOLD:
-        # choose end_time as median of client-reported t's to reduce outliers
-        times = sorted(ev["t"] for ev in latest_by_user.values())
-        mid = len(times) // 2
-        if len(times) % 2 == 1:
-            end_time = times[mid]
+    _prune_clip_jobs(now_ts)
+    _ensure_clip_workers()
+    job = {
+        "id": uuid.uuid4().hex,
+        "stream": stream_id,
+        "status": "queued",
+        "start": start_time,
+        "end": end_time,
+        "reaction": reaction_type,
+        "engagement_count": engagement_count,
+        "created": now_ts,
+        "updated": now_ts,
+        "path": None,
+        "public_url": None,
+        "error": None,
+    }
+    with CLIP_JOBS_LOCK:
+        CLIP_JOBS[job["id"]] = job
+        snapshot = dict(job)
+    try:
+        CLIP_JOB_QUEUE.put_nowait(job["id"])
+    except queue.Full:
+        with CLIP_JOBS_LOCK:
+            CLIP_JOBS.pop(job["id"], None)
+        return None
+    _clip_job_changed(snapshot)
+    return snapshot
+
+def _claim_clip_job(job_id: str):
+    """Move a queued job to processing and return its snapshot; atomic with extend_clip_job."""
+    with CLIP_JOBS_LOCK:
+        job = CLIP_JOBS.get(job_id)
+        if job is None:
+            return None
+        job["status"] = "processing"
+        job["updated"] = time.time()
+        snapshot = dict(job)
+    _clip_job_changed(snapshot)
+    return snapshot
+
+def extend_clip_job(job_id: str, start_time: float, end_time: float, engagement_count: int):
+    """Widen a still-queued job to cover [start_time, end_time]. Returns the snapshot, or None if it already started."""
+    with CLIP_JOBS_LOCK:
+        job = CLIP_JOBS.get(job_id)
+        if job is None or job["status"] != "queued":
+            return None
+        job["start"] = min(job["start"], start_time)
+        job["end"] = max(job["end"], end_time)
+        job["engagement_count"] += engagement_count
+        job["merged"] = job.get("merged", 0) + 1
+        job["updated"] = time.time()
+        snapshot = dict(job)
+    _clip_job_changed(snapshot)
+    return snapshot
+
+def _run_clip_job(job_id: str):
+    job = _claim_clip_job(job_id)
+    if not job:
+        return
+    stream = STREAMS.get(job["stream"])
+    if stream is None:
+        _update_clip_job(job_id, status="failed", error="Stream stopped")
+        return
+    clip_path = _clip_async(stream, job["start"], job["end"])
+    if not clip_path:
+        _update_clip_job(job_id, status="failed", error="Clip creation failed")
+        return
+    # Upload to Supabase Storage under clips/
+    remote_path = f"clips/{os.path.basename(clip_path)}"
+    if not _upload_with_retry(clip_path, remote_path, content_type="video/mp4"):
+        _update_clip_job(job_id, status="failed", error="Clip upload failed")
+        return
+    public_url = public_url_for(remote_path)
+    _update_clip_job(job_id, status="ready", path=remote_path, public_url=public_url, size=os.path.getsize(clip_path))
+    print(f"[CLIP JOB] {job_id} ready '{job['reaction']}' t={job['end']:.2f} (start {job['start']:.2f}) -> {remote_path}")
+
+def _clip_worker():
+    while True:
+        job_id = CLIP_JOB_QUEUE.get()
+        try:
+            _run_clip_job(job_id)
+        except Exception as e:
+            print("[CLIP JOB] worker error:", e)
+            _update_clip_job(job_id, status="failed", error=str(e))
+        finally:
+            CLIP_JOB_QUEUE.task_done()
+
+_clip_workers = []  # the worker threads, started once on the first job
+_clip_workers_lock = threading.Lock()
+
+def _ensure_clip_workers():
+    if _clip_workers:
+        return
+    with _clip_workers_lock:
+        if _clip_workers:
+            return
+        workers = [threading.Thread(target=_clip_worker, name=f"clip-worker-{i}", daemon=True)
+                   for i in range(CLIP_WORKERS)]
+        for t in workers:
+            t.start()
+        _clip_workers.extend(workers)
+
+# ---- trigger engine: per-stream, per-reaction cool-down that merges overlapping hot moments ----
+class TriggerEngine:
+    """
+    Decides what a threshold crossing turns into. Per (stream, reaction) it is
+    idle, or cooling down after a hot moment: the time range its clips cover and
+    the clip job it queued last.
+
+      idle     -> trigger: queue a clip job, start cooling for CLIP_COOLDOWN_SEC
+      cooling  -> trigger already covered by the moment: suppressed
+      cooling  -> trigger, job still queued: widen that job by the part the
+                  moment does not cover yet (merged), restart the cool-down
+      cooling  -> trigger, job already cutting/done, or the merge would pass
+                  CLIP_MAX_SECONDS: queue a follow-up job for that part
+      cooling  -> trigger that does not overlap the moment, or the job failed: as idle
+      cooling  -> cool-down over: idle
+
+    A sustained spike therefore yields one extended clip (plus follow-ups for
+    what comes after it) instead of a burst of overlapping ffmpeg runs.
+
+    Each (stream, reaction) decides under its own lock, so the job store write
+    behind one trigger never holds up triggers of other streams or reactions.
+    """
+
+    def __init__(self, cooldown_sec: float, max_clip_sec: float):
+        self.cooldown_sec = cooldown_sec
+        self.max_clip_sec = max_clip_sec
+        self._lock = threading.Lock()  # guards the dicts below, never held across a job update
+        self._key_locks = {}  # (stream_id, reaction_type) -> Lock
+        self._moments = {}  # (stream_id, reaction_type) -> {"job_id", "start", "end", "until"}
+        self._stats = {"queued": 0, "merged": 0, "follow_ups": 0, "suppressed": 0, "dropped": 0}
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _record(self, action: str, key=None, moment=None):
+        with self._lock:
+            self._stats[action] += 1
+            if moment is not None:
+                self._moments[key] = moment
+
+    def on_trigger(self, reaction_type: str, start_time: float, end_time: float, uniq: int,
+                   stream_id: str = DEFAULT_STREAM_ID):
+        """
+        Returns (action, job snapshot). action is queued (a new job or a follow-up), merged,
+        suppressed (already covered; job is the covering one) or dropped (clip queue full; job is None).
+        """
+        key = (stream_id, reaction_type)
+        now_ts = time.time()
+        with self._key_lock(key):
+            with self._lock:
+                moment = dict(self._moments.get(key) or {}) or None
+            if (moment is not None and now_ts < moment["until"]
+                    and start_time <= moment["end"] and end_time >= moment["start"]):
+                with CLIP_JOBS_LOCK:
+                    job = dict(CLIP_JOBS.get(moment["job_id"]) or {}) or None
+                if job is not None and job["status"] != "failed":
+                    return self._on_cooling(key, moment, job, start_time, end_time, uniq, now_ts)
+            job = enqueue_clip_job(start_time, end_time, reaction_type, uniq, stream_id)
+            if job is None:
+                self._record("dropped")
+                return "dropped", None
+            self._record("queued", key, {"job_id": job["id"], "start": start_time, "end": end_time,
+                                         "until": now_ts + self.cooldown_sec})
+            return "queued", job
+
+    def _on_cooling(self, key, moment, job, start_time: float, end_time: float, uniq: int, now_ts: float):
+        # only the part of the trigger the moment does not cover yet still needs clipping
+        if end_time > moment["end"]:
+            gap = (max(moment["end"], end_time - self.max_clip_sec), end_time)
+        elif start_time < moment["start"]:
+            gap = (start_time, min(moment["start"], start_time + self.max_clip_sec))
         else:
-            end_time = 0.5 * (times[mid - 1] + times[mid])
-        start_time = max(0.0, end_time - CLIP_BACK_SECONDS)
-        # Indicate a synchronous clip should be created by caller
-        return True, start_time, end_time, unique_count
-    return False, None, None, unique_count
+            self._record("suppressed")
+            return "suppressed", job
+        action = "merged"
+        updated = None
+        if max(job["end"], gap[1]) - min(job["start"], gap[0]) <= self.max_clip_sec:
+            updated = extend_clip_job(job["id"], gap[0], gap[1], uniq)
+        if updated is None:
+            # the job is already cutting (or done), or would grow too long
+            action = "queued"
+            updated = enqueue_clip_job(gap[0], gap[1], key[1], uniq, key[0])
+            if updated is None:
+                self._record("dropped")
+                return "dropped", None
+        self._record("merged" if action == "merged" else "follow_ups", key,
+                     {"job_id": updated["id"], "start": min(moment["start"], gap[0]),
+                      "end": max(moment["end"], gap[1]), "until": now_ts + self.cooldown_sec})
+        return action, updated
+
+    def reset(self, stream_id: str = DEFAULT_STREAM_ID):
+        """Forget cool-downs for a stream (its timeline restarted)."""
+        with self._lock:
+            for key in [k for k in self._moments if k[0] == stream_id]:
+                del self._moments[key]
+
+    def snapshot(self):
+        now_ts = time.time()
+        with self._lock:
+            cooling = {f"{s}/{r}": {**m, "remaining_sec": round(m["until"] - now_ts, 2)}
+                       for (s, r), m in self._moments.items() if m["until"] > now_ts}
+            return {"cooldown_sec": self.cooldown_sec, "max_clip_sec": self.max_clip_sec,
+                    "cooling": cooling, **self._stats}
+
+TRIGGERS = TriggerEngine(CLIP_COOLDOWN_SEC, CLIP_MAX_SECONDS)
+
+# ---- realtime channel: reactions in, counts and clip job updates out (WebSocket + SSE) ----
+def reaction_counts(stream):
+    return {r: stream.reactions.unique_count(r) for r in REACTION_TYPES}
+
+class RealtimeHub:
+    """
+    Push channel for players, replacing /clips and job polling. One asyncio loop in a
+    background thread runs the WebSocket server (WS_PORT) and a ticker that pushes the
+    window counts whenever they change; clip job updates are pushed as they happen.
+    WebSocket fan-out serialises each event once and hands it to broadcast(), which
+    writes to every connection without awaiting any of them, so one slow client
+    cannot hold up the rest. Reactions sent over the socket are coalesced and
+    ingested with record_many off the loop; while ingest is behind, at most
+    WS_INBOUND_MAX wait and the rest are dropped (the sender gets an error). SSE clients (/events) each hold a
+    server thread and a bounded queue; they suit a handful of consumers, not a
+    whole audience. Every client follows one stream (?stream=, the default stream
+    without it) and only gets that stream's counts and clip jobs.
+
+    The hub starts on the first request of each process (after a gunicorn fork),
+    and only the first process to bind WS_PORT serves WebSockets; the others keep
+    SSE. There is one hub per process and no fan-out between them, so a socket
+    only hears clip jobs queued in the process that owns the port: run the
+    realtime channel with a single worker (e.g. gunicorn -w 1 --threads N).
+    """
+
+    def __init__(self, ws_port: int, counts_interval: float, inbound_max: int):
+        self.ws_port = ws_port
+        self.counts_interval = counts_interval
+        self.inbound_max = inbound_max
+        self._loop = None
+        self._start_lock = threading.Lock()
+        self._ws_listening = False
+        self._ws_clients = {}  # stream id -> set of connections, only touched on the loop
+        self._sse_clients = {}  # queue -> stream id
+        self._sse_lock = threading.Lock()
+        self._counts = {}  # stream id -> last pushed counts
+        self._inbound = []  # (stream id, reaction), at most inbound_max while a drain is behind
+        self._inbound_dropped = 0
+        self._draining = False
+
+    def start(self):
+        """Start the loop thread (and WebSocket server) once; safe to call from anywhere."""
+        if self._loop is not None:
+            return
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            threading.Thread(target=self._loop.run_until_complete, args=(self._main(ready),),
+                             name="realtime", daemon=True).start()
+        ready.wait(5)
+
+    async def _main(self, ready: threading.Event):
+        asyncio.get_running_loop().create_task(self._tick_counts())
+        if self.ws_port:
+            try:
+                # no per-message compression: it costs tens of KB per connection
+                await serve(self._handle_ws, "0.0.0.0", self.ws_port, compression=None,
+                            max_size=256 * 1024, ping_interval=20, ping_timeout=20)
+                self._ws_listening = True
+                print(f"[RT] WebSocket channel on :{self.ws_port} (pid {os.getpid()})")
+            except OSError as e:
+                # e.g. another worker on this host already owns the port
+                print(f"[RT] WebSocket channel not started on :{self.ws_port}: {e}")
+        ready.set()
+        await asyncio.Event().wait()
+
+    def publish(self, event: dict, stream_id: str = DEFAULT_STREAM_ID):
+        """Push an event to every client following the stream. Thread-safe and non-blocking."""
+        message = json.dumps(event)
+        item = (event["type"], message)
+        with self._sse_lock:
+            subscribers = [q for q, s in self._sse_clients.items() if s == stream_id]
+        for q in subscribers:
+            try:
+                q.put_nowait(item)
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    q.put_nowait(item)
+                except (queue.Empty, queue.Full):
+                    pass
+        loop = self._loop
+        if loop is not None and self._ws_clients.get(stream_id):
+            loop.call_soon_threadsafe(self._broadcast, stream_id, message)
+
+    def _broadcast(self, stream_id: str, message: str):
+        broadcast(self._ws_clients.get(stream_id, ()), message)
+
+    def stats(self):
+        with self._sse_lock:
+            sse = len(self._sse_clients)
+        ws = sum(len(clients) for clients in list(self._ws_clients.values()))
+        return {"websocket_clients": ws, "sse_clients": sse, "ws_port": self.ws_port, "ws_listening": self._ws_listening,
+                "inbound_queued": len(self._inbound), "inbound_dropped": self._inbound_dropped}
+
+    def hello(self, stream_id: str = DEFAULT_STREAM_ID):
+        return {
+            "type": "hello",
+            "stream": stream_id,
+            "counts": self._counts.get(stream_id, {}),
+            "threshold": REACTION_THRESHOLD,
+            "window_sec": REACTION_WINDOW_SEC,
+        }
+
+    def subscribe(self, stream_id: str = DEFAULT_STREAM_ID):
+        self.start()
+        q = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        with self._sse_lock:
+            self._sse_clients[q] = stream_id
+        return q
+
+    def unsubscribe(self, q):
+        with self._sse_lock:
+            self._sse_clients.pop(q, None)
+
+    async def _tick_counts(self):
+        while True:
+            await asyncio.sleep(self.counts_interval)
+            with self._sse_lock:
+                followed = set(self._sse_clients.values())
+            followed.update(s for s, clients in self._ws_clients.items() if clients)
+            for stream_id in followed:
+                stream = STREAMS.get(stream_id)
+                if stream is None:
+                    continue
+                try:
+                    counts = await asyncio.to_thread(reaction_counts, stream)
+                except Exception as e:
+                    print("[RT] counts error:", e)
+                    continue
+                if counts != self._counts.get(stream_id):
+                    self._counts[stream_id] = counts
+                    self.publish({"type": "counts", "counts": counts}, stream_id)
+
+    async def _handle_ws(self, ws):
+        # reactions may omit user_id when the socket was opened with ?user_id=...
+        query = parse_qs(urlsplit(ws.request.path).query)
+        default_user = (query.get("user_id") or [""])[0]
+        stream_id = (query.get("stream") or [DEFAULT_STREAM_ID])[0]
+        if STREAMS.get(stream_id) is None:
+            await ws.send(json.dumps({"type": "error", "error": "Unknown stream"}))
+            return
+        clients = self._ws_clients.setdefault(stream_id, set())
+        clients.add(ws)
+        try:
+            await ws.send(json.dumps(self.hello(stream_id)))
+            async for raw in ws:
+                try:
+                    data = json.loads(raw)
+                except ValueError:
+                    await ws.send(json.dumps({"type": "error", "error": "invalid JSON"}))
+                    continue
+                items = data.get("events") if isinstance(data, dict) and "events" in data else [data]
+                if not isinstance(items, list):
+                    await ws.send(json.dumps({"type": "error", "error": "events array required"}))
+                    continue
+                rejected = dropped = 0
+                for item in items[:REACT_BATCH_MAX]:
+                    if isinstance(item, dict) and default_user:
+                        item.setdefault("user_id", default_user)
+                    try:
+                        event = _parse_reaction(item)
+                    except ValueError:
+                        rejected += 1
+                        continue
+                    if len(self._inbound) >= self.inbound_max:
+                        dropped += 1  # ingest is behind: shed load instead of buffering without bound
+                        continue
+                    self._inbound.append((stream_id, event))
+                rejected += max(0, len(items) - REACT_BATCH_MAX)
+                if rejected:
+                    await ws.send(json.dumps({"type": "error", "error": "invalid reactions skipped", "rejected": rejected}))
+                if dropped:
+                    self._inbound_dropped += dropped
+                    await ws.send(json.dumps({"type": "error", "error": "server busy, reactions dropped", "dropped": dropped}))
+                if self._inbound and not self._draining:
+                    self._draining = True
+                    asyncio.get_running_loop().create_task(self._drain_inbound())
+        except ConnectionClosed:
+            pass
+        finally:
+            clients.discard(ws)
+            if not clients and self._ws_clients.get(stream_id) is clients:
+                del self._ws_clients[stream_id]
+
+    async def _drain_inbound(self):
+        # reactions arriving while one batch is ingested form the next batch (one per stream)
+        try:
+            while self._inbound:
+                events, self._inbound = self._inbound, []
+                by_stream = {}
+                for stream_id, event in events:
+                    by_stream.setdefault(stream_id, []).append(event)
+                for stream_id, batch in by_stream.items():
+                    stream = STREAMS.get(stream_id)
+                    if stream is None:
+                        continue  # stopped while the reactions were queued
+                    try:
+                        await asyncio.to_thread(ingest_reactions, batch, stream)
+                    except Exception as e:
+                        print("[RT] ingest error:", e)
+        finally:
+            self._draining = False
+
+REALTIME = RealtimeHub(WS_PORT, REALTIME_COUNTS_INTERVAL_SEC, WS_INBOUND_MAX)
+
+@app.before_request
+def start_realtime():
+    # not at import: under gunicorn --preload the loop thread would not survive the fork
+    REALTIME.start()
+
+def _parse_reaction(data):
+    """(reaction_type, user_id, t) from a reaction payload; ValueError with a client-facing message."""
+    if not isinstance(data, dict):
+        raise ValueError("reaction must be an object")
+    reaction_type = str(data.get("type", "")).lower()
+    if reaction_type not in REACTION_TYPES:
+        raise ValueError("Invalid reaction type")
+    user_id = str(data.get("user_id") or "").strip()
+    if not user_id:
+        raise ValueError("user_id required")
+    try:
+        t = float(data.get("t"))
+        if not (t >= 0):
+            raise ValueError
+    except Exception:
+        raise ValueError("valid 't' (seconds) required")
+    return reaction_type, user_id, t
+
+def _queue_triggered_clip(reaction_type: str, start_time: float, end_time: float, uniq: int,
+                          stream_id: str = DEFAULT_STREAM_ID):
+    """
+    Hand a trigger to the trigger engine (window already reset under its lock).
+    Returns the response entry, or None if a job was needed but the queue is full.
+    """
+    action, job = TRIGGERS.on_trigger(reaction_type, start_time, end_time, uniq, stream_id=stream_id)
+    if action == "dropped":
+        print(f"[REACT] Clip queue full, dropped trigger for '{reaction_type}' t={end_time:.2f}")
+        return None
+    if action == "queued":
+        print(f"[REACT] Queued clip job {job['id']} for '{reaction_type}' t={end_time:.2f} (start {start_time:.2f})")
+    elif action == "merged":
+        print(f"[REACT] Merged '{reaction_type}' t={end_time:.2f} into clip job {job['id']} ({job['start']:.2f}-{job['end']:.2f})")
+    else:
+        print(f"[REACT] Suppressed '{reaction_type}' t={end_time:.2f}, already covered by clip job {job['id']}")
+    entry = {
+        "action": action,
+        "start": job["start"] if job else start_time,
+        "end": job["end"] if job else end_time,
+        "reaction": reaction_type,
+        "unique_in_window": uniq,
+    }
+    if job:
+        entry.update(job_id=job["id"], status=job["status"], status_url=f"/clips/jobs/{job['id']}")
+    return entry
+
+def ingest_reactions(events, stream):
+    """Record parsed reactions of a stream and queue a clip per trigger. Returns (queued jobs, counts, dropped triggers)."""
+    triggers, counts = stream.reactions.record_many(events)
+    jobs, dropped = [], 0
+    for reaction_type, start_time, end_time, uniq in triggers:
+        queued = _queue_triggered_clip(reaction_type, start_time, end_time, uniq, stream.id)
+        if queued is None:
+            dropped += 1
+        else:
+            jobs.append(queued)
+    return jobs, counts, dropped
 
 @app.route("/react", methods=["POST", "OPTIONS"])
 def react():
     # Handle preflight explicitly
     if request.method == "OPTIONS":
         return ("", 204)
+    stream = _request_stream()
+    if stream is None:
+        return jsonify({"error": "Unknown stream"}), 404
     try:
-        data = request.get_json() or {}
-        reaction_type = str(data.get("type", "")).lower()
-        if reaction_type not in REACTION_EVENTS:
-            return jsonify({"error": "Invalid reaction type"}), 400
-        user_id = str(data.get("user_id") or "").strip()
-        if not user_id:
-            return jsonify({"error": "user_id required"}), 400
         try:
-            t = float(data.get("t"))
-            if not (t >= 0):
-                raise ValueError
-        except Exception:
-            return jsonify({"error": "valid 't' (seconds) required"}), 400
+            reaction_type, user_id, t = _parse_reaction(request.get_json() or {})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        now_ts = time.time()
-        REACTION_EVENTS[reaction_type].append({
-            "time": now_ts,
-            "user_id": user_id,
-            "t": t,
-        })
-        triggered, start_time, end_time, uniq = _maybe_trigger_clip(reaction_type)
+        triggered, start_time, end_time, uniq = stream.reactions.record(reaction_type, user_id, t)
         if triggered:
-            # Create the clip synchronously and upload it to storage
-            try:
-                duration = max(0.1, end_time - start_time)
-                clip_filename = f"clip_{uuid.uuid4().hex[:8]}_{int(start_time)}_{int(end_time)}.mp4"
-                clip_path = os.path.join(CLIPS_DIR, clip_filename)
-                command = [
-                    "ffmpeg",
-                    "-ss", str(start_time),
-                    "-i", CURRENT_VIDEO_SOURCE,
-                    "-t", str(duration),
-                    "-c:v", "libx264",
-                    "-c:a", "aac",
-                    "-preset", "ultrafast",
-                    "-y",
-                    clip_path
-                ]
-                result = subprocess.run(command, capture_output=True, text=True)
-                if result.returncode != 0:
-                    print("[REACT CLIP] ffmpeg error:", result.stderr)
-                    return jsonify({"error": "Clip creation failed"}), 500
-                # Upload to Supabase Storage under clips/
-                remote_path = f"clips/{os.path.basename(clip_path)}"
-                try:
-                    upload_to_supabase(clip_path, remote_path, content_type="video/mp4")
-                except Exception as up_err:
-                    print("[REACT CLIP] upload error:", up_err)
-                    return jsonify({"error": "Clip upload failed"}), 500
-                public_url = None
-                try:
-                    # get_public_url returns a dict in some client versions; handle both cases
-                    res = supabase.storage.from_(SUPABASE_BUCKET).get_public_url(remote_path)
-                    public_url = res.get("publicUrl") if isinstance(res, dict) else res
-                except Exception:
-                    public_url = None
-                # Reset reaction window to avoid duplicate triggers
-                REACTION_EVENTS[reaction_type] = []
-                print(f"[REACT] Stored clip for '{reaction_type}' t={end_time:.2f} (start {start_time:.2f}) -> {remote_path}")
-                return jsonify({
-                    "ok": True,
-                    "stored": True,
-                    "bucket": SUPABASE_BUCKET,
-                    "path": remote_path,
-                    "public_url": public_url,
-                    "start": start_time,
-                    "end": end_time,
-                    "reaction": reaction_type,
-                })
-            except Exception as e:
-                return jsonify({"error": str(e)}), 500
+            queued = _queue_triggered_clip(reaction_type, start_time, end_time, uniq, stream.id)
+            if queued is None:
+                return jsonify({"error": "Clip queue full, try again later"}), 503
+            if queued["action"] == "suppressed":
+                return jsonify({"ok": True, "queued": False, **queued})
+            return jsonify({"ok": True, "queued": True, **queued}), 202
         # Not yet at threshold: return JSON status
         return jsonify({
             "ok": True,
@@ -588,10 +4145,111 @@ def react():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/react/batch", methods=["POST", "OPTIONS"])
+def react_batch():
+    """
+    Many reactions in one request: {"events": [{type, user_id, t}, ...]} (or a bare
+    array), as sent by clients that coalesce taps. Invalid events are skipped and
+    counted in "rejected"; the rest are ingested in one pass per reaction type.
+    """
+    if request.method == "OPTIONS":
+        return ("", 204)
+    stream = _request_stream()
+    if stream is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    try:
+        data = request.get_json()
+        events = data.get("events") if isinstance(data, dict) else data
+        if not isinstance(events, list):
+            return jsonify({"error": "events array required"}), 400
+        if len(events) > REACT_BATCH_MAX:
+            return jsonify({"error": f"at most {REACT_BATCH_MAX} events per batch"}), 413
+        parsed, rejected = [], 0
+        for event in events:
+            try:
+                parsed.append(_parse_reaction(event))
+            except ValueError:
+                rejected += 1
+
+        jobs, counts, dropped = ingest_reactions(parsed, stream)
+        body = {
+            "ok": True,
+            "accepted": len(parsed),
+            "rejected": rejected,
+            "unique_in_window": counts,
+            "window_sec": REACTION_WINDOW_SEC,
+            "threshold": REACTION_THRESHOLD,
+            "jobs": jobs,
+        }
+        if dropped:
+            body["dropped_triggers"] = dropped
+            if not jobs:
+                body["error"] = "Clip queue full, try again later"
+                return jsonify(body), 503
+        return jsonify(body), 202 if any(j["action"] != "suppressed" for j in jobs) else 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/events", methods=["GET"])
+def events_stream():
+    """Server-Sent Events: the same counts / clip_job events as the WebSocket channel (receive only)."""
+    stream = _request_stream()
+    if stream is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    q = REALTIME.subscribe(stream.id)
+
+    def generate():
+        try:
+            yield f"event: hello\ndata: {json.dumps(REALTIME.hello(stream.id))}\n\n"
+            while True:
+                try:
+                    event_type, message = q.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event_type}\ndata: {message}\n\n"
+        finally:
+            REALTIME.unsubscribe(q)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/metrics/realtime", methods=["GET"])
+def realtime_metrics():
+    return jsonify(REALTIME.stats())
+
+@app.route("/metrics/triggers", methods=["GET"])
+def trigger_metrics():
+    return jsonify(TRIGGERS.snapshot())
+
+@app.route("/clips/jobs/<job_id>", methods=["GET"])
+def clip_job_status(job_id):
+    with CLIP_JOBS_LOCK:
+        job = CLIP_JOBS.get(job_id)
+        job = dict(job) if job else None
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify({"ok": True, "job": job, "queue_depth": CLIP_JOB_QUEUE.qsize()})
+
+@app.route("/metrics/uploads", methods=["GET"])
+def upload_metrics():
+    return jsonify({"workers": UPLOAD_WORKERS, "uploads": UPLOAD_STATS.snapshot()})
+
+@app.route("/metrics/cache", methods=["GET"])
+def cache_metrics():
+    return jsonify({"live": LIVE_CACHE.stats()})
+
 @app.route("/stream/<path:filename>")
 def stream_files(filename):
+    stream, rel = _stream_for_path(filename)
+    if stream is None or not rel:
+        return jsonify({"error": "Not found"}), 404
+    if LL_HLS:
+        held, _ = _ll_hold(stream, rel, published=False)
+        if held is not None:
+            return held
     # always ensure the browser gets the latest playlist/segments
-    response = send_from_directory(HLS_OUTPUT_DIR, filename)
+    response = send_from_directory(stream.out_dir, rel)
     response.cache_control.no_cache = True
     response.cache_control.no_store = True
     response.cache_control.must_revalidate = True
@@ -599,6 +4257,7 @@ def stream_files(filename):
 
 # ---- main ----
 if __name__ == "__main__":
+    REALTIME.start()
     print("[MAIN] Starting FFmpeg streaming...")
     start_transcoding(VIDEO_SOURCE)
     # give ffmpeg a second to produce initial files
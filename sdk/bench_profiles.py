@@ -0,0 +1,165 @@
+# bench_profiles.py
+# Sweep stream profiles (segment length x keyframe cadence) over the same source and report the
+# tradeoff for each one:
+#   - clip precision: how far before a random trigger time a stream-copy clip has to start
+#     (the distance back to the previous keyframe, measured on the encoded output)
+#   - encode CPU: ffmpeg CPU seconds per second of media (~cores per live stream) and bitrate
+#   - upload requests: storage requests per second of media the uploader makes for this output
+# Encodes run as fast as possible (no -re) with the same ffmpeg arguments start_transcoding uses,
+# so ABR_LADDER / LL_HLS from the environment are honoured. Needs ffmpeg and ffprobe.
+#
+#   python bench_profiles.py --source test.mp4 --seconds 60
+#   python bench_profiles.py --segments 2,4,6,20 --keyframes 1,2,segment --no-scenecut
+#   LL_HLS=1 python bench_profiles.py --segments 2,4 --keyframes 0.2,0.4,1
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+import app
+
+
+def parse_list(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def child_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def probe_video_keyframes(playlist):
+    """(keyframe pts list, last pts) of the first video stream, read through the playlist (no decode)."""
+    command = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "json",
+        playlist,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {playlist}: {result.stderr}")
+    packets = [p for p in json.loads(result.stdout or "{}").get("packets", []) if p.get("pts_time") not in (None, "N/A")]
+    keyframes = sorted(float(p["pts_time"]) for p in packets if "K" in p.get("flags", ""))
+    last = max((float(p["pts_time"]) for p in packets), default=0.0)
+    return keyframes, last
+
+
+def clip_start_errors(keyframes, last, samples, rng):
+    """Seconds between random trigger times and the keyframe a stream-copy clip starts on."""
+    errors = []
+    for _ in range(samples):
+        t = rng.uniform(keyframes[0], last)
+        # newest keyframe at/before t
+        lo, hi = 0, len(keyframes) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if keyframes[mid] <= t:
+                lo = mid
+            else:
+                hi = mid - 1
+        errors.append(t - keyframes[lo])
+    return sorted(errors)
+
+
+def keep_all_segments(args):
+    """The live arguments delete old segments; for the measurements keep and list every one."""
+    args = list(args)
+    args[args.index("-hls_list_size") + 1] = "0"
+    i = args.index("-hls_flags") + 1
+    args[i] = "+".join(f for f in args[i].split("+") if f != "delete_segments")
+    return args
+
+
+def media_files(out_dir):
+    files = []
+    for root, _, names in os.walk(out_dir):
+        files += [os.path.join(root, n) for n in names if n.endswith((".ts", ".m4s"))]
+    return files
+
+
+def run_profile(profile, args, rng):
+    out_dir = tempfile.mkdtemp(prefix="bench_profile_")
+    try:
+        for variant in app.ABR_VARIANTS:
+            os.makedirs(os.path.join(out_dir, variant), exist_ok=True)
+        command = ["ffmpeg", "-hide_banner", "-nostats", "-loglevel", "error", "-y", "-i", args.source,
+                   "-t", str(args.seconds)] + keep_all_segments(app.transcode_args(profile, "bench", out_dir))
+        cpu_before, started = child_cpu_seconds(), time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True)
+        wall, cpu = time.perf_counter() - started, child_cpu_seconds() - cpu_before
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-500:]}")
+
+        playlist = os.path.join(out_dir, app.LL_PARTS_PLAYLIST if app.LL_HLS else app.MEDIA_PLAYLISTS[0])
+        keyframes, last = probe_video_keyframes(playlist)
+        if not keyframes:
+            raise RuntimeError("no keyframes in the output")
+        errors = clip_start_errors(keyframes, last, args.samples, rng)
+
+        files = media_files(out_dir)
+        media_seconds = max(last, 1e-6)
+        # uploader: one request per media file plus one playlist publish per file it adds (per media playlist);
+        # in LL-HLS mode the segments built from parts are uploaded as well
+        requests = 2 * len(files)
+        if app.LL_HLS:
+            requests += len(files) // profile.parts_per_segment
+        return {
+            "clip_err_mean": sum(errors) / len(errors),
+            "clip_err_p95": errors[int(len(errors) * 0.95)],
+            "clip_err_max": errors[-1],
+            "cpu_per_sec": cpu / media_seconds,
+            "speed": media_seconds / wall,
+            "kbps": sum(os.path.getsize(f) for f in files) * 8 / 1000 / media_seconds,
+            "req_per_sec": requests / media_seconds,
+        }
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream profile sweep: clip precision vs CPU vs upload requests")
+    parser.add_argument("--source", default=app.VIDEO_SOURCE)
+    parser.add_argument("--seconds", type=float, default=60.0, help="media seconds encoded per profile")
+    parser.add_argument("--segments", default="2,4,6,10,20", help="segment lengths (s)")
+    parser.add_argument("--keyframes", default="1,2,segment", help="keyframe cadences (s); 'segment' = segment length")
+    parser.add_argument("--no-scenecut", action="store_true", help="disable scene-change keyframes")
+    parser.add_argument("--samples", type=int, default=2000, help="random trigger times per profile")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    mode = "ll-hls" if app.LL_HLS else (f"abr {','.join(app.ABR_VARIANTS)}" if app.ABR_VARIANTS else "single")
+    print(f"[BENCH] source={args.source} seconds={args.seconds} mode={mode} scenecut={not args.no_scenecut}")
+    print(f"[BENCH] {'segment':>7} {'keyframe':>8} {'gop':>5} | {'clip err mean/p95/max (s)':>26} | "
+          f"{'cpu/s':>6} {'speed':>6} {'kbps':>7} | {'req/s':>6}")
+    for seg in parse_list(args.segments):
+        for kf in parse_list(args.keyframes):
+            try:
+                profile = app.DEFAULT_STREAM_PROFILE.replace({
+                    "segment_sec": float(seg),
+                    "keyframe_sec": float(seg if kf == "segment" else kf),
+                    "scenecut": not args.no_scenecut,
+                })
+            except ValueError as e:
+                print(f"[BENCH] {seg:>7} {kf:>8} skipped: {e}")
+                continue
+            try:
+                r = run_profile(profile, args, rng)
+            except (RuntimeError, OSError) as e:
+                print(f"[BENCH] {seg:>7} {kf:>8} failed: {e}")
+                continue
+            errs = f"{r['clip_err_mean']:.2f}/{r['clip_err_p95']:.2f}/{r['clip_err_max']:.2f}"
+            print(f"[BENCH] {profile.segment_sec:>7g} {profile.keyframe_sec:>8g} {profile.gop_frames:>5} | "
+                  f"{errs:>26} | {r['cpu_per_sec']:>6.2f} {r['speed']:>5.1f}x {r['kbps']:>7.0f} | "
+                  f"{r['req_per_sec']:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# bench_reactions.py
+# Stress test for the reaction aggregator: many threads record reactions at a target
+# rate and the totals are checked afterwards. Every reaction comes from a distinct user,
+# so (users counted by triggers) + (users still in the windows) must equal what was sent,
+# and with the exact counter every trigger must fire at exactly the threshold. The shm and
+# redis backends count approximately, so for them the error is reported instead.
+#
+#   python bench_reactions.py --rate 10000 --seconds 5 --threads 16
+#   REACTION_COUNTER=hll python bench_reactions.py
+#   python bench_reactions.py --backend shm
+#   python bench_reactions.py --backend redis --redis-url memory://
+import argparse
+import os
+import threading
+import time
+
+import app
+
+
+def worker(agg, types, thread_no, per_thread_rate, deadline, results):
+    sent = {r: 0 for r in types}
+    triggers = {r: [] for r in types}
+    latencies = []
+    interval = 1.0 / per_thread_rate
+    next_at = time.perf_counter()
+    i = 0
+    while time.perf_counter() < deadline:
+        reaction_type = types[i % len(types)]
+        user_id = f"u{thread_no}-{i}"
+        t = 60.0 + (i % 50) * 0.1
+        started = time.perf_counter()
+        triggered, start_time, end_time, uniq = agg.record(reaction_type, user_id, t)
+        latencies.append(time.perf_counter() - started)
+        sent[reaction_type] += 1
+        if triggered:
+            triggers[reaction_type].append(uniq)
+        i += 1
+        next_at += interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    results[thread_no] = (sent, triggers, latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reaction aggregator stress benchmark")
+    parser.add_argument("--rate", type=int, default=10000, help="total reactions per second")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--threshold", type=int, default=1000)
+    parser.add_argument("--backend", choices=("memory", "shm", "redis"), default="memory")
+    parser.add_argument("--redis-url", default="memory://")
+    args = parser.parse_args()
+
+    # window long enough that nothing expires during the run, so counts are exact
+    window_sec = args.seconds + 60
+    exact = False
+    if args.backend == "shm":
+        agg = app.SharedMemoryReactions(f"bench_reactions_{os.getpid()}", threshold=args.threshold,
+                                        window_sec=window_sec)
+    elif args.backend == "redis":
+        agg = app.RedisReactions(app._redis_client(args.redis_url), threshold=args.threshold,
+                                 window_sec=window_sec, prefix=f"bench:{os.getpid()}:")
+    else:
+        if app.REACTION_COUNTER == "hll":
+            factory = lambda: app.HLLReactionWindow(window_sec, app.REACTION_BUCKET_SEC)
+        else:
+            factory = lambda: app.ReactionWindow(window_sec, app.REACTION_BUCKET_SEC)
+            exact = True
+        agg = app.ReactionAggregator(app.REACTION_TYPES, threshold=args.threshold, window_factory=factory)
+    types = list(app.REACTION_TYPES)
+
+    results = {}
+    deadline = time.perf_counter() + args.seconds
+    threads = [
+        threading.Thread(target=worker, args=(agg, types, n, args.rate / args.threads, deadline, results))
+        for n in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(l for _, _, lat in results.values() for l in lat)
+    total = len(latencies)
+    print(f"[BENCH] backend={args.backend} counter={app.REACTION_COUNTER if args.backend == 'memory' else 'hll'} threads={args.threads} threshold={args.threshold}")
+    print(f"[BENCH] sent {total} reactions in {elapsed:.2f}s ({total / elapsed:.0f}/s, target {args.rate}/s)")
+    if latencies:
+        p50 = latencies[len(latencies) // 2] * 1e6
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6
+        print(f"[BENCH] record() latency p50={p50:.1f}us p99={p99:.1f}us")
+
+    ok = True
+    for r in types:
+        sent = sum(res[0][r] for res in results.values())
+        fired = [u for res in results.values() for u in res[1][r]]
+        remaining = agg.unique_count(r)
+        counted = sum(fired) + remaining
+        line = f"[BENCH] {r}: sent={sent} triggers={len(fired)} remaining={remaining} counted={counted}"
+        if not exact:
+            err = (counted - sent) / sent if sent else 0.0
+            print(f"{line} error={err:+.2%}")
+        else:
+            match = counted == sent and all(u == args.threshold for u in fired)
+            ok = ok and match
+            print(f"{line} {'OK' if match else 'MISMATCH'}")
+    if args.backend == "shm":
+        agg.destroy()
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
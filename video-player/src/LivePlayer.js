@@ -5,8 +5,23 @@ const LivePlayer = () => {
   const videoRef = useRef(null);
   const hlsRef = useRef(null);
   const apiBase = process.env.REACT_APP_API_BASE || "http://localhost:5001";
+  // Channel to play (POST /streams id); the default stream when unset
+  const streamId = process.env.REACT_APP_STREAM_ID || "";
+  const streamQuery = streamId ? `?stream=${encodeURIComponent(streamId)}` : "";
   // Stream via backend proxy to Supabase storage
-  const streamURL = `${apiBase}/live/stream.m3u8`;
+  const streamURL = streamId
+    ? `${apiBase}/live/streams/${encodeURIComponent(streamId)}/stream.m3u8`
+    : `${apiBase}/live/stream.m3u8`;
+  // Taps are queued and sent to /react/batch at most once per interval
+  const reactFlushMs = Number(process.env.REACT_APP_REACT_FLUSH_MS) || 250;
+  // Realtime channel (reactions in, counts and clip updates out); defaults to the API host on port 5002
+  const wsURL = process.env.REACT_APP_WS_URL || (() => {
+    const url = new URL(apiBase);
+    url.protocol = url.protocol === "https:" ? "wss:" : "ws:";
+    url.port = "5002";
+    url.pathname = "/";
+    return url.toString();
+  })();
 
   // Player State
   const [error,] = useState(null);
@@ -15,6 +30,7 @@ const LivePlayer = () => {
   // Clip State
   const [clipping, setClipping] = useState(false);
   const [clipMessage, setClipMessage] = useState("");
+  const [hotMoment, setHotMoment] = useState("");
 
   const [userId] = useState(() => {
     try {
@@ -30,32 +46,8 @@ const LivePlayer = () => {
   const [heartCount, setHeartCount] = useState(0);
   const [dislikeCount, setDislikeCount] = useState(0);
   const [clips, setClips] = useState([]);
-
-  const maybeDownloadFile = async (res) => {
-    const disposition = res.headers.get('Content-Disposition') || '';
-    const ctype = (res.headers.get('Content-Type') || '').toLowerCase();
-    const isAttachment = disposition.includes('attachment');
-    const isMedia = ctype.includes('application/octet-stream') || ctype.includes('video/mp4');
-    if (isAttachment || isMedia) {
-      const blob = await res.blob();
-      const url = window.URL.createObjectURL(blob);
-      const a = document.createElement('a');
-      a.href = url;
-      // try extract filename from Content-Disposition
-      let filename = 'clip.mp4';
-      const match = /filename\*=UTF-8''([^;]+)|filename="?([^";]+)"?/i.exec(disposition);
-      if (match) {
-        filename = decodeURIComponent(match[1] || match[2]);
-      }
-      a.download = filename;
-      document.body.appendChild(a);
-      a.click();
-      document.body.removeChild(a);
-      window.URL.revokeObjectURL(url);
-      return true;
-    }
-    return false;
-  };
+  const pendingReactionsRef = useRef([]);
+  const wsRef = useRef(null);
 
   const fetchClips = async () => {
     try {
@@ -66,6 +58,23 @@ const LivePlayer = () => {
     } catch (_) {}
   };
 
+  // Poll a queued clip job (/clips/jobs/<id>) until it is ready or failed
+  const pollClipJob = async (jobId, attempt = 0) => {
+    if (!jobId || attempt > 60) return;
+    try {
+      const res = await fetch(`${apiBase}/clips/jobs/${jobId}`);
+      if (!res.ok) return;
+      const data = await res.json();
+      const status = data.job && data.job.status;
+      if (status === 'ready') {
+        fetchClips();
+        return;
+      }
+      if (status === 'failed') return;
+    } catch (_) {}
+    setTimeout(() => pollClipJob(jobId, attempt + 1), 1000);
+  };
+
   // Video Management State
   const [videos, setVideos] = useState([]);
   const [currentVideo, setCurrentVideo] = useState("");
@@ -103,6 +112,10 @@ const LivePlayer = () => {
         const hls = new Hls({
           enableWorker: true,
           debug: false,
+          // with an ABR ladder the playlist is a master: never fetch a rendition taller than the player
+          capLevelToPlayerSize: true,
+          // LL-HLS (LL_HLS=1 on the server): load parts and use blocking playlist reloads
+          lowLatencyMode: true,
         });
 
         hlsRef.current = hls;
@@ -154,7 +167,7 @@ const LivePlayer = () => {
       setClipping(true);
       setClipMessage(`Creating clip from ${Math.floor(clipStartTime)}s to ${Math.floor(clipEndTime)}s...`);
 
-      const response = await fetch(`${apiBase}/clip`, {
+      const response = await fetch(`${apiBase}/clip${streamQuery}`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -240,48 +253,89 @@ const LivePlayer = () => {
     }
   };
 
-  const handleHeart = async () => {
+  const queueReaction = (type) => {
     const video = videoRef.current;
     if (!video) return;
-    try {
-      const t = Number.isFinite(video.duration) ? video.currentTime : video.currentTime;
-      const res = await fetch(`${apiBase}/react`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ type: 'heart', user_id: userId, t })
-      });
-      if (!res.ok) return;
-      const downloaded = await maybeDownloadFile(res.clone());
-      if (downloaded) return;
-      const data = await res.json();
-      setHeartCount(data.unique_in_window ?? 0);
-      if (data.stored) {
-        fetchClips();
-      }
-    } catch (_) {}
+    pendingReactionsRef.current.push({ type, user_id: userId, t: video.currentTime });
   };
 
-  const handleDislike = async () => {
-    const video = videoRef.current;
-    if (!video) return;
+  // Send queued taps over the socket, or in one /react/batch request when it is down
+  const flushReactions = async (keepalive = false) => {
+    const events = pendingReactionsRef.current;
+    if (!events.length) return;
+    pendingReactionsRef.current = [];
+    const ws = wsRef.current;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({ events }));
+      return;
+    }
     try {
-      const t = Number.isFinite(video.duration) ? video.currentTime : video.currentTime;
-      const res = await fetch(`${apiBase}/react`, {
+      const res = await fetch(`${apiBase}/react/batch${streamQuery}`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ type: 'dislike', user_id: userId, t })
+        body: JSON.stringify({ events }),
+        keepalive
       });
-      if (!res.ok) return;
-      const downloaded = await maybeDownloadFile(res.clone());
-      if (downloaded) return;
       const data = await res.json();
-      setDislikeCount(data.unique_in_window ?? 0);
-      if (data.stored) {
-        fetchClips();
-      }
+      applyCounts(data.unique_in_window);
+      (data.jobs || []).filter((job) => job.action !== 'suppressed').forEach((job) => pollClipJob(job.job_id));
     } catch (_) {}
   };
 
+  useEffect(() => {
+    const timer = setInterval(() => flushReactions(), reactFlushMs);
+    return () => {
+      clearInterval(timer);
+      flushReactions(true);
+    };
+    // eslint-disable-next-line
+  }, []);
+
+  const applyCounts = (counts = {}) => {
+    if (counts.heart !== undefined) setHeartCount(counts.heart);
+    if (counts.dislike !== undefined) setDislikeCount(counts.dislike);
+  };
+
+  // Pushed counts and clip job updates replace /clips and job polling while connected
+  useEffect(() => {
+    let closed = false;
+    let retry = 0;
+    let reconnectTimer = null;
+    const connect = () => {
+      const ws = new WebSocket(`${wsURL}?user_id=${encodeURIComponent(userId)}${streamId ? `&stream=${encodeURIComponent(streamId)}` : ""}`);
+      wsRef.current = ws;
+      ws.onopen = () => { retry = 0; };
+      ws.onmessage = (msg) => {
+        let data;
+        try { data = JSON.parse(msg.data); } catch (_) { return; }
+        if (data.type === 'hello' || data.type === 'counts') {
+          applyCounts(data.counts);
+        } else if (data.type === 'clip_job' && data.job && data.job.status === 'ready') {
+          fetchClips();
+          setHotMoment('🔥 Hot moment captured!');
+          setTimeout(() => setHotMoment(''), 3000);
+        }
+      };
+      ws.onclose = () => {
+        if (wsRef.current === ws) wsRef.current = null;
+        if (closed) return;
+        retry += 1;
+        reconnectTimer = setTimeout(connect, Math.min(30000, 1000 * 2 ** Math.min(retry, 5)));
+      };
+    };
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
+      if (wsRef.current) wsRef.current.close();
+    };
+    // eslint-disable-next-line
+  }, []);
+
+  const handleHeart = () => queueReaction('heart');
+
+  const handleDislike = () => queueReaction('dislike');
+
   const handleUpload = async (e) => {
     const file = e.target.files[0];
     if (!file) return;
@@ -316,10 +370,10 @@ const LivePlayer = () => {
 
     try {
       setStatus("Switching stream...");
-      const response = await fetch(`${apiBase}/start_stream`, {
+      const response = await fetch(streamId ? `${apiBase}/streams` : `${apiBase}/start_stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ filename }),
+        body: JSON.stringify(streamId ? { id: streamId, source: filename } : { filename }),
       });
 
       if (response.ok) {
@@ -376,6 +430,12 @@ const LivePlayer = () => {
       {status && <p style={{ color: "#666", fontSize: "14px" }}>Status: {status}</p>}
       {error && <p style={{ color: "red", fontSize: "14px" }}>⚠️ {error}</p>}
 
+      {hotMoment && (
+        <p style={{ color: "#e91e63", fontSize: "14px", fontWeight: "bold" }}>
+          {hotMoment}
+        </p>
+      )}
+
       {clipping && (
         <p style={{ color: "#4CAF50", fontSize: "14px", fontWeight: "bold" }}>
           🎬 {clipMessage}